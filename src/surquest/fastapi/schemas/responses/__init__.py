@@ -1,3 +1,15 @@
 from .info import InfoSuccess, InfoWarning, InfoError
+from .metadata import Metadata, CursorMetadata
 from .message import Message
-from .responses import Success, Warnings, Errors, Response, Responses
\ No newline at end of file
+from .encoder import Encoder
+from .streaming import EnvelopeStreamingResponse
+from .responses import (
+    Success,
+    Warnings,
+    Errors,
+    CursorSuccess,
+    CursorWarnings,
+    Response,
+    Responses,
+    EncodedJSONResponse
+)
\ No newline at end of file
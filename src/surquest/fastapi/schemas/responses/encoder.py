@@ -0,0 +1,175 @@
+import os
+import json
+import enum
+import uuid
+import decimal
+import dataclasses
+import datetime as dt
+from collections.abc import Mapping
+from pydantic import BaseModel
+from fastapi.encoders import jsonable_encoder
+
+try:
+    from pydantic_core import to_jsonable_python
+except ImportError:  # pragma: no cover (pydantic v1)
+    to_jsonable_python = jsonable_encoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:  # pragma: no cover
+    msgspec = None
+
+
+class Encoder(object):
+    """JSON encoder shared by the responses and the log formatter
+
+    The backend is selected by `JSON_ENCODER` environment variable
+    (`auto`, `json`, `orjson` or `msgspec`) or by `Encoder.set_backend()`.
+    The `auto` mode uses orjson or msgspec when installed and falls back
+    to the standard library json module otherwise.
+
+    The output is compact UTF-8 JSON as produced by Starlette's `JSONResponse`.
+    """
+
+    BACKENDS = ("json", "orjson", "msgspec")
+
+    backend = "json"
+
+    _msgspec_encoders = {}
+
+    @classmethod
+    def set_backend(cls, backend: str = "auto"):
+        """Select the backend used to serialize the objects
+
+        :param backend: `auto`, `json`, `orjson` or `msgspec`
+        :return: name of the selected backend
+        """
+
+        if backend == "auto":
+
+            backend = "json"
+
+            if orjson is not None:
+                backend = "orjson"
+            elif msgspec is not None:
+                backend = "msgspec"
+
+        if backend not in cls.BACKENDS:
+            raise ValueError(F"Unknown JSON encoder backend: `{backend}`")
+
+        if backend == "orjson" and orjson is None:
+            raise ImportError("Backend `orjson` requires the orjson package")
+
+        if backend == "msgspec" and msgspec is None:
+            raise ImportError("Backend `msgspec` requires the msgspec package")
+
+        cls.backend = backend
+
+        return backend
+
+    @staticmethod
+    def default(obj):
+        """Converts objects not supported by the backends the same way
+        as FastAPI's `jsonable_encoder` does (unknown objects are converted
+        to string)"""
+
+        if isinstance(obj, BaseModel):
+            return jsonable_encoder(obj)
+
+        if isinstance(obj, enum.Enum):
+            return obj.value
+
+        if isinstance(obj, (dt.datetime, dt.date, dt.time)):
+            return obj.isoformat()
+
+        if isinstance(obj, dt.timedelta):
+            return obj.total_seconds()
+
+        if isinstance(obj, decimal.Decimal):
+            return int(obj) if obj.as_tuple().exponent >= 0 else float(obj)
+
+        if isinstance(obj, (set, frozenset, tuple)):
+            return list(obj)
+
+        if isinstance(obj, bytes):
+            return obj.decode("utf-8", errors="replace")
+
+        if isinstance(obj, uuid.UUID):
+            return str(obj)
+
+        if dataclasses.is_dataclass(obj) and not isinstance(obj, type):
+            return dataclasses.asdict(obj)
+
+        if isinstance(obj, Mapping):
+            return dict(obj)
+
+        return str(obj)
+
+    @classmethod
+    def dumps(cls, obj, default=None, passthrough=False) -> bytes:
+        """Serialize object to JSON bytes
+
+        :param obj: object to serialize
+        :param default: function converting unsupported objects
+            (defaults to `Encoder.default`)
+        :param passthrough: pass also datetime objects and dataclasses
+            to `default` instead of serializing them natively (orjson only)
+        :return: JSON encoded object
+        """
+
+        default = default or cls.default
+
+        if cls.backend == "orjson":
+
+            option = orjson.OPT_NON_STR_KEYS
+
+            if passthrough:
+                option |= orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+            try:
+                return orjson.dumps(obj, default=default, option=option)
+            except TypeError:
+                pass  # e.g. integers exceeding 64 bits, use json module
+
+        elif cls.backend == "msgspec":
+
+            encoder = cls._msgspec_encoders.get(default)
+
+            if encoder is None:
+                encoder = cls._msgspec_encoders[default] = msgspec.json.Encoder(enc_hook=default)
+
+            try:
+                return encoder.encode(obj)
+            except (TypeError, msgspec.EncodeError):
+                pass
+
+        return json.dumps(
+            obj,
+            default=default,
+            ensure_ascii=False,
+            allow_nan=False,
+            indent=None,
+            separators=(",", ":"),
+        ).encode("utf-8")
+
+    @classmethod
+    def dumps_data(cls, obj) -> bytes:
+        """Serialize object exactly as pydantic serializes `Any` field
+        in JSON mode (i.e. as `jsonable_encoder` serializes response model)
+        without building and validating the model"""
+
+        return cls.dumps(obj, default=to_jsonable_python, passthrough=True)
+
+    @classmethod
+    def dumps_str(cls, obj, default=None) -> str:
+        """Serialize object to JSON string"""
+
+        return cls.dumps(obj, default=default).decode("utf-8")
+
+
+Encoder.set_backend(os.getenv("JSON_ENCODER", "auto"))
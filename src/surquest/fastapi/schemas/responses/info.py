@@ -1,21 +1,29 @@
 from .base import Base
-from typing import List, Optional
+from typing import List, Optional, Union
 from .status import Status
 from .message import Message
-from .metadata import Metadata
+from .metadata import Metadata, CursorMetadata
 
 
 class InfoSuccess(Base):
     status: str = Status.success
-    metadata: Optional[Metadata] = None
+    metadata: Optional[Union[Metadata, CursorMetadata]] = None
 
 
 class InfoWarning(Base):
     status: str = Status.warning
-    metadata: Optional[Metadata] = None
+    metadata: Optional[Union[Metadata, CursorMetadata]] = None
     warnings: List[Message] = []
 
 
+class InfoCursorSuccess(InfoSuccess):
+    metadata: Optional[CursorMetadata] = None
+
+
+class InfoCursorWarning(InfoWarning):
+    metadata: Optional[CursorMetadata] = None
+
+
 class InfoError(Base):
     status: str = Status.error
     warnings: Optional[List[Message]] = None
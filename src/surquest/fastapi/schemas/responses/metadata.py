@@ -1,4 +1,5 @@
 from pydantic import Field
+from typing import Optional
 from .base import Base
 
 class Metadata(Base):
@@ -27,10 +28,53 @@ class Metadata(Base):
         ge=0,
     )
 
-    total: int = Field(
+    total: Optional[int] = Field(
+        default=None,
+        title="Total records",
+        description="Total number of records in the database (null if not counted)",
+        example=18301,
+        ge=0,
+    )
+
+
+class CursorMetadata(Base):
+    """Metadata of the keyset (cursor) pagination, the next page is requested
+    with the `next_cursor` (see `surquest.fastapi.utils.cursor.Cursor`)"""
+
+    page_size: int = Field(
+        default=0,
+        title="Page size",
+        description="Maximal number of records returned by the call",
+        ge=0,
+        example=1000,
+    )
+
+    count: int = Field(
         ...,
+        title="Count of records",
+        description="Count of records returned by the call",
+        example=391,
+        ge=0,
+    )
+
+    next_cursor: Optional[str] = Field(
+        default=None,
+        title="Next cursor",
+        description="Opaque cursor of the next page (null on the last page)",
+        example="WzE4MzAxXQ.2x7kQ0bdZVbY1Nq3Nc5hCw",
+    )
+
+    total: Optional[int] = Field(
+        default=None,
         title="Total records",
-        description="Total number of records in the database",
+        description="Total number of records in the database (null if not counted)",
         example=18301,
         ge=0,
     )
+
+    total_estimated: bool = Field(
+        default=False,
+        title="Total is estimated",
+        description="The total is an estimate (e.g. from table statistics)",
+        example=False,
+    )
@@ -1,10 +1,21 @@
+import time
 from .base import Base
-from .info import InfoSuccess, InfoWarning, InfoError
-from typing import Union, List, Dict, Optional
-from starlette.responses import JSONResponse, Response
+from .info import InfoSuccess, InfoWarning, InfoError, InfoCursorSuccess, InfoCursorWarning
+from .encoder import Encoder
+from .streaming import EnvelopeStreamingResponse
+from typing import Any, Union, List, Dict, Optional
+from starlette.responses import JSONResponse
+from starlette.responses import Response as RawResponse
 from fastapi.encoders import jsonable_encoder
 
 
+class EncodedJSONResponse(JSONResponse):
+    """JSON response serialized by the shared `Encoder`"""
+
+    def render(self, content: Any) -> bytes:
+        return Encoder.dumps(content)
+
+
 class Success(Base):
     info: InfoSuccess = InfoSuccess()
     data: Optional[Union[List, Dict]]= None
@@ -31,6 +42,18 @@ class Warnings(Base):
         )
 
 
+class CursorSuccess(Success):
+    """Success response of the endpoints with keyset (cursor) pagination
+    (documentation of the `CursorMetadata`)"""
+
+    info: InfoCursorSuccess = InfoCursorSuccess()
+
+
+class CursorWarnings(Warnings):
+
+    info: InfoCursorWarning = InfoCursorWarning()
+
+
 class Errors(Base):
     info: InfoError = InfoError()
 
@@ -45,6 +68,13 @@ class Errors(Base):
 
 class Response:
 
+    # write success and warning envelopes directly to bytes (see `set_fast`)
+    fast = False
+
+    # called with the start of the serialization (`time.perf_counter()`),
+    # set by `LoggingMiddleware(server_timing=True)`
+    serialization_hook = None
+
     @classmethod
     def set(
         cls,
@@ -52,43 +82,122 @@ class Response:
         data=None,
         metadata=None,
         warnings=None,
-        errors=None
+        errors=None,
+        fast=None
     ):
 
-        status_code = cls.get_status_code(status_code, warnings, errors)
+        start = time.perf_counter()
 
-        if errors is not None:
+        try:
 
-            return JSONResponse(
-                status_code=status_code,
-                content=jsonable_encoder(
-                    Errors.set(
-                        errors=errors,
-                        warnings=warnings
+            status_code = cls.get_status_code(status_code, warnings, errors)
+
+            if errors is None and (cls.fast if fast is None else fast):
+
+                response = cls.set_fast(status_code, data, metadata, warnings)
+
+                if response is not None:
+                    return response
+
+            if errors is not None:
+
+                return EncodedJSONResponse(
+                    status_code=status_code,
+                    content=jsonable_encoder(
+                        Errors.set(
+                            errors=errors,
+                            warnings=warnings
+                        )
+                    )
+                )
+            if errors is None and warnings is not None:
+
+                return EncodedJSONResponse(
+                    status_code=status_code,
+                    content=jsonable_encoder(
+                        Warnings.set(
+                            warnings=warnings,
+                            data=data,
+                            metadata=metadata
+                        )
                     )
                 )
-            )
-        if errors is None and warnings is not None:
 
-            return JSONResponse(
+            return EncodedJSONResponse(
                 status_code=status_code,
                 content=jsonable_encoder(
-                    Warnings.set(
-                        warnings=warnings,
+                    Success.set(
                         data=data,
                         metadata=metadata
                     )
                 )
             )
 
-        return JSONResponse(
+        finally:
+
+            if cls.serialization_hook is not None:
+                cls.serialization_hook(start)
+
+    @classmethod
+    def stream(
+        cls,
+        rows,
+        metadata=None,
+        format="json",
+        status_code=200,
+        chunk_size=EnvelopeStreamingResponse.CHUNK_SIZE
+    ):
+        """Returns streaming success response for sync or async iterator
+        of rows (see `EnvelopeStreamingResponse`)
+
+        :param rows: sync or async iterable of rows
+        :param metadata: `Metadata` or dict with `offset`, `limit` and `total`
+        :param format: `json` or `ndjson`
+        :param status_code: HTTP status code
+        :param chunk_size: minimal size of the chunks sent to the client
+        """
+
+        return EnvelopeStreamingResponse(
+            rows,
+            metadata=metadata,
+            format=format,
+            chunk_size=chunk_size,
+            status_code=status_code
+        )
+
+    @classmethod
+    def set_fast(cls, status_code, data=None, metadata=None, warnings=None):
+        """Returns success or warning response serialized directly to bytes
+
+        Only the small `info` part is built as pydantic model, the data are
+        passed to the encoder once without validation and `jsonable_encoder`.
+        The output is byte-identical to the standard path. Returns None when
+        the data can not be serialized this way (the standard path is used).
+        """
+
+        if data is not None and not isinstance(data, (list, dict, tuple)):
+            return None  # let pydantic raise the validation error
+
+        if warnings is None:
+            info = InfoSuccess(metadata=metadata)
+        else:
+            info = InfoWarning(warnings=warnings, metadata=metadata)
+
+        try:
+            data = Encoder.dumps_data(data)
+        except (TypeError, ValueError):
+            return None
+
+        return RawResponse(
+            content=b"".join((
+                b'{"info":',
+                Encoder.dumps(jsonable_encoder(info)),
+                b',"data":',
+                data,
+                b'}'
+            )),
             status_code=status_code,
-            content=jsonable_encoder(
-                Success.set(
-                    data=data,
-                    metadata=metadata
-                )
-            )
+            media_type=EncodedJSONResponse.media_type
         )
 
     @staticmethod
@@ -108,11 +217,15 @@ class Response:
 class Responses:
 
     @classmethod
-    def get(cls):
+    def get(cls, cursor: bool = False):
+        """Returns responses of the endpoint for OpenAPI documentation
+
+        :param cursor: document the metadata of the keyset (cursor) pagination
+        """
 
         return {
-            200: {"model": Success},
-            299: {"model": Warnings},
+            200: {"model": CursorSuccess if cursor else Success},
+            299: {"model": CursorWarnings if cursor else Warnings},
             400: {"model": Errors},
             422: {"model": Errors},
             500: {"model": Errors},
@@ -0,0 +1,168 @@
+import itertools
+from typing import AsyncIterator, Iterable, Union
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+
+from .info import InfoSuccess
+from .metadata import Metadata, CursorMetadata
+from .encoder import Encoder
+
+
+class EnvelopeStreamingResponse(StreamingResponse):
+    """Streaming response with the standard success envelope
+
+    The rows are serialized one by one as they are produced by sync or async
+    iterator (e.g. DB cursor) and sent in chunks of `chunk_size` bytes.
+    Because `Metadata.count` is known only once all rows are sent, the `info`
+    part is emitted after the data:
+
+    * `json`: `{"data":[...],"info":{"status":"success","metadata":{...}}}`
+    * `ndjson`: one row per line followed by the `{"info":{...}}` line
+
+    :param rows: sync or async iterable of rows
+    :param metadata: `Metadata` or dict with `offset`, `limit` and `total`
+        (`count` is computed, `total` is null if not given) or `CursorMetadata`
+        or dict with `page_size` and `next_cursor`
+    :param format: `json` or `ndjson`
+    :param chunk_size: minimal size of the chunks sent to the client
+    """
+
+    MEDIA_TYPES = {
+        "json": "application/json",
+        "ndjson": "application/x-ndjson",
+    }
+
+    CHUNK_SIZE = 64 * 1024
+
+    # rows read from the iterator (and serialized) at once
+    BATCH_SIZE = 1000
+
+    def __init__(
+            self,
+            rows: Union[Iterable, AsyncIterator],
+            metadata=None,
+            format: str = "json",
+            chunk_size: int = CHUNK_SIZE,
+            status_code: int = 200,
+            headers=None
+    ):
+
+        if format not in self.MEDIA_TYPES:
+            raise ValueError(F"Unknown streaming format: `{format}`")
+
+        self.metadata_model = Metadata
+
+        if isinstance(metadata, (Metadata, CursorMetadata)):
+            self.metadata_model = type(metadata)
+            metadata = metadata.dict(exclude={"count"})
+
+        elif metadata is not None and ("next_cursor" in metadata or "page_size" in metadata):
+            self.metadata_model = CursorMetadata
+
+        self.metadata = metadata
+        self.count = 0
+
+        chunks = self.iter_ndjson if format == "ndjson" else self.iter_json
+
+        super().__init__(
+            content=chunks(rows, chunk_size),
+            status_code=status_code,
+            headers=headers,
+            media_type=self.MEDIA_TYPES[format]
+        )
+
+    @classmethod
+    async def iter_batches(cls, rows, batch_size: int = None):
+        """Iterate lists of up to `batch_size` rows, sync iterables are read
+        in thread pool (one thread hop per batch) so the event loop is not
+        blocked by e.g. fetching from DB cursor"""
+
+        batch_size = batch_size or cls.BATCH_SIZE
+
+        if hasattr(rows, "__aiter__"):
+
+            batch = []
+
+            async for row in rows:
+
+                batch.append(row)
+
+                if len(batch) >= batch_size:
+                    yield batch
+                    batch = []
+
+            if batch:
+                yield batch
+
+        else:
+
+            iterator = iter(rows)
+
+            while True:
+
+                batch = await run_in_threadpool(list, itertools.islice(iterator, batch_size))
+
+                if not batch:
+                    break
+
+                yield batch
+
+    def get_info(self) -> bytes:
+        """Returns serialized `info` part of the envelope with metadata
+        updated by the number of sent rows"""
+
+        metadata = None
+
+        if self.metadata is not None and self.metadata_model is CursorMetadata:
+
+            metadata = CursorMetadata(**{**self.metadata, "count": self.count})
+
+        elif self.metadata is not None:
+
+            metadata = Metadata(**{**self.metadata, "count": self.count})
+
+        return Encoder.dumps(jsonable_encoder(InfoSuccess(metadata=metadata)))
+
+    async def iter_json(self, rows, chunk_size):
+
+        buffer = bytearray(b'{"data":[')
+
+        async for batch in self.iter_batches(rows):
+
+            if self.count:
+                buffer += b","
+
+            # `[row,row,...]` without the brackets
+            buffer += Encoder.dumps_data(batch)[1:-1]
+            self.count += len(batch)
+
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+
+        buffer += b'],"info":'
+        buffer += self.get_info()
+        buffer += b'}'
+
+        yield bytes(buffer)
+
+    async def iter_ndjson(self, rows, chunk_size):
+
+        buffer = bytearray()
+
+        async for batch in self.iter_batches(rows):
+
+            buffer += b"\n".join([Encoder.dumps_data(row) for row in batch])
+            buffer += b"\n"
+            self.count += len(batch)
+
+            if len(buffer) >= chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+
+        buffer += b'{"info":'
+        buffer += self.get_info()
+        buffer += b'}\n'
+
+        yield bytes(buffer)
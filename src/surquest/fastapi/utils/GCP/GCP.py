@@ -1,5 +1,10 @@
 from .logging import (
     setup_logging,
+    reconfigure_logging,
+    get_logging_stats,
+    BackgroundHandler,
+    CloudLoggingHandler,
+    SamplingFilter,
     Logger,
     DEFAULT_LOGGER_NAME
 )
@@ -12,13 +17,25 @@ from .tracer import (
 from .middleware import (
     BasicMiddleware,
     LoggingMiddleware,
-    DBMiddleware
+    DBMiddleware,
+    DBPool
+)
+
+from .observability import (
+    ObservabilityProfile,
+    observability
 )
 
 from .formatter import JSONFormatter
 
+from .budget import PayloadBudget
+
+from .project import ProjectID
+
 from .http_context import (
     HTTPContext,
+    TraceContext,
     CLOUD_TRACE_CONTEXT,
+    TRACE_CONTEXT,
     HTTP_REQUEST_CONTEXT
 )
\ No newline at end of file
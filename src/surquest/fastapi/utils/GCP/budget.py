@@ -0,0 +1,154 @@
+# import internal modules
+from surquest.fastapi.schemas.responses.encoder import Encoder
+
+__all__ = ["PayloadBudget"]
+
+_SCALARS = frozenset({type(None), bool, int, float})
+
+
+class PayloadBudget(object):
+    """Limits the size of the payload (extra attributes) of the log records
+
+    The payload is copied up to the limits so the formatting time is bounded
+    regardless of the size of the logged objects:
+
+    * `max_bytes`: approximate size of the serialized payload, once exceeded
+      remaining items are replaced by a summary
+    * `max_depth`: deeper containers are replaced by a summary
+    * `max_items`: longer lists show only the first `show_items` items
+      (e.g. "list of 10000 items, first 20 shown"), dicts the first `max_items` keys
+    * `max_string`: longer strings are cut
+
+    Lists under the `exempt_keys` (the tracebacks of the errors, at any depth)
+    keep all their items, so the exception line at the end of the traceback
+    reaches Error Reporting; only their strings are cut to `max_string`.
+
+    Default limits keep the log entries well below the 256 KB limit of Cloud Logging.
+    """
+
+    __slots__ = ("max_bytes", "max_depth", "max_items", "show_items", "max_string", "exempt_keys")
+
+    def __init__(
+            self,
+            max_bytes: int = 200_000,
+            max_depth: int = 10,
+            max_items: int = 100,
+            show_items: int = 20,
+            max_string: int = 16_384,
+            exempt_keys: tuple = ("traceback",)
+    ):
+        self.max_bytes = max_bytes
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.show_items = show_items
+        self.max_string = max_string
+        self.exempt_keys = frozenset(exempt_keys)
+
+    def apply(self, payload, default=Encoder.default) -> tuple:
+        """Returns the payload cut to the limits
+
+        :param payload: object to limit
+        :param default: function converting objects not supported by JSON
+        :return: tuple (limited payload, True if anything was truncated)
+        """
+
+        state = _State(self.max_bytes, default)
+
+        return self.limit(payload, 0, state), state.truncated
+
+    def limit(self, obj, depth: int, state: "_State"):
+
+        cls = type(obj)
+
+        if cls is str or isinstance(obj, str):
+
+            if len(obj) > self.max_string:
+                state.truncated = True
+                obj = F"{obj[:self.max_string]}... ({len(obj)} characters)"
+
+            state.remaining -= len(obj) + 2
+            return obj
+
+        if cls in _SCALARS:
+
+            state.remaining -= 8
+            return obj
+
+        if cls is dict or isinstance(obj, dict):
+            return self.limit_dict(obj, depth, state)
+
+        if cls is list or isinstance(obj, (list, tuple, set, frozenset)):
+            return self.limit_list(obj, depth, state)
+
+        if isinstance(obj, (bool, int, float)):
+
+            state.remaining -= 8
+            return obj
+
+        # objects not supported by JSON (models, dates, ...)
+        converted = state.default(obj)
+
+        if converted is obj:
+            converted = str(obj)
+
+        return self.limit(converted, depth, state)
+
+    def limit_dict(self, obj: dict, depth: int, state: "_State"):
+
+        if depth >= self.max_depth:
+            state.truncated = True
+            return F"dict of {len(obj)} keys"
+
+        output = {}
+
+        for i, (key, value) in enumerate(obj.items()):
+
+            if i >= self.max_items or state.remaining <= 0:
+                state.truncated = True
+                output["..."] = F"dict of {len(obj)} keys, first {i} shown"
+                break
+
+            key = key if isinstance(key, str) else str(key)
+            state.remaining -= len(key) + 3
+
+            if key in self.exempt_keys and isinstance(value, list):
+                output[key] = [self.limit(item, depth + 2, state) for item in value]
+            else:
+                output[key] = self.limit(value, depth + 1, state)
+
+        return output
+
+    def limit_list(self, obj, depth: int, state: "_State"):
+
+        size = len(obj)
+
+        if depth >= self.max_depth:
+            state.truncated = True
+            return F"list of {size} items"
+
+        shown = size if size <= self.max_items else self.show_items
+        output = []
+
+        for item in obj:
+
+            if len(output) >= shown or state.remaining <= 0:
+                break
+
+            output.append(self.limit(item, depth + 1, state))
+            state.remaining -= 1
+
+        if len(output) < size:
+            state.truncated = True
+            output.append(F"list of {size} items, first {len(output)} shown")
+
+        return output
+
+
+class _State(object):
+
+    __slots__ = ("remaining", "truncated", "default")
+
+    def __init__(self, remaining: int, default):
+        self.remaining = remaining
+        self.truncated = False
+        self.default = default
@@ -1,25 +1,39 @@
 # import external modules
 import os
+import time
+import atexit
+import random
+import threading
+from collections import OrderedDict
 from fastapi import Request
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException as StarletteHTTPException
 import traceback
 
 from surquest.fastapi.schemas.responses import Response, Message
+from surquest.fastapi.utils.metrics import REGISTRY
 
 from .logging import Logger
 from .http_context import (
-    HTTP_REQUEST_CONTEXT,
+    HTTPContext,
     CLOUD_TRACE_CONTEXT
 )
 
 __all__ = [
     "Catcher",
+    "ErrorThrottle",
     "catch_validation_exceptions",
     "catch_http_exceptions"
 ]
 
 
+ERRORS = REGISTRY.counter(
+    "http_errors_total",
+    "Number of errors handled by the Catcher by the message type",
+    labels=("type",)
+)
+
+
 async def catch_validation_exceptions(request: Request, exc):
     return await Catcher.catch_validation_error(request, exc)
 
@@ -28,10 +42,206 @@ async def catch_http_exceptions(request: Request, exc):
     return await Catcher.catch_http_exception(request, exc)
 
 
+class ErrorThrottle(object):
+    """Throttling of the error reports per error fingerprint
+    (exception type and the frame where the exception was raised)
+
+    Each fingerprint has a token bucket allowing `limit` full reports
+    (with traceback and request context) per `window` seconds. Further
+    occurrences are only counted (a `sample_rate` fraction of them is still
+    reported in full) and summarized as "repeated X times" once the `window`
+    since the first suppressed occurrence expires (see `flush`).
+
+    :param limit: number of full reports per window (bucket capacity)
+    :param window: length of the window in seconds
+    :param sample_rate: fraction of throttled errors reported in full
+    :param max_fingerprints: maximal number of tracked fingerprints
+        (the least recently seen fingerprint is evicted)
+    """
+
+    FULL = "full"
+    SUPPRESSED = "suppressed"
+
+    def __init__(
+            self,
+            limit: int = 10,
+            window: float = 60.0,
+            sample_rate: float = 0.01,
+            max_fingerprints: int = 1000
+    ):
+        self.limit = limit
+        self.window = window
+        self.sample_rate = sample_rate
+        self.max_fingerprints = max_fingerprints
+
+        # fingerprint: [tokens, last refill, occurrences, suppressed, first suppressed]
+        self.buckets = OrderedDict()
+        # fingerprints with suppressed occurrences ordered by the first of them
+        self.pending = OrderedDict()
+        # summaries of the evicted fingerprints
+        self.evicted = []
+
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(exc: BaseException) -> tuple:
+        """Returns fingerprint of the exception: type and origin frame"""
+
+        tb = exc.__traceback__
+
+        if tb is None:
+            return type(exc).__name__, None, None
+
+        while tb.tb_next is not None:
+            tb = tb.tb_next
+
+        return type(exc).__name__, tb.tb_frame.f_code.co_filename, tb.tb_lineno
+
+    def check(self, exc: BaseException) -> str:
+        """Register occurrence of the exception and decide how to report it
+
+        :param exc: exception
+        :return: `full` or `suppressed`
+        """
+
+        key = self.fingerprint(exc)
+        now = time.monotonic()
+
+        with self._lock:
+
+            bucket = self.buckets.get(key)
+
+            if bucket is None:
+
+                if len(self.buckets) >= self.max_fingerprints:
+                    self.evict()
+
+                bucket = self.buckets[key] = [float(self.limit), now, 0, 0, now]
+
+            else:
+                self.buckets.move_to_end(key)
+
+            bucket[0] = min(self.limit, bucket[0] + (now - bucket[1]) * self.limit / self.window)
+            bucket[1] = now
+            bucket[2] += 1
+
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return self.FULL
+
+            if random.random() < self.sample_rate:
+                return self.FULL
+
+            if bucket[3] == 0:
+                bucket[4] = now
+                self.pending[key] = None
+
+            bucket[3] += 1
+
+            return self.SUPPRESSED
+
+    def evict(self):
+        """Remove the least recently seen fingerprint (the caller holds the lock)"""
+
+        key, bucket = self.buckets.popitem(last=False)
+
+        if bucket[3]:
+            self.pending.pop(key, None)
+            self.evicted.append((key, bucket[3]))
+
+    def flush(self, force: bool = False) -> list:
+        """Returns summaries `(fingerprint, suppressed occurrences)` of the
+        fingerprints whose window expired (all of them if `force`)"""
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            summaries, self.evicted = self.evicted, []
+
+            for key in list(self.pending):
+
+                bucket = self.buckets[key]
+
+                if not force and now - bucket[4] < self.window:
+                    break
+
+                summaries.append((key, bucket[3]))
+                bucket[3] = 0
+                del self.pending[key]
+
+        return summaries
+
+    def get_stats(self) -> dict:
+        """Returns counters of the occurrences per fingerprint"""
+
+        return {
+            F"{name} ({file}:{line})": {
+                "occurrences": bucket[2],
+                "suppressed": bucket[3],
+            }
+            for (name, file, line), bucket in list(self.buckets.items())
+        }
+
+
 class Catcher:
 
     OUPS = "Oups, something went wrong"
 
+    # throttling of internal error reports, e.g. `ErrorThrottle()`
+    # (None to report every error in full)
+    throttle = None
+
+    _summary_timer = None
+    _summary_at_exit = False
+
+    @classmethod
+    def report_summaries(cls, force: bool = False):
+        """Log summaries of the suppressed errors whose throttling window
+        expired (all of them if `force`, e.g. at exit)"""
+
+        throttle = cls.throttle
+
+        if throttle is None:
+            return
+
+        for (name, file, line), suppressed in throttle.flush(force):
+
+            Logger.warning(
+                F"{name} ({file}:{line}) repeated {suppressed} times",
+                extra={
+                    "error": {"type": "SERVER.ERROR", "exception": name, "file": file, "line": line},
+                    "suppressed": suppressed
+                }
+            )
+
+    @classmethod
+    def schedule_summaries(cls):
+        """Report the summaries when the window expires even without
+        further occurrences of the error and report the pending ones at exit"""
+
+        if not cls._summary_at_exit:
+            # registered late so it runs before the log handlers are closed
+            atexit.register(cls.report_summaries, True)
+            cls._summary_at_exit = True
+
+        if cls._summary_timer is not None and cls._summary_timer.is_alive():
+            return
+
+        def report():
+
+            cls.report_summaries()
+
+            if cls.throttle is not None and cls.throttle.pending:
+                cls._summary_timer = None
+                cls.schedule_summaries()
+
+        timer = threading.Timer(cls.throttle.window, report)
+        timer.daemon = True
+        timer.start()
+
+        cls._summary_timer = timer
+
     @classmethod
     async def catch_internal_error(
             cls,
@@ -39,14 +249,30 @@ class Catcher:
             exc: BaseException
     ):
 
-        tb = traceback.format_exc(chain=False).split("\n")
+        ERRORS.inc("SERVER.ERROR")
+        decision = ErrorThrottle.FULL
+
+        if cls.throttle is not None:
+
+            decision = cls.throttle.check(exc)
+            cls.report_summaries()
+
+            if decision == ErrorThrottle.SUPPRESSED:
+                cls.schedule_summaries()
+
+        tb = None
+
+        if decision == ErrorThrottle.FULL:
+            tb = traceback.format_exc(chain=False).split("\n")
 
         ctx = {
             "trace": CLOUD_TRACE_CONTEXT.get()
         }
 
-        if os.getenv("ENV", "DEV").upper() not in ["PROD", "PRODUCTION"] or \
-            os.getenv("ENVIRONMENT", "DEV").upper() not in ["PROD", "PRODUCTION"]:
+        if tb is not None and (
+            os.getenv("ENV", "DEV").upper() not in ["PROD", "PRODUCTION"] or \
+            os.getenv("ENVIRONMENT", "DEV").upper() not in ["PROD", "PRODUCTION"]
+        ):
 
             ctx["traceback"] = tb
 
@@ -56,14 +282,16 @@ class Catcher:
             ctx=ctx,
         )
 
-        Logger.error(
-            F"{str(exc)} ({type(exc).__name__})",
-            extra={
-                "error": message.dict(exclude_none=True),
-                "request": HTTP_REQUEST_CONTEXT.get(),
-                "traceback": tb
-            }
-        )
+        if decision == ErrorThrottle.FULL:
+
+            Logger.error(
+                F"{str(exc)} ({type(exc).__name__})",
+                extra={
+                    "error": message.dict(exclude_none=True),
+                    "request": HTTPContext.get_http_request_context(),
+                    "traceback": tb
+                }
+            )
 
         return Response.set(
             status_code=500,
@@ -79,6 +307,7 @@ class Catcher:
         errors = []
 
         for error in exc.errors():
+            ERRORS.inc(str(error.get("type")))
             errors.append(
                 Message(
                     msg=error.get("msg"),
@@ -92,7 +321,7 @@ class Catcher:
             "Validation Error",
             extra={
                 "errors": errors,
-                "request": HTTP_REQUEST_CONTEXT.get()
+                "request": HTTPContext.get_http_request_context()
             }
         )
 
@@ -114,12 +343,13 @@ class Catcher:
             loc=getattr(exc, "loc", [F"{request.url}"]),
             ctx=getattr(exc, "ctx", {"trace": CLOUD_TRACE_CONTEXT.get()})
         )
+        ERRORS.inc(str(message.type))
 
         Logger.error(
             F"{message.msg}: ({message.loc[0]})",
             extra={
                 "error": message.dict(exclude_none=True),
-                "request": HTTP_REQUEST_CONTEXT.get()
+                "request": HTTPContext.get_http_request_context()
             }
         )
 
@@ -2,14 +2,18 @@ import os
 import json
 import logging
 import datetime as dt
-import google.cloud.logging
+from surquest.fastapi.schemas.responses.encoder import Encoder
 from surquest.fastapi.utils.GCP.http_context import (
     HTTPContext
 )
 
 from .http_context import (
-    HTTP_REQUEST_CONTEXT
+    HTTP_REQUEST_CONTEXT,
+    BodyCapture,
+    RequestContext
 )
+from .project import ProjectID
+from .budget import PayloadBudget
 
 __all__ = ["JSONFormatter"]
 
@@ -19,12 +23,14 @@ class JSONFormatter(logging.Formatter):
     Formatter that outputs JSON strings after parsing the LogRecord.
     """
 
-    LOG_RECORDS_ATTRS = {
+    LOG_RECORDS_ATTRS = frozenset({
         "name", "msg", "args", "levelname", "levelno", "pathname", "filename",
         "module", "exc_info", "exc_text", "stack_info", "lineno", "funcName",
         "created", "msecs", "relativeCreated", "thread", "threadName",
-        "process", "processName", "message", "asctime"
-    }
+        "process", "processName", "message", "asctime", "taskName",
+        # attributes set by the formatter itself
+        "ctx", "trace", "spanId", "flags", "source"
+    })
 
     GCP_LOG_TYPE = "type.googleapis.com/type.googleapis.com/google.devtools.clouderrorreporting.v1beta1.ReportedErrorEvent"
 
@@ -38,17 +44,29 @@ class JSONFormatter(logging.Formatter):
                 "logging.googleapis.com/spanId": "spanId",
                 "logging.googleapis.com/trace_sampled": "flags",
                 "logging.googleapis.com/sourceLocation": "source"
-            }
+            },
+            project_id: str = None,
+            offline: bool = None,
+            budget: PayloadBudget = PayloadBudget()
     ):
+        """
+        :param fields: mapping of the log entry keys to the LogRecord attributes
+        :param project_id: Google Cloud project ID (resolved by `ProjectID` if not set)
+        :param offline: do not query the metadata server for the project ID
+        :param budget: limits of the extra attributes (None for no limits)
+        """
         super().__init__(fmt=None, datefmt=None, style='%')
-        self.project_id = "-"
+        self.project_id = ProjectID.resolve(project_id, offline=offline)
         self.fields = fields
+        self.budget = budget
 
-        try:
-            self.client = google.cloud.logging.Client()
-            self.project_id = self.client.project
-        except Exception:
-            pass
+        # static parts of the log entries compiled once
+        self.field_items = tuple(fields.items())
+        self.trace_prefix = f"projects/{self.project_id}/traces/"
+        self.service_context = self.get_service_context()
+
+        # (request, context) of the last request built once per request, not per record
+        self._request_cache = (None, None)
 
     def format_log_entry(self, record: logging.LogRecord) -> dict:
         """Method to extract from LogRecord all attributes required attributes
@@ -58,9 +76,10 @@ class JSONFormatter(logging.Formatter):
         :return: dictionary with required fields
         :rtype: dict
         """
+        attrs = record.__dict__
+
         return {
-            key: record.__dict__[val] \
-            for key, val in self.fields.items()
+            key: attrs[val] for key, val in self.field_items
         }
 
     @staticmethod
@@ -76,23 +95,39 @@ class JSONFormatter(logging.Formatter):
         :return:
         """
 
+        log = self.format_dict(record)
+
+        try:
+            return Encoder.dumps_str(log, default=self.json_default)
+        except ValueError:
+            # out of range floats (NaN, Infinity) are not valid JSON
+            return json.dumps(log, default=self.json_default)
+
+    def format_dict(self, record) -> dict:
+        """Method to convert LogRecord to the structured log entry
+        (dictionary serialized by `format`)
+
+        :param record: LogRecord
+        :return: structured log entry
+        """
+
         # get log message
         record.message = record.getMessage()
 
         # collect all attributes passed to LogRecord via logging.info(..., extra=...)
         # into json_field to comply with GCP LogRecord format https://cloud.google.com/logging/docs/reference/v2/rest/v2/LogEntry
         record.ctx = self.get_extra(record)  # context
+        truncated = False
+
+        if record.ctx and self.budget is not None:
+            record.ctx, truncated = self.budget.apply(record.ctx, default=self.json_default)
 
         # extend LogRecord attributes by trace information
-        (
-            trace_id,
-            span_id,
-            flags
-        ) = HTTPContext.get_trace_context()
+        trace_context = HTTPContext.get_trace_context()
 
-        record.trace = f"projects/{self.project_id}/traces/{trace_id}"
-        record.spanId = span_id
-        record.flags = flags
+        record.trace = self.trace_prefix + trace_context.trace_id
+        record.spanId = trace_context.span_id
+        record.flags = trace_context.sampled
 
         # add information about the location of the source of the log entry
         record.source = {
@@ -104,6 +139,9 @@ class JSONFormatter(logging.Formatter):
         # convert log record to dictionary compatible with GCP LogRecord format
         log = self.format_log_entry(record)
 
+        if truncated:
+            log["truncated"] = True
+
         # if log record is an error add @type attribute to comply with GCP Error Reporting format
         if record.levelno >= logging.ERROR:
 
@@ -117,14 +155,42 @@ class JSONFormatter(logging.Formatter):
                 message=log["message"],
                 traceback=tb
             )
-            log["serviceContext"] = self.get_service_context()
+            http_request, user = self.get_request_context()
+
+            log["serviceContext"] = self.service_context
             log["context"] = {
-                "httpRequest": self.get_http_request_context(),
+                "httpRequest": http_request,
                 "reportLocation": self.get_report_location(record),
-                "user": self.get_user()
+                "user": user
             }
 
-        return json.dumps(log, default=str)
+        return log
+
+    @staticmethod
+    def json_default(obj):
+        """Method to serialize objects not supported by the JSON encoder
+        (lazily captured request body is parsed on demand)"""
+
+        if isinstance(obj, BodyCapture):
+            return obj.resolve()
+
+        if isinstance(obj, RequestContext):
+            return obj.resolve()
+
+        return Encoder.default(obj)
+
+    def get_request_context(self) -> tuple:
+        """Returns http request context and user of the current request
+        (cached for all the records of the same request)"""
+
+        request = HTTP_REQUEST_CONTEXT.get()
+        cached_request, context = self._request_cache  # single read, thread safe
+
+        if request is not cached_request:
+            context = (self.get_http_request_context(), self.get_user())
+            self._request_cache = (request, context)
+
+        return context
 
     @staticmethod
     def get_user():
@@ -196,7 +262,12 @@ class JSONFormatter(logging.Formatter):
         """
         Get extra attributes from the LogRecord
         """
+        attrs = record.__dict__
+
+        if attrs.keys() <= JSONFormatter.LOG_RECORDS_ATTRS:
+            return {}  # no extra attributes (checked without python loop)
+
         return {
-            key: val for key, val in record.__dict__.items()
+            key: val for key, val in attrs.items()
             if key not in JSONFormatter.LOG_RECORDS_ATTRS
         }
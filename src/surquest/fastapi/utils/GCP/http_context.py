@@ -1,20 +1,415 @@
-import sys
+import re
+import copy
+import json
 import secrets
 import random
 import contextvars
+from typing import Optional
+from collections.abc import MutableMapping
 from starlette.requests import Request
-from google.cloud.logging_v2.handlers._helpers import _parse_xcloud_trace
 
 CLOUD_TRACE_CONTEXT = contextvars.ContextVar(
     'CLOUD_TRACE_CONTEXT',
     default=""
 )
 
+TRACE_CONTEXT = contextvars.ContextVar(
+    'TRACE_CONTEXT',
+    default=None
+)
+
 HTTP_REQUEST_CONTEXT = contextvars.ContextVar(
     'HTTP_REQUEST_CONTEXT',
     default=dict({})
 )
 
+class TraceContext(object):
+    """Trace identity of the request
+
+    Parsed from `X-Cloud-Trace-Context` header (or generated) once per request
+    by the middleware and stored in `TRACE_CONTEXT` context variable.
+
+    :param trace_id: 128-bit trace id (32 hex characters)
+    :param span_id: 64-bit span id (16 hex characters)
+    :param sampled: the trace is sampled (`o=1` option of the header)
+    :param decided: the sampling decision was made by the caller
+        (the header contains the `o=` option)
+
+    The parent span context of the request and the sampling decision
+    are cached in `parent` by the `Tracer`.
+    """
+
+    __slots__ = ("trace_id", "span_id", "sampled", "decided", "parent")
+
+    # TRACE_ID[/SPAN_ID][;o=OPTIONS] see https://cloud.google.com/trace/docs/trace-context#legacy-http-header
+    HEADER_PATTERN = re.compile(r"([\w-]+)?(/?([\w-]+))?(;?o=(\d))?")
+    TRACE_ID_PATTERN = re.compile(r"[0-9a-fA-F]{1,32}")
+
+    def __init__(
+            self,
+            trace_id: str,
+            span_id: str,
+            sampled: bool = False,
+            decided: bool = False
+    ):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.decided = decided
+        self.parent = None
+
+    def __iter__(self):
+        """Allows unpacking `trace_id, span_id, flags = trace_context`"""
+        return iter((self.trace_id, self.span_id, self.sampled))
+
+    def __repr__(self):
+        return (
+            F"{self.__class__.__name__}(trace_id={self.trace_id!r}, "
+            F"span_id={self.span_id!r}, sampled={self.sampled!r})"
+        )
+
+    @staticmethod
+    def generate_trace_id() -> str:
+        return secrets.token_hex(16)
+
+    @staticmethod
+    def generate_span_id() -> str:
+        return F"{random.getrandbits(64):016x}"
+
+    @classmethod
+    def from_header(cls, header: Optional[str]) -> "TraceContext":
+        """Parse the `X-Cloud-Trace-Context` header, missing or invalid
+        ids are generated
+
+        :param header: value of the header (or None)
+        :return: trace context
+        """
+
+        trace_id = span_id = None
+        sampled = decided = False
+
+        if header:
+
+            match = cls.HEADER_PATTERN.match(header)
+            trace_id = match.group(1)
+            decided = match.group(5) is not None
+            sampled = match.group(5) == "1"
+
+            if trace_id is not None and cls.TRACE_ID_PATTERN.fullmatch(trace_id) is None:
+                trace_id = None
+
+            try:
+                span_id_int = int(match.group(3))
+                if 0 < span_id_int < 2 ** 64:
+                    span_id = F"{span_id_int:016x}"
+            except (ValueError, TypeError):
+                pass
+
+        return cls(
+            trace_id=trace_id or cls.generate_trace_id(),
+            span_id=span_id or cls.generate_span_id(),
+            sampled=sampled,
+            decided=decided
+        )
+
+
+class BodyCapture(object):
+    """Lazy capture of the request body
+
+    The body is not read by the middleware but the chunks received by the
+    application are copied (up to `max_size` bytes) while the application
+    reads them. The captured bytes are parsed only when requested via
+    `resolve()` e.g. when an error is logged.
+    """
+
+    MAX_SIZE = 64 * 1024
+
+    TEXT_TYPES = (
+        "application/json",
+        "application/x-www-form-urlencoded",
+        "application/xml",
+        "text/",
+    )
+
+    __slots__ = ("content_type", "max_size", "chunks", "size", "received", "truncated", "complete")
+
+    def __init__(self, content_type: str = "", max_size: int = MAX_SIZE):
+
+        self.content_type = content_type
+        self.max_size = max_size
+        self.chunks = []
+        self.size = 0
+        self.received = 0  # number of received bytes (including the truncated ones)
+        self.truncated = False
+        self.complete = False
+
+    @classmethod
+    def is_capturable(cls, content_type: str) -> bool:
+        """Returns True for JSON and text content types (binary and multipart
+        payloads are never captured)"""
+
+        if not content_type:
+            return True
+
+        content_type = content_type.split(";", 1)[0].strip().lower()
+
+        return content_type.startswith(cls.TEXT_TYPES) or content_type.endswith("+json")
+
+    @property
+    def is_json(self) -> bool:
+
+        content_type = self.content_type.split(";", 1)[0].strip().lower()
+
+        return content_type == "application/json" or content_type.endswith("+json")
+
+    def write(self, chunk: bytes):
+        """Store received chunk of the body respecting the size cap"""
+
+        free = self.max_size - self.size
+
+        if len(chunk) > free:
+            chunk = chunk[:free]
+            self.truncated = True
+
+        if chunk:
+            self.chunks.append(chunk)
+            self.size += len(chunk)
+
+    def wrap(self, receive):
+        """Returns ASGI receive channel copying the body chunks into the capture
+
+        :param receive: original ASGI receive channel
+        :return: ASGI receive channel
+        """
+
+        async def receive_wrapper():
+
+            message = await receive()
+
+            if message["type"] == "http.request":
+
+                body = message.get("body", b"")
+                self.received += len(body)
+
+                if not self.truncated:
+                    self.write(body)
+
+                if not message.get("more_body", False):
+                    self.complete = True
+
+            return message
+
+        return receive_wrapper
+
+    def resolve(self):
+        """Parse captured bytes: JSON content is decoded into python objects,
+        truncated or non JSON content is returned as text"""
+
+        body = b"".join(self.chunks)
+
+        if self.is_json and not self.truncated:
+
+            try:
+                return json.loads(body)
+            except ValueError:
+                pass
+
+        return body.decode("utf-8", errors="replace")
+
+
+class ContextProjection(object):
+    """Selection of the request attributes stored in the request context
+    (and so logged with the errors)
+
+    :param headers: names of the logged headers (None for all headers)
+    :param cookies: names of the logged cookies (None for all cookies, their
+        values are redacted as long as the `cookie` header is redacted)
+    :param redact: names of the headers and cookies logged with redacted value
+    :param body: log the request body
+    :param params: log the path and query parameters
+    """
+
+    REDACTED = "[REDACTED]"
+
+    DEFAULT_REDACT = ("authorization", "proxy-authorization", "cookie", "x-api-key")
+
+    __slots__ = ("headers", "cookies", "redact", "body", "params")
+
+    def __init__(
+            self,
+            headers=None,
+            cookies=None,
+            redact=DEFAULT_REDACT,
+            body: bool = True,
+            params: bool = True
+    ):
+        self.headers = None if headers is None else frozenset(name.lower() for name in headers)
+        self.cookies = None if cookies is None else frozenset(cookies)
+        self.redact = frozenset(name.lower() for name in redact)
+        self.body = body
+        self.params = params
+
+    def without_body(self) -> "ContextProjection":
+        """Returns copy of the projection without the body"""
+
+        projection = copy.copy(self)
+        projection.body = False
+
+        return projection
+
+    def project(self, items, allowed, redact_all: bool = False) -> dict:
+        """Returns the allowed items with redacted values"""
+
+        projected = {}
+
+        for name, value in items:
+
+            if allowed is not None and name not in allowed:
+                continue
+
+            projected[name] = self.REDACTED if redact_all or name.lower() in self.redact else value
+
+        return projected
+
+    def project_headers(self, headers) -> dict:
+        return self.project(headers.items(), self.headers)
+
+    def project_cookies(self, cookies) -> dict:
+        # the values of the redacted `cookie` header are kept only for the allowed cookies
+        return self.project(cookies.items(), self.cookies, self.cookies is None and "cookie" in self.redact)
+
+
+class RequestContext(MutableMapping):
+    """Context of the request stored in `HTTP_REQUEST_CONTEXT`
+
+    Only the request and the body are stored per request, the dictionary
+    with the projected attributes (see `ContextProjection`) is built on
+    first access i.e. when a log record needs it.
+
+    The context is used as the dictionary stored by the previous versions:
+    it can be updated (e.g. `context["user"] = ...`) and passed to the log
+    records (`extra={"request": context}`), use `dict(context)` or
+    `HTTPContext.get_http_request_context()` for a plain dictionary.
+    """
+
+    __slots__ = ("request", "body", "projection", "_data")
+
+    def __init__(self, request: Request, body=None, projection: ContextProjection = None):
+
+        self.request = request
+        self.body = body
+        self.projection = projection or DEFAULT_PROJECTION
+        self._data = None
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __setitem__(self, key, value):
+        self.to_dict()[key] = value
+
+    def __delitem__(self, key):
+        del self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def to_dict(self) -> dict:
+        """Returns the context as dictionary (built once)"""
+
+        if self._data is None:
+            self._data = self.build()
+
+        return self._data
+
+    def build(self) -> dict:
+
+        request = self.request
+        projection = self.projection
+        headers = request.headers
+        request_size = self.get_request_size()  # before the body is parsed
+
+        http_request = {
+            'requestMethod': request.method,
+            'requestUrl': request.url,
+            'body': self.get_body(),
+            'paramsPatch': dict(request.path_params) if projection.params else None,
+            'paramsQuery': dict(request.query_params) if projection.params else None,
+            "headers": projection.project_headers(headers),
+            "cookies": projection.project_cookies(request.cookies),
+            'requestSize': request_size,
+            'remoteIp': request.client.host if request.client is not None else None,
+            'protocol': request.url.scheme,
+        }
+
+        if 'referrer' in headers:
+            http_request['referrer'] = headers.get('referrer')
+
+        if 'user-agent' in headers:
+            http_request['userAgent'] = headers.get('user-agent')
+
+        return http_request
+
+    def get_body(self):
+        """Returns the body parsed from JSON (or decoded to text)"""
+
+        body = self.body
+
+        if isinstance(body, bytes):
+
+            try:
+                body = json.loads(body)
+            except ValueError:
+                body = body.decode('utf-8', errors='replace')
+
+            self.body = body
+
+        return body
+
+    def get_request_size(self):
+        """Returns size of the request body from `Content-Length` header
+        (or the number of received bytes)"""
+
+        content_length = self.request.headers.get("content-length")
+
+        if content_length is not None and content_length.isdigit():
+            return int(content_length)
+
+        if isinstance(self.body, BodyCapture):
+            return self.body.received
+
+        if isinstance(self.body, bytes):
+            return len(self.body)
+
+        return None
+
+    def resolve(self) -> dict:
+        """Returns the context with the lazily captured body parsed"""
+
+        http_request = self.to_dict()
+        body = http_request.get("body")
+
+        if isinstance(body, BodyCapture):
+
+            if body.complete:
+                http_request["requestSize"] = self.get_request_size()
+                http_request["body"] = self.body = body.resolve()
+            else:
+                # body is not fully received yet, keep capturing
+                http_request = dict(
+                    http_request,
+                    body=body.resolve(),
+                    requestSize=self.get_request_size()
+                )
+
+        return http_request
+
+
+DEFAULT_PROJECTION = ContextProjection()
+
+
 class HTTPContext(object):
     """HTTP Context
 
@@ -32,36 +427,52 @@ class HTTPContext(object):
 
             CLOUD_TRACE_CONTEXT.set(trace)
 
+        TRACE_CONTEXT.set(TraceContext.from_header(trace))
+
     @staticmethod
-    async def set_http_request_context(request: Request):
-        """Set the HTTP Request Context for given request."""
+    async def set_http_request_context(
+            request: Request,
+            lazy_body: bool = False,
+            max_body_size: int = BodyCapture.MAX_SIZE,
+            projection: ContextProjection = None
+    ):
+        """Set the HTTP Request Context for given request.
 
-        try:
-            body = await request.json()
-        except BaseException:
-            body =  await request.body()
-            body = body.decode('utf-8')
+        :param request: Request
+        :param lazy_body: if True the body is not read upfront, a `BodyCapture`
+            (or None for binary content types) is stored instead
+        :param max_body_size: maximal number of captured bytes in lazy mode
+        :param projection: attributes of the request stored in the context
+        """
 
-        http_request = {
-            'requestMethod': request.method,
-            'requestUrl': request.url,
-            'body': body,
-            'paramsPatch': dict(request.path_params),
-            'paramsQuery': dict(request.query_params),
-            "headers": dict(request.headers),
-            "cookies": dict(request.cookies),
-            'requestSize': sys.getsizeof(request),
-            'remoteIp': request.client.host if request.client is not None else None,
-            'protocol': request.url.scheme,
-        }
+        projection = projection or DEFAULT_PROJECTION
+        body = None
+
+        if projection.body:
+
+            if lazy_body:
 
-        if 'referrer' in request.headers:
-            http_request['referrer'] = request.headers.get('referrer')
+                content_type = request.headers.get("content-type", "")
 
-        if 'user-agent' in request.headers:
-            http_request['userAgent'] = request.headers.get('user-agent')
+                if BodyCapture.is_capturable(content_type):
+                    body = BodyCapture(content_type, max_body_size)
 
-        HTTP_REQUEST_CONTEXT.set(http_request)
+            else:
+                body = await request.body()  # parsed when the context is logged
+
+        HTTP_REQUEST_CONTEXT.set(RequestContext(request, body, projection))
+
+    @staticmethod
+    def get_http_request_context() -> dict:
+        """Get the HTTP Request Context with the lazily captured body
+        parsed and attached to the context."""
+
+        http_request = HTTP_REQUEST_CONTEXT.get()
+
+        if isinstance(http_request, RequestContext):
+            return http_request.resolve()
+
+        return http_request
 
     @staticmethod
     def get_cloud_trace_context(request: Request):
@@ -73,14 +484,13 @@ class HTTPContext(object):
 
 
     @staticmethod
-    def get_trace_context():
-        """Get the trace context from the context variable."""
+    def get_trace_context() -> TraceContext:
+        """Get the trace context of the current request (outside of the request
+        the context is parsed from `CLOUD_TRACE_CONTEXT` or generated)."""
 
-        trace_id, span_id, flags = _parse_xcloud_trace(
-            CLOUD_TRACE_CONTEXT.get()
-        )
-        if trace_id is None:
-            trace_id = secrets.token_hex(16)
-        if span_id is None:
-            span_id = str(random.getrandbits(64))
-        return trace_id, span_id, flags
\ No newline at end of file
+        trace = TRACE_CONTEXT.get()
+
+        if trace is None:
+            trace = TraceContext.from_header(CLOUD_TRACE_CONTEXT.get())
+
+        return trace
\ No newline at end of file
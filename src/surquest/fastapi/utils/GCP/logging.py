@@ -12,25 +12,679 @@ The main source of inspiration for this module is the following:
 
 # import external modules
 import os
+import copy
+import sys
+import time
+import queue
+import random
+import atexit
+import json
 import logging
+import threading
+import contextvars
+import datetime as dt
+import urllib.error
+import urllib.parse
+import urllib.request
 
 # import internal modules
+from surquest.fastapi.schemas.responses.encoder import Encoder
 from .formatter import JSONFormatter
+from .project import ProjectID
+from .http_context import TRACE_CONTEXT
 
 
-__all__ = ["Logger", "setup_logging", "DEFAULT_LOGGER_NAME"]
+__all__ = [
+    "Logger",
+    "setup_logging",
+    "reconfigure_logging",
+    "is_logging_configured",
+    "get_logging_stats",
+    "BackgroundHandler",
+    "CloudLoggingHandler",
+    "SamplingFilter",
+    "DEFAULT_LOGGER_NAME"
+]
 
 DEFAULT_LOGGER_NAME = os.getenv('APP_NAME', "APILogger")
 
 Logger = logging.getLogger(DEFAULT_LOGGER_NAME)
 
+_CONFIGURED = False
+
+
+class BackgroundHandler(logging.Handler):
+    """Handler formatting and writing the log records on a background thread
+
+    The records are put on a bounded queue together with a copy of the
+    current context (so the formatter sees the request and trace context of
+    the caller). A worker thread formats them and writes them in batches.
+    Records are dropped (and counted) when the queue is full, so logging
+    never blocks the event loop, or when the handler is closed.
+
+    :param stream: output stream (defaults to `sys.stderr` as `StreamHandler`)
+    :param queue_size: maximal number of records waiting in the queue
+    :param batch_size: maximal number of records written at once
+    :param flush_interval: seconds to wait for more records to fill the batch
+    """
+
+    terminator = "\n"
+
+    _STOP = None  # sentinel stopping the worker
+
+    def __init__(
+            self,
+            stream=None,
+            queue_size: int = 10000,
+            batch_size: int = 500,
+            flush_interval: float = 0.0
+    ):
+        super().__init__()
+
+        self.stream = stream if stream is not None else sys.stderr
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.dropped = 0
+        self.written = 0
+        self.batches = 0
+        self.flush_latency_last = 0.0
+        self.flush_latency_max = 0.0
+        self.flush_latency_total = 0.0
+
+        self._closed = False
+        self._thread = threading.Thread(
+            target=self._run,
+            name=F"{self.__class__.__name__}-worker",
+            daemon=True
+        )
+        self._thread.start()
+
+        atexit.register(self.close)
+
+    def emit(self, record: logging.LogRecord):
+
+        if self._closed:
+            self.dropped += 1  # the worker is stopped
+            return
+
+        try:
+            self.queue.put_nowait((contextvars.copy_context(), self.prepare(record)))
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+
+    @staticmethod
+    def prepare(record: logging.LogRecord) -> logging.LogRecord:
+        """Returns copy of the record with the arguments merged into the
+        message on the caller thread (as `QueueHandler.prepare`), so later
+        changes of the mutable arguments are not logged"""
+
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+
+        return record
+
+    def _run(self):
+
+        while True:
+
+            batch = self._collect()
+            stop = batch and batch[-1] is self._STOP
+
+            if stop:
+                batch.pop()
+
+            if batch:
+                self.write_batch(batch)
+
+            for _ in range(len(batch) + stop):
+                self.queue.task_done()
+
+            if stop:
+                return
+
+    def _collect(self) -> list:
+        """Wait for the first record and collect the batch of records
+        available within `flush_interval`"""
+
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.flush_interval
+
+        while len(batch) < self.batch_size and batch[-1] is not self._STOP:
+
+            try:
+
+                timeout = deadline - time.monotonic()
+
+                if timeout > 0:
+                    batch.append(self.queue.get(timeout=timeout))
+                else:
+                    batch.append(self.queue.get_nowait())
+
+            except queue.Empty:
+                break
+
+        return batch
+
+    def format_batch(self, batch: list) -> list:
+        """Format the records within the context of the caller"""
+
+        lines = []
+
+        for context, record in batch:
+
+            try:
+                lines.append(context.run(self.format, record))
+            except Exception:
+                self.handleError(record)
+
+        return lines
+
+    def write_batch(self, batch: list):
+        """Format and write the batch of records to the stream"""
+
+        lines = self.format_batch(batch)
+
+        if not lines:
+            return
+
+        start = time.perf_counter()
+
+        try:
+            self.stream.write(self.terminator.join(lines) + self.terminator)
+            self.stream.flush()
+        except Exception:
+            self.handleError(batch[0][1])
+            return
+
+        self.record_flush(len(lines), time.perf_counter() - start)
+
+    def record_flush(self, written: int, latency: float):
+        """Update the statistics by the written batch"""
+
+        self.written += written
+        self.batches += 1
+        self.flush_latency_last = latency
+        self.flush_latency_total += latency
+        self.flush_latency_max = max(self.flush_latency_max, latency)
+
+    def flush(self):
+        """Wait until all queued records are written"""
+
+        if not self._closed:
+            self.queue.join()
+
+    def close(self):
+        """Write all queued records and stop the worker thread"""
+
+        if self._closed:
+            return
+
+        self._closed = True
+        atexit.unregister(self.close)
+
+        self.queue.put(self._STOP)
+        self._thread.join()
+
+        super().close()
+
+    def get_stats(self) -> dict:
+        """Returns statistics of the log pipeline"""
+
+        return {
+            "queue_depth": self.queue.qsize(),
+            "queue_size": self.queue.maxsize,
+            "dropped": self.dropped,
+            "written": self.written,
+            "batches": self.batches,
+            "flush_latency_last": self.flush_latency_last,
+            "flush_latency_max": self.flush_latency_max,
+            "flush_latency_avg": self.flush_latency_total / self.batches if self.batches else 0.0,
+        }
+
+
+class CloudLoggingHandler(BackgroundHandler):
+    """Handler writing the log entries directly to the Cloud Logging API
+    (`entries:write` method) instead of the standard error output
+
+    The structured entries produced by `JSONFormatter` are buffered on the
+    bounded queue of `BackgroundHandler` and written in batches once
+    `batch_size` entries are collected or `flush_interval` elapses.
+    Batches are split into requests of at most `max_request_bytes`.
+    Failed requests are retried with exponential backoff; entries of the
+    requests failing permanently are dropped (and counted). All queued entries
+    are written when the handler is closed (at the latest on interpreter exit).
+
+    The endpoint can be changed (e.g. to a local stand-in of the API in tests)
+    by `endpoint` parameter or `LOGGING_ENDPOINT` environment variable.
+    Requests to other than the default endpoint are not authenticated
+    unless `credentials` are given.
+
+    :param log_name: name of the log (`projects/PROJECT_ID/logs/LOG_NAME`)
+    :param project_id: Google Cloud project ID (resolved by `ProjectID` if not set)
+    :param resource: monitored resource of the entries (defaults to `global`)
+    :param endpoint: base URL of the Cloud Logging API
+    :param credentials: `google.auth` credentials (application default
+        credentials are used for the default endpoint)
+    :param max_retries: maximal number of retries of the failed request
+    :param backoff: initial delay between the retries (doubled by every retry)
+    :param max_backoff: maximal delay between the retries
+    :param timeout: timeout of the request in seconds
+    :param max_request_bytes: maximal size of the request body
+    :param handler_options: options of the `BackgroundHandler`
+    """
+
+    DEFAULT_ENDPOINT = "https://logging.googleapis.com"
+    WRITE_PATH = "/v2/entries:write"
+    SCOPES = ("https://www.googleapis.com/auth/logging.write",)
+
+    RETRY_STATUS_CODES = frozenset({408, 429, 500, 502, 503, 504})
+
+    # keys of the formatted entry mapped to the fields of the LogEntry
+    ENTRY_FIELDS = {
+        "severity": "severity",
+        "logging.googleapis.com/trace": "trace",
+        "logging.googleapis.com/spanId": "spanId",
+        "logging.googleapis.com/trace_sampled": "traceSampled",
+        "logging.googleapis.com/sourceLocation": "sourceLocation",
+    }
+
+    def __init__(
+            self,
+            log_name: str = None,
+            project_id: str = None,
+            resource: dict = None,
+            endpoint: str = None,
+            credentials=None,
+            max_retries: int = 5,
+            backoff: float = 0.5,
+            max_backoff: float = 30.0,
+            timeout: float = 10.0,
+            max_request_bytes: int = 5_000_000,
+            flush_interval: float = 1.0,
+            **handler_options
+    ):
+        self.project_id = ProjectID.resolve(project_id)
+        self.log_name = F"projects/{self.project_id}/logs/" + urllib.parse.quote(
+            log_name or DEFAULT_LOGGER_NAME, safe=""
+        )
+        self.resource = resource or {"type": "global"}
+        self.endpoint = (endpoint or os.getenv("LOGGING_ENDPOINT") or self.DEFAULT_ENDPOINT).rstrip("/")
+        self.credentials = credentials
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.max_request_bytes = max_request_bytes
+
+        self.requests = 0
+        self.retries = 0
+        self.failed_requests = 0
+
+        # static part of the request body
+        self._body_prefix = Encoder.dumps({
+            "logName": self.log_name,
+            "resource": self.resource,
+            "partialSuccess": True,
+        })[:-1] + b',"entries":['
+
+        super().__init__(flush_interval=flush_interval, **handler_options)
+
+        self.setFormatter(JSONFormatter(project_id=self.project_id))
+
+    def format_entry(self, record: logging.LogRecord) -> bytes:
+        """Convert the record to serialized LogEntry
+        see https://cloud.google.com/logging/docs/reference/v2/rest/v2/LogEntry"""
+
+        formatter = self.formatter
+
+        if isinstance(formatter, JSONFormatter):
+
+            payload = formatter.format_dict(record)
+            entry = {
+                field: payload.pop(key)
+                for key, field in self.ENTRY_FIELDS.items()
+                if key in payload
+            }
+            entry["jsonPayload"] = payload
+            default = formatter.json_default
+
+        else:
+
+            entry = {
+                "severity": record.levelname,
+                "textPayload": self.format(record),
+            }
+            default = None
+
+        entry["timestamp"] = dt.datetime.fromtimestamp(
+            record.created, tz=dt.timezone.utc
+        ).isoformat()
+
+        try:
+            return Encoder.dumps(entry, default=default)
+        except ValueError:
+            # out of range floats (NaN, Infinity) are not valid JSON
+            return json.dumps(entry, default=default).encode("utf-8")
+
+    def format_batch(self, batch: list) -> list:
+        """Format the records to serialized entries within the context of the caller"""
+
+        entries = []
+
+        for context, record in batch:
+
+            try:
+                entries.append(context.run(self.format_entry, record))
+            except Exception:
+                self.handleError(record)
+
+        return entries
+
+    def write_batch(self, batch: list):
+        """Format the batch of records and write them in one or more requests"""
+
+        entries = self.format_batch(batch)
+        chunk, size = [], 0
+
+        for entry in entries:
+
+            if chunk and size + len(entry) > self.max_request_bytes:
+                self.write_entries(chunk)
+                chunk, size = [], 0
+
+            chunk.append(entry)
+            size += len(entry) + 1
+
+        if chunk:
+            self.write_entries(chunk)
+
+    def write_entries(self, entries: list):
+        """Write the serialized entries in single request (with retries)"""
+
+        body = self._body_prefix + b",".join(entries) + b"]}"
+        delay = self.backoff
+        start = time.perf_counter()
+
+        for attempt in range(self.max_retries + 1):
+
+            if attempt:
+                self.retries += 1
+                time.sleep(delay * (0.5 + random.random() / 2))  # jitter
+                delay = min(delay * 2, self.max_backoff)
+
+            self.requests += 1
+
+            try:
+                self.send(body)
+            except urllib.error.HTTPError as exc:
+                if exc.code not in self.RETRY_STATUS_CODES:
+                    break
+            except (urllib.error.URLError, OSError):
+                pass  # connection errors and timeouts
+            else:
+                self.record_flush(len(entries), time.perf_counter() - start)
+                return
+
+        self.failed_requests += 1
+        self.dropped += len(entries)
+
+    def send(self, body: bytes):
+        """Send the request to the `entries:write` method of the API"""
+
+        request = urllib.request.Request(
+            self.endpoint + self.WRITE_PATH,
+            data=body,
+            headers=self.get_headers(),
+            method="POST"
+        )
+
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def get_headers(self) -> dict:
+        """Returns headers of the request with authorization token"""
+
+        headers = {"Content-Type": "application/json"}
+
+        if self.credentials is None and self.endpoint == self.DEFAULT_ENDPOINT:
+
+            import google.auth
+            self.credentials, _ = google.auth.default(scopes=self.SCOPES)
+
+        if self.credentials is not None:
+
+            if not self.credentials.valid:
+
+                import google.auth.transport.requests
+                self.credentials.refresh(google.auth.transport.requests.Request())
+
+            headers["Authorization"] = F"Bearer {self.credentials.token}"
+
+        return headers
+
+    def get_stats(self) -> dict:
+        """Returns statistics of the log pipeline including the API requests"""
+
+        return {
+            **super().get_stats(),
+            "requests": self.requests,
+            "retries": self.retries,
+            "failed_requests": self.failed_requests,
+        }
+
+
+class SamplingFilter(logging.Filter):
+    """Filter keeping only a fraction of the log records of lower severity
+
+    The decision is made per trace (not per record): the low 64 bits of the
+    trace ID of the request (see `TRACE_CONTEXT`) are compared with the rate
+    of the record level, so the logs of one request are kept or dropped
+    as a unit. As the same value is compared with all the rates, a request
+    with kept DEBUG records keeps also its INFO records (if the INFO rate
+    is not lower). Records outside of a request are sampled randomly.
+
+    Records of the requests sampled by the caller (`o=1` option
+    of `X-Cloud-Trace-Context` header) and records of `always_keep` level
+    and above are always kept.
+
+    The filter is attached to the handler, so dropped records are never
+    queued or formatted.
+
+    :param rates: sampling rate (0.0 - 1.0) per level name or number,
+        levels without rate are kept (e.g. `{"DEBUG": 0.01, "INFO": 0.1}`)
+    :param loggers: rates per logger name overriding `rates`
+        for the logger and its children (e.g. `{"APILogger.db": {"DEBUG": 0.0}}`)
+    :param always_keep: records of this level and above are always kept
+    """
+
+    def __init__(
+            self,
+            rates: dict = None,
+            loggers: dict = None,
+            always_keep: int = logging.ERROR
+    ):
+        super().__init__()
+
+        self.rates = self.parse_rates(rates or {})
+        self.loggers = {
+            name: self.parse_rates(logger_rates)
+            for name, logger_rates in (loggers or {}).items()
+        }
+        self.always_keep = always_keep
+
+        self.kept = 0
+        self.dropped = 0
+
+        self._thresholds = {}
+
+    @staticmethod
+    def parse_rates(rates: dict) -> dict:
+        """Returns the rates keyed by level number"""
+
+        parsed = {}
+
+        for level, rate in rates.items():
+
+            if isinstance(level, str):
+                level = logging.getLevelName(level.upper())
+
+            if not isinstance(level, int):
+                raise ValueError(F"Unknown logging level: `{level}`")
+
+            if not 0.0 <= rate <= 1.0:
+                raise ValueError(F"Sampling rate must be between 0 and 1: `{rate}`")
+
+            parsed[level] = rate
+
+        return parsed
+
+    def get_rates(self, name: str) -> dict:
+        """Returns the rates of the logger (the most specific override)"""
+
+        while name:
+
+            if name in self.loggers:
+                return self.loggers[name]
+
+            name = name.rpartition(".")[0]
+
+        return self.rates
+
+    def get_threshold(self, name: str, levelno: int):
+        """Returns the 64-bit threshold of the logger and level
+        (or None if the records are not sampled)"""
+
+        key = (name, levelno)
+
+        try:
+            return self._thresholds[key]
+        except KeyError:
+            pass
+
+        rate = self.get_rates(name).get(levelno)
+        threshold = None if rate is None else int(rate * 2 ** 64)
+        self._thresholds[key] = threshold
+
+        return threshold
+
+    def filter(self, record: logging.LogRecord) -> bool:
+
+        if record.levelno >= self.always_keep:
+            return True
+
+        threshold = self.get_threshold(record.name, record.levelno)
+
+        if threshold is None:
+            return True
+
+        trace_context = TRACE_CONTEXT.get()
+
+        if trace_context is None:
+            value = random.getrandbits(64)
+        elif trace_context.sampled:
+            return True
+        else:
+            value = int(trace_context.trace_id[-16:], 16)
+
+        if value < threshold:
+            self.kept += 1
+            return True
+
+        self.dropped += 1
+        return False
+
+    def get_stats(self) -> dict:
+        """Returns the number of sampled records kept and dropped"""
+
+        return {
+            "kept": self.kept,
+            "dropped": self.dropped,
+        }
+
+
+def get_logging_stats() -> dict:
+    """Returns statistics of the background handlers and sampling filters
+    of the Logger"""
+
+    stats = {}
+
+    for handler in Logger.handlers:
+
+        name = handler.get_name() or handler.__class__.__name__
+
+        if isinstance(handler, BackgroundHandler):
+            stats[name] = handler.get_stats()
+
+        for log_filter in handler.filters:
+
+            if isinstance(log_filter, SamplingFilter):
+                stats.setdefault(name, {})["sampling"] = log_filter.get_stats()
+
+    return stats
+
+
+def is_logging_configured() -> bool:
+    """Returns True if the Logger was already configured by `setup_logging`"""
+
+    return _CONFIGURED
+
+
+def reconfigure_logging(level=logging.DEBUG, **options):
+    """Configure the Logger again replacing the current handlers
+    (e.g. after change of the environment variables)"""
+
+    setup_logging(level=level, force=True, **options)
+
+
+def setup_logging(
+        level=logging.DEBUG,
+        force=False,
+        background=False,
+        cloud_logging=False,
+        sampling=None,
+        **handler_options
+):
+    """Configure the Logger with JSON formatter (or plain text formatter
+    for `ENV=LOCAL`), the `CloudLoggingHandler` keeps its own formatter
+
+    The configuration is done only once per process: repeated calls are
+    no-op unless `force` is True, see `reconfigure_logging`.
+
+    :param level: logging level
+    :param force: replace the existing configuration
+    :param background: format and write the records on a background thread
+        (see `BackgroundHandler`)
+    :param cloud_logging: write the entries directly to the Cloud Logging API
+        (see `CloudLoggingHandler`)
+    :param sampling: `SamplingFilter` or its options (e.g. `{"rates": {"DEBUG": 0.01}}`)
+        dropping a fraction of the low severity records
+    :param handler_options: options of the `BackgroundHandler`
+        or `CloudLoggingHandler`
+    """
+
+    global _CONFIGURED
+
+    if _CONFIGURED and not force:
+        return
 
-def setup_logging(level=logging.DEBUG):
     # get default handler
-    handler = logging.StreamHandler()
+    if cloud_logging:
+        handler = CloudLoggingHandler(**handler_options)
+    elif background:
+        handler = BackgroundHandler(**handler_options)
+    else:
+        handler = logging.StreamHandler()
 
+    if isinstance(handler, CloudLoggingHandler):
+        # keep the formatter of the handler (trace of its project)
+        handler.setLevel(level)
 
-    if os.getenv("ENV", "").upper() != "LOCAL":
+    elif os.getenv("ENV", "").upper() != "LOCAL":
         json_formatter = JSONFormatter()
         handler.setFormatter(json_formatter)
         handler.setLevel(level)
@@ -43,7 +697,19 @@ def setup_logging(level=logging.DEBUG):
         handler.setFormatter(formatter)
         handler.setLevel(level)
 
+    if sampling is not None:
+
+        if isinstance(sampling, dict):
+            sampling = SamplingFilter(**sampling)
+
+        handler.addFilter(sampling)
+
     # set logger
+    for old_handler in Logger.handlers:
+        old_handler.close()
+
     Logger.handlers = []
     Logger.addHandler(handler)
     Logger.setLevel(level)
+
+    _CONFIGURED = True
@@ -1,92 +1,487 @@
 # import external modules
+import time
+import logging
+import functools
+import threading
 from starlette.requests import Request
-from starlette.middleware.base import (
-    BaseHTTPMiddleware,
-    RequestResponseEndpoint
-)
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 # import internal modules
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.timing import ServerTiming, SERVER_TIMING
+from surquest.fastapi.utils.metrics import REGISTRY
 from .catcher import Catcher
-from .http_context import HTTPContext
-from .logging import setup_logging
+from .http_context import HTTPContext, HTTP_REQUEST_CONTEXT, BodyCapture, ContextProjection
+from .observability import ObservabilityProfile, ProfileResolver, TRACE_ONLY
+from .logging import Logger, setup_logging
 
 
 __all__ = [
     "BasicMiddleware",
     "LoggingMiddleware",
-    "DBMiddleware"
+    "DBMiddleware",
+    "DBPool"
 ]
 
-class BasicMiddleware(BaseHTTPMiddleware):
+REQUESTS = REGISTRY.counter(
+    "http_requests_total",
+    "Number of HTTP requests",
+    labels=("method", "route", "status")
+)
 
-    def __init__(self, app):
-        super().__init__(app)
+REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests in seconds",
+    labels=("method", "route", "status")
+)
 
-    @staticmethod
-    async def dispatch(
-            request: Request,
-            call_next: RequestResponseEndpoint
-    ):
+
+class BasicMiddleware:
+    """Pure ASGI middleware catching unhandled exceptions
+
+    Unlike Starlette's `BaseHTTPMiddleware` the request is passed to the
+    wrapped application directly (no extra task or memory stream per request)
+    so the streaming responses are not buffered.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        await self.call_next(Request(scope, receive), receive, send)
+
+    async def call_next(self, request: Request, receive: Receive, send: Send):
+        """Call the wrapped application and convert unhandled exceptions
+        into the standard error response via `Catcher.catch_internal_error`
+
+        :param request: Request wrapping the current scope
+        :param receive: ASGI receive channel passed to the application
+        :param send: ASGI send channel
+        """
+
+        response_started = False
+        status_code = 500
+        start = time.perf_counter()
+
+        # with stacked middlewares the request is recorded by the outermost one
+        record_metrics = "metrics_recorded" not in request.scope
+        request.scope["metrics_recorded"] = True
+
+        async def send_wrapper(message: Message):
+
+            nonlocal response_started, status_code
+
+            if message["type"] == "http.response.start":
+                response_started = True
+                status_code = message["status"]
+
+            await send(message)
 
         try:
 
-            response = await call_next(request)
-            return response
+            await self.app(request.scope, receive, send_wrapper)
 
-        except BaseException as exc:
+        except Exception as exc:
 
-            return await Catcher.catch_internal_error(request, exc)
+            if response_started:
+                # the response can not be replaced once its headers were sent
+                raise
 
-class LoggingMiddleware(BaseHTTPMiddleware):
+            response = await Catcher.catch_internal_error(request, exc)
+            await response(request.scope, receive, send)
 
-    def __init__(self, app):
-        super().__init__(app)
+        finally:
+
+            if record_metrics:
+                self.record_metrics(request.scope, status_code, time.perf_counter() - start)
 
     @staticmethod
-    async def dispatch(
-            request: Request,
-            call_next: RequestResponseEndpoint
+    def record_metrics(scope: Scope, status_code: int, duration: float):
+        """Count the request and its duration by the route template
+        (e.g. `/users/{user_id}`, `-` for requests not matching any route)"""
+
+        labels = (
+            scope["method"],
+            getattr(scope.get("route"), "path", "-"),
+            str(status_code)
+        )
+
+        REQUESTS.inc(*labels)
+        REQUEST_DURATION.observe(duration, *labels)
+
+    @staticmethod
+    async def replay_body(request: Request, receive: Receive) -> Receive:
+        """Returns receive channel replaying the request body already
+        consumed by the middleware to the wrapped application
+
+        :param request: Request with body already read
+        :param receive: original ASGI receive channel
+        :return: ASGI receive channel
+        """
+
+        body = await request.body()  # cached by the request
+        replayed = False
+
+        async def receive_wrapper() -> Message:
+
+            nonlocal replayed
+
+            if not replayed:
+
+                replayed = True
+                return {
+                    "type": "http.request",
+                    "body": body,
+                    "more_body": False
+                }
+
+            return await receive()
+
+        return receive_wrapper
+
+
+class LoggingMiddleware(BasicMiddleware):
+    """Middleware setting up the request context
+
+    The logging is configured once when the middleware is created
+    (no-op if it was already configured at application startup).
+
+    :param app: ASGI application
+    :param lazy_body: capture the request body lazily (see `BodyCapture`)
+    :param max_body_size: maximal number of captured bytes in lazy mode
+    :param logging_level: level passed to `setup_logging`
+    :param server_timing: measure the phases of the requests (see `ServerTiming`),
+        report them by `Server-Timing` response header and log access log entry
+        with the timings
+    :param projection: attributes of the request stored in the request context
+        (see `ContextProjection`, by default all except credentials)
+    :param profile: observability profile of the routes without `observability`
+        decorator (see `ObservabilityProfile`)
+    """
+
+    def __init__(
+            self,
+            app: ASGIApp,
+            lazy_body: bool = False,
+            max_body_size: int = BodyCapture.MAX_SIZE,
+            logging_level: int = logging.DEBUG,
+            server_timing: bool = False,
+            projection: ContextProjection = None,
+            profile="full"
     ):
+        super().__init__(app)
+        self.lazy_body = lazy_body
+        self.max_body_size = max_body_size
+        self.server_timing = server_timing
+        self.projection = projection or ContextProjection()
+
+        if not isinstance(profile, ObservabilityProfile):
+            profile = ObservabilityProfile(profile)
+
+        self.profiles = ProfileResolver(default=profile)
+        self._projections = {}  # projection per profile
+
+        if server_timing:
+            # duration of the serialization reported by `Server-Timing` header
+            Response.serialization_hook = functools.partial(ServerTiming.record, ServerTiming.SERIALIZATION)
+
+        setup_logging(level=logging_level)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope, receive)
+        profile = self.profiles.get_profile(scope)
+
+        if not profile.trace:
+            await self.call_next(request, receive, send)
+            return
+
+        if self.server_timing:
+            await self.call_timed(request, receive, send, profile)
+            return
+
+        await self.call_next(
+            request,
+            await self.set_context(request, receive, profile),
+            send
+        )
+
+    async def set_context(
+            self,
+            request: Request,
+            receive: Receive,
+            profile: ObservabilityProfile,
+            timing: ServerTiming = None
+    ) -> Receive:
+        """Set the trace and request context selected by the profile
+
+        :param request: Request
+        :param receive: original ASGI receive channel
+        :param profile: observability profile of the route
+        :param timing: timing of the request (measures the body capture)
+        :return: ASGI receive channel for the wrapped application
+        """
 
         await HTTPContext.set_cloud_trace_context(request)
-        await HTTPContext.set_http_request_context(request)
 
-        setup_logging()
+        if profile.sample_rate < 1.0 and not profile.is_sampled(HTTPContext.get_trace_context().trace_id):
+            profile = TRACE_ONLY
+
+        if not profile.context:
+            HTTP_REQUEST_CONTEXT.set({})
+            return receive
+
+        projection = self._projections.get(profile)
+
+        if projection is None:
+            projection = self._projections[profile] = profile.get_projection(self.projection)
+
+        if timing is not None and not self.lazy_body and projection.body:
+            body_start = time.perf_counter()
+            await request.body()  # cached by the request for the context
+            timing.durations[ServerTiming.BODY] += time.perf_counter() - body_start
+
+        await HTTPContext.set_http_request_context(
+            request,
+            lazy_body=self.lazy_body,
+            max_body_size=self.max_body_size,
+            projection=projection
+        )
+
+        return await self.wrap_receive(request, receive)
+
+    async def call_timed(self, request: Request, receive: Receive, send: Send, profile: ObservabilityProfile):
+        """Process the request measuring its phases (context setup, body
+        capture, handler up to the start of the response), add `Server-Timing`
+        header to the response and log access log entry with the timings"""
+
+        timing = ServerTiming()
+        token = SERVER_TIMING.set(timing)
+        status_code = None
+
+        start = time.perf_counter()
+        wrapped_receive = await self.set_context(request, receive, profile, timing)
+        timing.durations[ServerTiming.CONTEXT] += (
+            time.perf_counter() - start - timing.durations[ServerTiming.BODY]
+        )
+
+        handler_start = time.perf_counter()
+
+        async def send_wrapper(message: Message):
+
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+
+                status_code = message["status"]
+                timing.durations[ServerTiming.HANDLER] += time.perf_counter() - handler_start
+
+                headers = list(message.get("headers", ()))
+                headers.append((b"server-timing", timing.header().encode("latin-1")))
+                message = {**message, "headers": headers}
+
+            await send(message)
 
         try:
+            await self.call_next(request, wrapped_receive, send_wrapper)
+        finally:
 
-            response = await call_next(request)
-            return response
+            if Logger.isEnabledFor(logging.INFO):
+                Logger.info(
+                    F"{request.method} {request.url.path} {status_code}",
+                    extra={"status": status_code, "timing": timing.to_dict()}
+                )
 
-        except BaseException as exc:
+            SERVER_TIMING.reset(token)
 
-            return await Catcher.catch_internal_error(request, exc)
+    async def wrap_receive(self, request: Request, receive: Receive) -> Receive:
+        """Returns receive channel for the wrapped application: the eagerly
+        read body is replayed, the lazily captured body is copied while
+        the application reads it
 
+        :param request: Request
+        :param receive: original ASGI receive channel
+        :return: ASGI receive channel
+        """
 
-class DBMiddleware(BaseHTTPMiddleware):
+        body = HTTP_REQUEST_CONTEXT.get().body
+
+        if isinstance(body, BodyCapture):
+            return body.wrap(receive)
+
+        if isinstance(body, bytes):
+            return await self.replay_body(request, receive)
+
+        return receive
+
+
+class DBPool(object):
+    """Database engine (and its connection pool) shared by all requests
+    of the worker process
+
+    The engine is created by `db.get_engine()` on first use and disposed
+    at application shutdown.
+
+    :param db: object providing `get_engine()` method (SQLAlchemy engine)
+    """
+
+    def __init__(self, db):
 
-    def __init__(self, app, db=None, ):
-        super().__init__(app)
         self.db = db
+        self.engine = None
+        self.connections = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self._lock = threading.Lock()
 
-    async def dispatch(self, request: Request, call_next):
+    def get_engine(self):
+        """Returns the shared engine (created on first call)"""
 
-        try:
+        if self.engine is None:
 
-            await HTTPContext.set_cloud_trace_context(request)
-            await HTTPContext.set_http_request_context(request)
+            with self._lock:
 
-            setup_logging()
+                if self.engine is None:
+                    self.engine = self.db.get_engine()
 
-            request.state.db_engine = self.db.get_engine()
+        return self.engine
 
-            response = await call_next(request)
-            return response
+    def connect(self):
+        """Returns connection checked out from the pool of the shared engine"""
 
-        except BaseException as exc:
+        start = time.perf_counter()
+        connection = self.get_engine().connect()
+        wait_time = time.perf_counter() - start
 
-            return await Catcher.catch_internal_error(request, exc)
+        self.connections += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+
+        return connection
+
+    def dispose(self):
+        """Close all pooled connections and drop the engine"""
+
+        if self.engine is not None:
+            self.engine.dispose()
+            self.engine = None
+
+    def get_stats(self) -> dict:
+        """Returns statistics of the connection pool"""
+
+        stats = {
+            "connections": self.connections,
+            "wait_time_total": self.wait_time_total,
+            "wait_time_max": self.wait_time_max,
+            "wait_time_avg": self.wait_time_total / self.connections if self.connections else 0.0,
+        }
+
+        pool = getattr(self.engine, "pool", None)
+
+        for key, method in (
+            ("size", "size"),
+            ("checked_in", "checkedin"),
+            ("checked_out", "checkedout"),
+            ("overflow", "overflow"),
+        ):
+            if hasattr(pool, method):
+                stats[key] = getattr(pool, method)()
+
+        return stats
+
+
+class DBMiddleware(LoggingMiddleware):
+    """Middleware sharing database engine across the requests
+
+    The engine is created once per worker and disposed at application
+    shutdown (lifespan). Each request gets:
+
+    * `request.state.db_engine`: the shared engine
+    * `request.state.db_pool`: the `DBPool` (e.g. for `get_stats()`)
+    * connection checked out lazily by `DBMiddleware.get_connection(request)`
+      and returned to the pool at the end of the request
+
+    :param app: ASGI application
+    :param db: object providing `get_engine()` method
+    :param options: options of the `LoggingMiddleware` (server timing,
+        projection, profile etc.)
+    """
+
+    def __init__(self, app: ASGIApp, db=None, **options):
+        super().__init__(app, **options)
+        self.db = db
+        self.pool = DBPool(db)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+
+        if scope["type"] == "lifespan":
+            await self.app(scope, receive, self.wrap_lifespan_send(send))
+            return
+
+        await super().__call__(scope, receive, send)
+
+    async def call_next(self, request: Request, receive: Receive, send: Send):
+        """Provide the shared engine to the request (within the context set up
+        by `LoggingMiddleware`) and return the connection of the request
+        to the pool when the request is processed"""
+
+        try:
+
+            request.state.db_pool = self.pool
+            request.state.db_engine = self.pool.get_engine()
+
+        except Exception as exc:
+
+            response = await Catcher.catch_internal_error(request, exc)
+            await response(request.scope, receive, send)
+            return
+
+        try:
+
+            await super().call_next(request, receive, send)
 
         finally:
 
-            request.state.db_engine.dispose()
+            connection = request.scope["state"].pop("db_connection", None)
+
+            if connection is not None:
+                connection.close()  # return connection to the pool
+
+    def wrap_lifespan_send(self, send: Send) -> Send:
+        """Returns send channel disposing the engine at application shutdown"""
+
+        async def send_wrapper(message: Message):
+
+            if message["type"] in ("lifespan.shutdown.complete", "lifespan.shutdown.failed"):
+                self.pool.dispose()
+
+            await send(message)
+
+        return send_wrapper
+
+    @staticmethod
+    def get_connection(request: Request):
+        """Returns connection of the request checked out from the shared pool
+        on first call (it is returned to the pool at the end of the request)"""
+
+        connection = getattr(request.state, "db_connection", None)
+
+        if connection is None:
+            connection = request.state.db_connection = request.state.db_pool.connect()
+
+        return connection
+
+    @staticmethod
+    def get_pool_stats(request: Request) -> dict:
+        """Returns statistics of the shared connection pool"""
+
+        return request.state.db_pool.get_stats()
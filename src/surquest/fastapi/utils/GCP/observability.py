@@ -0,0 +1,168 @@
+"""Per-route observability profiles of the `LoggingMiddleware`
+
+The endpoints select the profile by `observability` decorator:
+
+    @app.get("/health")
+    @observability("off")
+    async def health():
+        ...
+
+    @app.get("/users/{user_id}")
+    @observability("headers-only", sample_rate=0.1)
+    async def get_user(user_id: int):
+        ...
+
+The profiles of the routes are resolved once (on the first request) and
+looked up by the path of the request (static routes) or by the route
+templates, the first matching route wins as in the routing of Starlette.
+"""
+
+# import internal modules
+from .http_context import ContextProjection
+
+__all__ = [
+    "ObservabilityProfile",
+    "ProfileResolver",
+    "observability"
+]
+
+
+class ObservabilityProfile(object):
+    """Selection of the observability features of the requests
+
+    * `full`: trace context, request context with the body
+    * `headers-only`: trace context, request context without the body
+    * `trace-only`: trace context only (logs are correlated with the trace)
+    * `off`: no context, no `Server-Timing` and access log (unhandled errors
+      are still caught and the request is counted in the metrics)
+
+    :param name: name of the profile
+    :param sample_rate: fraction of the requests observed with the profile,
+        the others are observed as `trace-only` (decided by the trace ID,
+        so all the requests of the trace are observed the same way)
+    """
+
+    LEVELS = ("off", "trace-only", "headers-only", "full")
+
+    TRACE_ID_LIMIT = (1 << 64) - 1
+
+    __slots__ = ("name", "trace", "context", "body", "sample_rate", "bound")
+
+    def __init__(self, name: str = "full", sample_rate: float = 1.0):
+
+        if name not in self.LEVELS:
+            raise ValueError(F"Unknown observability profile: `{name}`, use one of {self.LEVELS}")
+
+        if not 0.0 <= sample_rate <= 1.0:
+            raise ValueError(F"Sample rate must be between 0 and 1: `{sample_rate}`")
+
+        level = self.LEVELS.index(name)
+
+        self.name = name
+        self.trace = level >= 1
+        self.context = level >= 2
+        self.body = level >= 3
+        self.sample_rate = sample_rate
+        self.bound = round(sample_rate * (self.TRACE_ID_LIMIT + 1))
+
+    def __repr__(self):
+        return F"{self.__class__.__name__}({self.name!r}, sample_rate={self.sample_rate!r})"
+
+    def is_sampled(self, trace_id: str) -> bool:
+        """Returns True if the request of the trace is observed with the profile"""
+
+        return self.sample_rate >= 1.0 or int(trace_id[-16:], 16) < self.bound
+
+    def get_projection(self, projection: ContextProjection = None) -> ContextProjection:
+        """Returns the projection of the request context restricted by the profile"""
+
+        projection = projection or ContextProjection()
+
+        if self.body or not projection.body:
+            return projection
+
+        return projection.without_body()
+
+
+TRACE_ONLY = ObservabilityProfile("trace-only")
+
+
+def observability(profile: str = "full", sample_rate: float = 1.0):
+    """Decorator selecting the observability profile of the endpoint
+    (the endpoint is returned unchanged)
+
+    :param profile: `full`, `headers-only`, `trace-only` or `off`
+    :param sample_rate: fraction of the requests observed with the profile
+        (the others are observed as `trace-only`)
+    """
+
+    selected = ObservabilityProfile(profile, sample_rate)
+
+    def decorator(endpoint):
+
+        endpoint.__observability__ = selected
+        return endpoint
+
+    return decorator
+
+
+class ProfileResolver(object):
+    """Profiles of the routes of the application resolved once
+
+    :param default: profile of the routes without `observability` decorator
+    """
+
+    def __init__(self, default: ObservabilityProfile = None):
+
+        self.default = default or ObservabilityProfile()
+        self.static = {}  # (method, path): (position, profile)
+        self.templated = []  # (position, methods, path regex, profile) in order of the routes
+        self.resolved = False
+
+    def resolve(self, app):
+        """Collect the profiles of the routes of the application"""
+
+        static, templated = {}, []
+
+        for position, route in enumerate(getattr(app, "routes", ())):
+
+            if not hasattr(route, "path_regex"):
+                continue  # e.g. mounted applications
+
+            profile = getattr(getattr(route, "endpoint", None), "__observability__", None) or self.default
+            methods = getattr(route, "methods", None) or ("GET",)
+
+            if not route.param_convertors:
+                for method in methods:
+                    static.setdefault((method, route.path), (position, profile))
+            else:
+                templated.append((position, frozenset(methods), route.path_regex, profile))
+
+        self.static, self.templated = static, templated
+        self.resolved = True
+
+    def get_profile(self, scope) -> ObservabilityProfile:
+        """Returns the profile of the route serving the request i.e. the first
+        matching route as routed by Starlette"""
+
+        if not self.resolved:
+            self.resolve(scope.get("app"))
+
+        method = scope["method"]
+        path = scope["path"]
+        root_path = scope.get("root_path")
+
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):]
+
+        static = self.static.get((method, path))
+
+        for position, methods, path_regex, profile in self.templated:
+
+            if static is not None and position > static[0]:
+                break  # the static route is declared first
+
+            if method in methods and path_regex.match(path):
+                return profile
+
+        return static[1] if static is not None else self.default
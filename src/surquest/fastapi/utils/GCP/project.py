@@ -0,0 +1,110 @@
+"""Resolution of the Google Cloud project ID
+
+The project ID is resolved without instantiating any Google Cloud client:
+
+1. explicitly configured value
+2. environment variables (`GOOGLE_CLOUD_PROJECT`, `GCLOUD_PROJECT`, `GCP_PROJECT`)
+3. metadata server (single request with bounded timeout, skipped in offline
+   mode i.e. with `GCP_OFFLINE=true`)
+
+The resolved value is cached for the whole process.
+"""
+
+# import external modules
+import os
+import threading
+import urllib.request
+
+__all__ = ["ProjectID"]
+
+
+class ProjectID(object):
+
+    UNKNOWN = "-"
+
+    ENV_VARS = ("GOOGLE_CLOUD_PROJECT", "GCLOUD_PROJECT", "GCP_PROJECT")
+
+    # IP address is used by default to avoid (unbounded) DNS resolution
+    METADATA_HOST = "169.254.169.254"
+    METADATA_PATH = "/computeMetadata/v1/project/project-id"
+    METADATA_TIMEOUT = 0.5
+
+    _cached = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def resolve(cls, project_id: str = None, offline: bool = None) -> str:
+        """Returns the project ID (or "-" if it can not be resolved)
+
+        :param project_id: explicitly configured project ID
+        :param offline: skip the metadata server lookup
+            (defaults to `GCP_OFFLINE` environment variable)
+        :return: project ID
+        """
+
+        if project_id:
+            return project_id
+
+        if cls._cached is not None:
+            return cls._cached
+
+        with cls._lock:
+
+            if cls._cached is None:
+
+                if offline is None:
+                    offline = os.getenv("GCP_OFFLINE", "").lower() in ("1", "true", "yes")
+
+                cls._cached = (
+                    cls.from_env()
+                    or (None if offline else cls.from_metadata_server())
+                    or cls.UNKNOWN
+                )
+
+        return cls._cached
+
+    @classmethod
+    def reset(cls):
+        """Drop the cached project ID"""
+
+        cls._cached = None
+
+    @classmethod
+    def from_env(cls):
+        """Returns project ID from environment variables (or None)"""
+
+        for name in cls.ENV_VARS:
+
+            value = os.getenv(name)
+
+            if value:
+                return value
+
+    @classmethod
+    def from_metadata_server(cls, timeout: float = None):
+        """Returns project ID from the metadata server (or None if the server
+        is not available within the timeout)
+
+        The host can be changed by `GCE_METADATA_HOST` environment variable.
+        """
+
+        host = os.getenv("GCE_METADATA_HOST", cls.METADATA_HOST)
+        request = urllib.request.Request(
+            F"http://{host}{cls.METADATA_PATH}",
+            headers={"Metadata-Flavor": "Google"}
+        )
+
+        try:
+
+            with urllib.request.urlopen(
+                    request,
+                    timeout=cls.METADATA_TIMEOUT if timeout is None else timeout
+            ) as response:
+
+                if response.headers.get("Metadata-Flavor") != "Google":
+                    return None
+
+                return response.read().decode("utf-8").strip() or None
+
+        except Exception:
+            return None
@@ -1,14 +1,16 @@
 import os
+import inspect
+import functools
+import contextlib
 from opentelemetry import trace
-from opentelemetry.trace import NonRecordingSpan
-from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
-from opentelemetry.sdk.trace import TracerProvider, SpanContext, RandomIdGenerator
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.sdk.trace.sampling import ALWAYS_ON
+from opentelemetry.trace import NonRecordingSpan, SpanContext, TraceFlags
+
+from surquest.fastapi.utils.timing import SERVER_TIMING, ServerTiming
 
 from .http_context import (
     HTTPContext
 )
+from .logging import Logger
 
 __all__ = [
     "Tracer"
@@ -16,39 +18,243 @@ __all__ = [
 
 DEFAULT_TRACER_NAME = os.getenv('APP_NAME', "APILogger")
 
-tracer_provider = TracerProvider(sampler=ALWAYS_ON)  # always trace
-trace.set_tracer_provider(tracer_provider)
-# cloud_trace_exporter = CloudTraceSpanExporter()
-try:
-    cloud_trace_exporter = CloudTraceSpanExporter()
-except Exception as e:
-    print("CloudTraceSpanExporter not initialized")
-    print(e)
-    cloud_trace_exporter = None
-
-if cloud_trace_exporter is not None:    
-    tracer_provider.add_span_processor(
-        # BatchSpanProcessor buffers spans and sends them in batches in a
-        # background thread. The default parameters are sensible, but can be
-        # tweaked to optimize your performance
-        BatchSpanProcessor(cloud_trace_exporter)
-    )
 
 class Tracer:
+    """Tracer exporting spans to Cloud Trace
+
+    The OpenTelemetry SDK and the Cloud Trace exporter are loaded and set up
+    on first use (or explicitly by `Tracer.setup()` e.g. at application
+    startup) so they do not slow down the import of the package.
+
+    Spans are started by `Tracer.start_span()` context manager or by
+    `Tracer.span()` decorator. The parent span of the request (span of the
+    caller) and the sampling decision are built once per request.
+    """
+
+    enabled = os.getenv("TRACING_ENABLED", "true").lower() not in ("0", "false", "no")
+
+    provider = None
+    tracer = None
+    exporter = None
+    processor = None
+    sampler = None
+
+    @classmethod
+    def setup(
+            cls,
+            enabled: bool = None,
+            ratio: float = None,
+            parent_based: bool = True,
+            routes: dict = None,
+            sampler=None,
+            exporter=None,
+            max_queue_size: int = 2048,
+            max_export_batch_size: int = 512,
+            schedule_delay_millis: float = 5000,
+            export_timeout_millis: float = 30000
+    ):
+        """Set up the tracer provider with Cloud Trace exporter
+
+        :param enabled: enable tracing (defaults to `TRACING_ENABLED` environment
+            variable), spans are not created when disabled
+        :param ratio: sampling ratio of the traces (defaults to
+            `TRACE_SAMPLING_RATIO` environment variable or 1.0 i.e. always sample)
+        :param parent_based: honor the sampling decision of the caller
+            (`o=` option of `X-Cloud-Trace-Context` header)
+        :param routes: sampling ratios per route (e.g. `{"/health": 0.0}`)
+        :param sampler: sampler replacing the `TraceSampler` configured
+            by the parameters above
+        :param exporter: span exporter (defaults to `CloudTraceSpanExporter`)
+        :param max_queue_size: maximal number of spans waiting for export,
+            spans are dropped (and counted) when the queue is full
+        :param max_export_batch_size: maximal number of spans exported at once
+        :param schedule_delay_millis: delay between two consecutive exports
+        :param export_timeout_millis: timeout of the export
+        :return: tracer provider
+        """
+
+        if enabled is not None:
+            cls.enabled = enabled
+
+        if cls.provider is not None:
+            return cls.provider
+
+        from opentelemetry.sdk.trace import TracerProvider
+        from .tracing import TraceSampler, MonitoredExporter, MonitoredSpanProcessor
+
+        if sampler is None:
+
+            if ratio is None:
+                ratio = float(os.getenv("TRACE_SAMPLING_RATIO", "1.0"))
+
+            sampler = TraceSampler(ratio=ratio, parent_based=parent_based, routes=routes)
+
+        provider = TracerProvider(sampler=sampler)
+
+        if exporter is None:
+
+            try:
+                from opentelemetry.exporter.cloud_trace import CloudTraceSpanExporter
+                exporter = CloudTraceSpanExporter()
+            except Exception as exc:
+                Logger.warning(F"CloudTraceSpanExporter not initialized: {exc}")
+
+        if exporter is not None:
+
+            cls.exporter = MonitoredExporter(exporter)
+            cls.processor = MonitoredSpanProcessor(
+                cls.exporter,
+                max_queue_size=max_queue_size,
+                max_export_batch_size=max_export_batch_size,
+                schedule_delay_millis=schedule_delay_millis,
+                export_timeout_millis=export_timeout_millis
+            )
+            provider.add_span_processor(cls.processor)
+
+        cls.sampler = sampler
+        cls.tracer = provider.get_tracer(DEFAULT_TRACER_NAME)
+        cls.provider = provider
+
+        trace.set_tracer_provider(provider)
+
+        return provider
+
+    @classmethod
+    def shutdown(cls):
+        """Export the pending spans and drop the configuration
+        (the next use sets up the tracer again)"""
+
+        if cls.provider is not None:
+            cls.provider.shutdown()
+
+        cls.provider = cls.tracer = cls.exporter = cls.processor = cls.sampler = None
+
+    @classmethod
+    def get_stats(cls) -> dict:
+        """Returns the statistics of the span export"""
+
+        stats = {}
+
+        if cls.processor is not None:
+            stats.update(cls.processor.get_stats())
+
+        if cls.exporter is not None:
+            stats.update(cls.exporter.get_stats())
+
+        return stats
 
     @classmethod
-    def start_span(cls, name):
-
-        (
-            trace_id,
-            span_id,
-            flags
-        ) = HTTPContext.get_trace_context()
-
-        span_context = SpanContext(
-            trace_id=int(trace_id, base=16),
-            span_id=RandomIdGenerator().generate_span_id(),
-            is_remote=False,
-        )
-        ctx = trace.set_span_in_context(NonRecordingSpan(span_context))
-        return trace.get_tracer(DEFAULT_TRACER_NAME).start_as_current_span(name=name, context=ctx)
+    def get_parent(cls) -> tuple:
+        """Returns the parent context of a new span and the sampling decision
+
+        Within a span started by the tracer the span is the parent (context
+        None i.e. current context is used). Otherwise the parent is the span
+        of the caller of the request which is built (together with the sampling
+        decision) once per request.
+
+        :return: tuple (parent context, sampled), sampled is None if the sampler
+            does not decide by the trace (the SDK decides per span)
+        """
+
+        if not cls.enabled:
+            return None, False
+
+        if cls.provider is None:
+            cls.setup()
+
+        current = trace.get_current_span().get_span_context()
+
+        if current.is_valid and not current.is_remote:
+            return None, current.trace_flags.sampled
+
+        trace_context = HTTPContext.get_trace_context()
+        parent = trace_context.parent  # (sampler, parent context, sampled) of the request
+
+        if parent is None or parent[0] is not cls.sampler:
+
+            trace_id = int(trace_context.trace_id, base=16)
+
+            # the parent span of the caller (its ID is logged with the records
+            # of the request), the sampler decides by its sampled flag
+            span_context = SpanContext(
+                trace_id=trace_id,
+                span_id=int(trace_context.span_id, base=16),
+                is_remote=True,
+                trace_flags=TraceFlags(TraceFlags.SAMPLED if trace_context.sampled else TraceFlags.DEFAULT),
+            )
+            context = trace.set_span_in_context(NonRecordingSpan(span_context))
+
+            is_sampled = getattr(cls.sampler, "is_sampled", None)
+            sampled = None if is_sampled is None else is_sampled(trace_id, trace_context)
+
+            parent = trace_context.parent = (cls.sampler, context, sampled)
+
+        _, context, sampled = parent
+
+        return context, sampled
+
+    @classmethod
+    def start_span(cls, name, attributes: dict = None):
+        """Start span as the current span (context manager yielding the span)
+
+        :param name: name of the span
+        :param attributes: attributes of the span
+        """
+
+        context, sampled = cls.get_parent()
+
+        if sampled is False:
+            span_manager = contextlib.nullcontext(trace.INVALID_SPAN)
+        else:
+            span_manager = cls.tracer.start_as_current_span(name=name, context=context, attributes=attributes)
+
+        if SERVER_TIMING.get() is not None:
+            # duration of the span reported by `Server-Timing` header
+            return ServerTiming.measure_span(name, span_manager)
+
+        return span_manager
+
+    @classmethod
+    def span(cls, name: str = None, attributes: dict = None):
+        """Decorator tracing the calls of sync or async function
+
+        Calls within unsampled requests (or with tracing disabled) are not
+        wrapped by any span.
+
+        :param name: name of the span (defaults to the qualified name of the function)
+        :param attributes: static attributes of the span
+        """
+
+        def decorator(func):
+
+            span_name = name or func.__qualname__
+
+            if inspect.iscoroutinefunction(func):
+
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+
+                    context, sampled = cls.get_parent()
+
+                    if sampled is False:
+                        return await func(*args, **kwargs)
+
+                    with cls.tracer.start_as_current_span(span_name, context=context, attributes=attributes):
+                        return await func(*args, **kwargs)
+
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+
+                context, sampled = cls.get_parent()
+
+                if sampled is False:
+                    return func(*args, **kwargs)
+
+                with cls.tracer.start_as_current_span(span_name, context=context, attributes=attributes):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
@@ -0,0 +1,245 @@
+"""Components of the OpenTelemetry SDK pipeline used by the `Tracer`
+
+The module imports the OpenTelemetry SDK, so it is loaded only when
+the tracer is set up (see `Tracer.setup()`).
+"""
+
+# import external modules
+import os
+import time
+from opentelemetry import trace
+from opentelemetry.sdk.environment_variables import OTEL_BSP_MAX_QUEUE_SIZE
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    SpanExporter,
+    SpanExportResult
+)
+from opentelemetry.sdk.trace.sampling import (
+    Decision,
+    Sampler,
+    SamplingResult
+)
+
+# import internal modules
+from .http_context import TRACE_CONTEXT, HTTP_REQUEST_CONTEXT
+
+__all__ = [
+    "TraceSampler",
+    "MonitoredExporter",
+    "MonitoredSpanProcessor"
+]
+
+
+class TraceSampler(Sampler):
+    """Sampler deciding once per trace
+
+    1. spans with a local parent follow the decision of the parent
+    2. requests with the sampling decision made by the caller
+       (`o=` option of `X-Cloud-Trace-Context` header) follow the decision
+       (if `parent_based` is True)
+    3. other traces are sampled by the ratio of the route (the `http.route`
+       attribute of the span, the template of the route of the current request
+       e.g. `/users/{user_id}`, or its path) or by the default `ratio`
+
+    As `SamplingFilter` of the logs, the ratio is compared with the low 64 bits
+    of the trace ID, so with the same rates the logs and the spans of
+    a request are kept together.
+
+    :param ratio: default sampling ratio (0.0 - 1.0)
+    :param parent_based: honor the sampling decision of the caller
+    :param routes: sampling ratios per route (e.g. `{"/health": 0.0}`)
+    """
+
+    TRACE_ID_LIMIT = (1 << 64) - 1
+
+    def __init__(self, ratio: float = 1.0, parent_based: bool = True, routes: dict = None):
+
+        self.ratio = ratio
+        self.parent_based = parent_based
+        self.routes = dict(routes or {})
+
+        self.bound = self.get_bound(ratio)
+        self.route_bounds = {
+            route: self.get_bound(route_ratio)
+            for route, route_ratio in self.routes.items()
+        }
+
+    @classmethod
+    def get_bound(cls, ratio: float) -> int:
+
+        if not 0.0 <= ratio <= 1.0:
+            raise ValueError(F"Sampling ratio must be between 0 and 1: `{ratio}`")
+
+        return round(ratio * (cls.TRACE_ID_LIMIT + 1))
+
+    def get_route_bound(self, attributes) -> int:
+        """Returns the bound of the route of the span (or the default bound)"""
+
+        if not self.route_bounds:
+            return self.bound
+
+        route = attributes.get("http.route") if attributes else None
+
+        if route is None:
+
+            context = HTTP_REQUEST_CONTEXT.get()
+            request = getattr(context, "request", None)
+
+            if request is not None:
+                # template of the route (set by the router), path before the routing
+                route = getattr(request.scope.get("route"), "path", None) or request.url.path
+            else:
+                route = getattr(context.get("requestUrl"), "path", None)
+
+        return self.route_bounds.get(route, self.bound)
+
+    def is_sampled(self, trace_id: int, trace_context=None, attributes=None) -> bool:
+        """Returns the sampling decision of the trace (without local parent span)
+
+        :param trace_id: 128-bit trace ID
+        :param trace_context: `TraceContext` of the request (or None)
+        :param attributes: attributes of the span
+        :return: True if the trace is sampled
+        """
+
+        if self.parent_based and trace_context is not None and trace_context.decided:
+            return trace_context.sampled
+
+        return trace_id & self.TRACE_ID_LIMIT < self.get_route_bound(attributes)
+
+    def should_sample(
+            self,
+            parent_context,
+            trace_id: int,
+            name: str,
+            kind=None,
+            attributes=None,
+            links=None,
+            trace_state=None
+    ) -> SamplingResult:
+
+        parent = trace.get_current_span(parent_context).get_span_context()
+
+        if parent.is_valid and not parent.is_remote:
+            sampled = parent.trace_flags.sampled
+        else:
+            sampled = self.is_sampled(trace_id, TRACE_CONTEXT.get(), attributes)
+
+        if sampled:
+            return SamplingResult(Decision.RECORD_AND_SAMPLE, attributes, parent.trace_state)
+
+        return SamplingResult(Decision.DROP, None, parent.trace_state)
+
+    def get_description(self) -> str:
+        return F"TraceSampler{{ratio={self.ratio}, parent_based={self.parent_based}, routes={self.routes}}}"
+
+
+class MonitoredExporter(SpanExporter):
+    """Span exporter counting the exported spans and measuring
+    the latency of the export
+
+    :param exporter: wrapped exporter
+    """
+
+    def __init__(self, exporter: SpanExporter):
+
+        self.exporter = exporter
+
+        self.received = 0
+        self.exported = 0
+        self.failed = 0
+        self.exports = 0
+        self.export_latency_last = 0.0
+        self.export_latency_max = 0.0
+        self.export_latency_total = 0.0
+
+    def export(self, spans) -> SpanExportResult:
+
+        self.received += len(spans)
+        start = time.perf_counter()
+
+        try:
+            result = self.exporter.export(spans)
+        except Exception:
+            result = SpanExportResult.FAILURE
+
+        latency = time.perf_counter() - start
+
+        self.exports += 1
+        self.export_latency_last = latency
+        self.export_latency_total += latency
+        self.export_latency_max = max(self.export_latency_max, latency)
+
+        if result is SpanExportResult.SUCCESS:
+            self.exported += len(spans)
+        else:
+            self.failed += len(spans)
+
+        return result
+
+    def shutdown(self):
+        return self.exporter.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.exporter.force_flush(timeout_millis)
+
+    def get_stats(self) -> dict:
+
+        return {
+            "exported": self.exported,
+            "failed": self.failed,
+            "exports": self.exports,
+            "export_latency_last": self.export_latency_last,
+            "export_latency_max": self.export_latency_max,
+            "export_latency_avg": self.export_latency_total / self.exports if self.exports else 0.0,
+        }
+
+
+class MonitoredSpanProcessor(BatchSpanProcessor):
+    """Batch span processor counting the spans dropped because of full queue
+
+    The queue is not inspected: its length is derived from the spans queued
+    by the processor and received by the (monitored) exporter, so the count
+    does not depend on the internals of the SDK (it is approximate as
+    the exporter runs concurrently).
+
+    :param span_exporter: exporter (wrapped by `MonitoredExporter` if needed)
+    :param max_queue_size: size of the queue (defaults as by the SDK)
+    """
+
+    DEFAULT_MAX_QUEUE_SIZE = 2048
+
+    def __init__(self, span_exporter: SpanExporter, max_queue_size: int = None, **kwargs):
+
+        if not isinstance(span_exporter, MonitoredExporter):
+            span_exporter = MonitoredExporter(span_exporter)
+
+        super().__init__(span_exporter, max_queue_size=max_queue_size, **kwargs)
+
+        self.exporter = span_exporter
+        self.max_queue_size = max_queue_size or int(
+            os.getenv(OTEL_BSP_MAX_QUEUE_SIZE, self.DEFAULT_MAX_QUEUE_SIZE)
+        )
+
+        self.queued = 0
+        self.dropped = 0
+
+    def on_end(self, span):
+
+        if not (span.context and span.context.trace_flags.sampled):
+            return
+
+        # the full queue drops the oldest span for the new one
+        if self.queued - self.dropped - self.exporter.received >= self.max_queue_size:
+            self.dropped += 1
+
+        self.queued += 1
+
+        super().on_end(span)
+
+    def get_stats(self) -> dict:
+
+        return {
+            "queued": self.queued,
+            "dropped": self.dropped,
+        }
@@ -1,2 +1,19 @@
-from .route import Route
-from .GCP import GCP
\ No newline at end of file
+"""Utilities for FastAPI
+
+The submodules are imported on first access (e.g. `utils.GCP`) so importing
+a single utility does not import all the others.
+"""
+import importlib
+
+__all__ = ["Route", "GCP"]
+
+
+def __getattr__(name):
+
+    if name == "Route":
+        return importlib.import_module(".route", __name__).Route
+
+    if name == "GCP":
+        return importlib.import_module(".GCP", __name__)
+
+    raise AttributeError(F"module {__name__!r} has no attribute {name!r}")
@@ -1,6 +1,9 @@
 import datetime as dt
+from typing import Optional
 from fastapi import Query, Path
 
+from .cursor import Cursor
+
 
 class QueryConfig(object):
 
@@ -109,3 +112,46 @@ class Args(object):
                 **defaults
             )
         )
+
+    @staticmethod
+    def cursor(**config):
+
+        Cursor.validate_secret()  # fail at startup without the key of the cursors
+
+        defaults = {
+            "default": None,
+            "alias": "cursor",
+            "description": "Cursor of the page (`next_cursor` of the previous page)",
+            "example": None
+        }
+
+        if config:
+            defaults.update(config)
+
+        return QueryConfig(
+            type_=Optional[str],
+            query=Query(
+                **defaults
+            )
+        )
+
+    @staticmethod
+    def page_size(**config):
+
+        defaults = {
+            "default": 1000,
+            "alias": "pageSize",
+            "description": "Maximal number of records returned",
+            "example": 1000,
+            "ge": 1
+        }
+
+        if config:
+            defaults.update(config)
+
+        return QueryConfig(
+            type_=int,
+            query=Query(
+                **defaults
+            )
+        )
@@ -0,0 +1,623 @@
+"""In-memory cache of the serialized responses with ETag validation
+and coalescing of the identical concurrent requests
+
+The cached endpoints return the stored bytes of the response (no handler
+call, no serialization) and answer the requests with matching
+`If-None-Match` header by `304 Not Modified`:
+
+    cache = ResponseCache(max_entries=1000, max_bytes=50 * 1024 * 1024)
+
+    @app.get("/rates")
+    @cache.cached(ttl=300, stale_while_revalidate=60)
+    async def get_rates(
+            start_date: Args.start_date().type = Args.start_date().query,
+            end_date: Args.end_date().type = Args.end_date().query
+    ):
+        return Response.set(data=...)
+
+The entries are keyed by the method, the route, the path and the sorted
+query parameters of the request. Endpoints which are not cached can still
+answer the conditional requests with `ResponseCache.conditional()`.
+
+Concurrent misses of the same key run the endpoint once (see `SingleFlight`),
+which is also available for the endpoints without cache:
+
+    flight = SingleFlight()
+
+    @app.get("/report")
+    @flight.coalesced()
+    async def get_report(...):
+        ...
+"""
+
+# import external modules
+import time
+import asyncio
+import hashlib
+import inspect
+import logging
+import functools
+import threading
+from collections import OrderedDict
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response as RawResponse
+
+# import internal modules
+from .metrics import REGISTRY
+
+__all__ = [
+    "ResponseCache",
+    "CacheEntry",
+    "SingleFlight"
+]
+
+CACHE_EVENTS = REGISTRY.counter(
+    "http_response_cache_total",
+    "Number of the lookups of the response cache by the result",
+    labels=("result",)
+)
+
+COALESCED_REQUESTS = REGISTRY.counter(
+    "http_coalesced_requests_total",
+    "Number of the requests served by the handler call of another identical request"
+)
+
+
+def build_key(request: Request) -> tuple:
+    """Returns key of the request: method, route, path and sorted query parameters"""
+
+    route = request.scope.get("route")
+
+    return (
+        request.method,
+        getattr(route, "path", None),
+        request.url.path,
+        tuple(sorted(request.query_params.multi_items()))
+    )
+
+
+def wrap_endpoint(endpoint, handle):
+    """Returns the endpoint wrapped by `handle(request, call)`, where `call()`
+    calls the endpoint with the arguments of the request
+
+    The `Request` is added to the signature of the endpoint if the endpoint
+    does not declare it. Sync endpoints run in the threadpool as they would
+    without the wrapper.
+    """
+
+    signature = inspect.signature(endpoint)
+    parameters = list(signature.parameters.values())
+    request_name = next(
+        (parameter.name for parameter in parameters if parameter.annotation is Request),
+        None
+    )
+    injected = request_name is None
+
+    if injected:
+
+        request_name = "__request"
+        position = len(parameters)
+
+        if parameters and parameters[-1].kind is inspect.Parameter.VAR_KEYWORD:
+            position -= 1
+
+        parameters.insert(
+            position,
+            inspect.Parameter(request_name, inspect.Parameter.KEYWORD_ONLY, annotation=Request)
+        )
+
+    is_coroutine = asyncio.iscoroutinefunction(endpoint)
+
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+
+        request = kwargs.pop(request_name) if injected else kwargs[request_name]
+
+        async def call():
+
+            if is_coroutine:
+                return await endpoint(*args, **kwargs)
+
+            return await run_in_threadpool(endpoint, *args, **kwargs)
+
+        return await handle(request, call)
+
+    wrapper.__signature__ = signature.replace(parameters=parameters)
+
+    return wrapper
+
+
+class Flight(object):
+    """Handler call shared by the identical concurrent requests"""
+
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    """Coalescing of the identical concurrent calls
+
+    The first call of a key (the leader) starts the handler in a separate
+    task, the calls of the same key arriving before it finishes wait for the
+    same task. All of them receive its result or its exception (handled
+    by the exception handlers and the `Catcher` of each request).
+
+    The task is shielded from the cancellation of the waiters: when
+    the client of the leader disconnects, the others still receive the
+    result. The task is cancelled only when all the waiters are cancelled.
+    """
+
+    # methods of the requests coalesced by `coalesced` decorator
+    METHODS = frozenset({"GET", "HEAD"})
+
+    def __init__(self):
+
+        self.flights = {}
+
+        self.calls = 0
+        self.coalesced_calls = 0
+
+    async def do(self, key, call) -> tuple:
+        """Returns result of `call()` shared by the concurrent calls of the key
+
+        :param key: key of the call
+        :param call: coroutine function called by the leader
+        :return: tuple (result, True if the result was produced for this call)
+        """
+
+        loop = asyncio.get_running_loop()
+        flight = self.flights.get(key)
+
+        if flight is None or flight.task.get_loop() is not loop:
+
+            flight = self.flights[key] = Flight(loop.create_task(call()))
+            flight.task.add_done_callback(lambda task: self.finish(key, flight))
+            leader = True
+            self.calls += 1
+
+        else:
+            leader = False
+            self.coalesced_calls += 1
+            COALESCED_REQUESTS.inc()
+
+        flight.waiters += 1
+
+        try:
+            return await asyncio.shield(flight.task), leader
+        finally:
+
+            flight.waiters -= 1
+
+            if flight.waiters == 0 and not flight.task.done():
+                # all the waiters are cancelled
+                flight.task.cancel()
+                self.finish(key, flight)
+
+    def finish(self, key, flight: Flight):
+        """Remove the flight, the following calls of the key start a new one"""
+
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+    @staticmethod
+    def share(response):
+        """Returns copy of the response for another request (None if the
+        response can not be sent twice, e.g. streaming response)"""
+
+        if not isinstance(response, RawResponse):
+            return response  # serialized by FastAPI for each request
+
+        body = getattr(response, "body", None)
+
+        if not isinstance(body, bytes):
+            return None
+
+        copy = RawResponse(content=body, status_code=response.status_code)
+        copy.raw_headers = list(response.raw_headers)
+
+        return copy
+
+    def coalesced(self):
+        """Decorator running the endpoint once for the identical concurrent
+        requests (the same method, route, path and query parameters)"""
+
+        async def handle(request: Request, call):
+
+            if request.method not in self.METHODS:
+                return await call()
+
+            response, leader = await self.do(build_key(request), call)
+
+            if leader:
+                return response
+
+            shared = self.share(response)
+
+            return shared if shared is not None else await call()
+
+        def decorator(endpoint):
+            return wrap_endpoint(endpoint, handle)
+
+        return decorator
+
+    def get_stats(self) -> dict:
+
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced_calls,
+            "in_flight": len(self.flights),
+        }
+
+
+class CacheEntry(object):
+    """Serialized response stored in the cache"""
+
+    __slots__ = ("body", "status_code", "headers", "etag", "expires", "stale_until", "refreshing")
+
+    def __init__(self, body: bytes, status_code: int, headers: list, etag: bytes, expires: float, stale_until: float):
+        self.body = body
+        self.status_code = status_code
+        self.headers = headers
+        self.etag = etag
+        self.expires = expires
+        self.stale_until = stale_until
+        self.refreshing = False
+
+    @property
+    def size(self) -> int:
+        return len(self.body)
+
+
+class ResponseCache(object):
+    """LRU cache of the serialized responses with time to live
+
+    :param max_entries: maximal number of the cached responses
+    :param max_bytes: maximal total size of the cached bodies
+        (larger responses are not cached)
+    :param coalesce: run the endpoint once for the concurrent misses of a key
+    """
+
+    # methods of the requests served from the cache
+    METHODS = frozenset({"GET", "HEAD"})
+
+    HIT = "hit"
+    STALE = "stale"
+    MISS = "miss"
+
+    # scope of the request refreshing a stale entry (see `revalidate`)
+    REFRESH_FLAG = "response_cache_refresh"
+    REFRESH_SCOPE_KEYS = (
+        "type", "asgi", "http_version", "scheme", "server", "client", "root_path",
+        "path", "raw_path", "query_string", "app"
+    )
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 * 1024 * 1024, coalesce: bool = True):
+
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flight = SingleFlight() if coalesce else None
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self._lock = threading.Lock()
+        self._tasks = set()  # running revalidations
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.evictions = 0
+        self.not_modified = 0
+        self.refresh_errors = 0
+
+    build_key = staticmethod(build_key)
+
+    @staticmethod
+    def get_etag(body: bytes) -> bytes:
+        """Returns strong ETag of the body"""
+
+        return b'"' + hashlib.blake2b(body, digest_size=16).hexdigest().encode("ascii") + b'"'
+
+    @staticmethod
+    def is_not_modified(request: Request, etag: bytes) -> bool:
+        """Returns True if the `If-None-Match` header of the request matches
+        the ETag (weak comparison as required for `If-None-Match`)"""
+
+        header = request.headers.get("if-none-match")
+
+        if not header:
+            return False
+
+        etag = etag.decode("ascii")
+
+        for value in header.split(","):
+
+            value = value.strip()
+
+            if value.startswith("W/"):
+                value = value[2:]
+
+            if value == "*" or value == etag:
+                return True
+
+        return False
+
+    def get(self, key) -> tuple:
+        """Returns the entry of the key and the lookup result (`hit`, `stale`
+        or `miss`), expired entries are removed"""
+
+        now = time.monotonic()
+
+        with self._lock:
+
+            entry = self.entries.get(key)
+
+            if entry is None:
+                self.misses += 1
+                result = self.MISS
+
+            elif now < entry.expires:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                result = self.HIT
+
+            elif now < entry.stale_until:
+                self.entries.move_to_end(key)
+                self.stale += 1
+                result = self.STALE
+
+            else:
+                self.remove(key)
+                self.misses += 1
+                entry, result = None, self.MISS
+
+        CACHE_EVENTS.inc(result)
+
+        return entry, result
+
+    def set(self, key, response: RawResponse, ttl: float, stale_while_revalidate: float = 0) -> CacheEntry:
+        """Store the successful response (status 200), returns the entry
+        or None if the response is not cacheable (e.g. dict or model
+        returned by the endpoint)"""
+
+        if not isinstance(response, RawResponse):
+            return None  # models and dicts are serialized by FastAPI
+
+        body = getattr(response, "body", None)
+
+        if response.status_code != 200 or not isinstance(body, bytes) or len(body) > self.max_bytes:
+            return None
+
+        etag = self.get_etag(body)
+        headers = [(name, value) for name, value in response.raw_headers if name != b"etag"]
+        headers.append((b"etag", etag))
+
+        now = time.monotonic()
+        entry = CacheEntry(body, response.status_code, headers, etag, now + ttl, now + ttl + stale_while_revalidate)
+
+        evicted = 0
+
+        with self._lock:
+
+            self.remove(key)
+            self.entries[key] = entry
+            self.size += entry.size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                evicted += 1
+
+            self.evictions += evicted
+
+        if evicted:
+            CACHE_EVENTS.inc("evicted", amount=evicted)
+
+        return entry
+
+    def remove(self, key):
+        """Remove entry of the key (the caller holds the lock)"""
+
+        entry = self.entries.pop(key, None)
+
+        if entry is not None:
+            self.size -= entry.size
+
+    def clear(self):
+
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def respond(self, request: Request, entry: CacheEntry) -> RawResponse:
+        """Returns response of the entry (`304 Not Modified` for matching `If-None-Match`)"""
+
+        if self.is_not_modified(request, entry.etag):
+
+            self.not_modified += 1
+            CACHE_EVENTS.inc("not_modified")
+
+            return RawResponse(status_code=304, headers={"etag": entry.etag.decode("ascii")})
+
+        response = RawResponse(content=entry.body, status_code=entry.status_code)
+        response.raw_headers = list(entry.headers)
+
+        return response
+
+    @classmethod
+    def conditional(cls, request: Request, response: RawResponse) -> RawResponse:
+        """Add strong ETag to the successful response, returns `304 Not Modified`
+        if the `If-None-Match` header of the request matches
+
+            return ResponseCache.conditional(request, Response.set(data=data))
+        """
+
+        body = getattr(response, "body", None)
+
+        if response.status_code != 200 or not isinstance(body, bytes):
+            return response
+
+        etag = cls.get_etag(body)
+
+        if cls.is_not_modified(request, etag):
+            return RawResponse(status_code=304, headers={"etag": etag.decode("ascii")})
+
+        response.headers["etag"] = etag.decode("ascii")
+
+        return response
+
+    def revalidate(self, request: Request, entry: CacheEntry):
+        """Refresh the stale entry in background (once at a time per entry)
+
+        The dependencies of the request (e.g. database sessions) are closed
+        once its response is sent, so the endpoint is not called with them:
+        a copy of the request is dispatched through the application instead
+        and its response is stored by the `cached` decorator.
+        """
+
+        if entry.refreshing:
+            return
+
+        entry.refreshing = True
+
+        async def refresh():
+
+            try:
+
+                status_code = await self.dispatch(self.build_refresh_scope(request.scope))
+
+                if status_code is None or status_code >= 500:
+                    raise RuntimeError(F"Refresh request failed with status {status_code}")
+
+            except Exception:
+                self.refresh_errors += 1
+                logging.getLogger(__name__).warning("Revalidation of cached response failed", exc_info=True)
+            finally:
+                entry.refreshing = False
+
+        task = asyncio.get_running_loop().create_task(refresh())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    @classmethod
+    def build_refresh_scope(cls, scope: dict) -> dict:
+        """Returns scope of the refresh request: the request without
+        the conditional headers and the state of the original request"""
+
+        refresh_scope = {key: scope[key] for key in cls.REFRESH_SCOPE_KEYS if key in scope}
+        refresh_scope["headers"] = [
+            (name, value) for name, value in scope.get("headers", ())
+            if name not in (b"if-none-match", b"if-modified-since")
+        ]
+        refresh_scope["method"] = "GET"
+        refresh_scope[cls.REFRESH_FLAG] = True
+
+        return refresh_scope
+
+    @staticmethod
+    async def dispatch(scope: dict):
+        """Process the request by the application, returns status code
+        of the (discarded) response"""
+
+        status_code = None
+        done = asyncio.Event()
+        requested = False
+
+        async def receive():
+
+            nonlocal requested
+
+            if not requested:
+                requested = True
+                return {"type": "http.request", "body": b"", "more_body": False}
+
+            await done.wait()
+
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+
+            nonlocal status_code
+
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+
+            elif message["type"] == "http.response.body" and not message.get("more_body", False):
+                done.set()
+
+        try:
+            await scope["app"](scope, receive, send)
+        finally:
+            done.set()
+
+        return status_code
+
+    def cached(self, ttl: float = 60, stale_while_revalidate: float = 0):
+        """Decorator caching the responses of the endpoint (see `wrap_endpoint`)
+
+        :param ttl: seconds the response is served from the cache
+        :param stale_while_revalidate: seconds the expired response is still
+            served while it is refreshed in background (by a copy of the
+            request processed by the application, see `revalidate`)
+        """
+
+        async def handle(request: Request, call):
+
+            if request.method not in self.METHODS:
+                return await call()
+
+            key = self.build_key(request)
+
+            if request.scope.get(self.REFRESH_FLAG):
+                response = await call()
+                self.set(key, response, ttl, stale_while_revalidate)
+                return response
+
+            entry, result = self.get(key)
+
+            if entry is None:
+
+                async def fill():
+                    response = await call()
+                    return response, self.set(key, response, ttl, stale_while_revalidate)
+
+                if self.flight is None:
+                    response, entry = await fill()
+                    leader = True
+                else:
+                    (response, entry), leader = await self.flight.do(key, fill)
+
+                if entry is None:
+
+                    if leader:
+                        return response
+
+                    shared = SingleFlight.share(response)
+
+                    return shared if shared is not None else await call()
+
+            elif result == self.STALE:
+                self.revalidate(request, entry)
+
+            return self.respond(request, entry)
+
+        def decorator(endpoint):
+            return wrap_endpoint(endpoint, handle)
+
+        return decorator
+
+    def get_stats(self) -> dict:
+
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "not_modified": self.not_modified,
+            "refresh_errors": self.refresh_errors,
+            "coalesced": self.flight.coalesced_calls if self.flight else 0,
+        }
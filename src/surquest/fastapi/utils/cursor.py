@@ -0,0 +1,213 @@
+"""Keyset (cursor) pagination
+
+The page is selected by the values of the sort columns of the last record
+of the previous page instead of OFFSET, so the database reads only the
+records of the page (`WHERE (created, id) > (:created, :id)`):
+
+    @app.get("/orders", responses=Responses.get(cursor=True))
+    async def get_orders(
+            cursor: Args.cursor().type = Args.cursor().query,
+            page_size: Args.page_size().type = Args.page_size().query
+    ):
+        after = Cursor.decode(cursor)  # () for the first page
+
+        rows = fetch_orders(after=after, limit=page_size + 1)
+        rows, metadata = Cursor.paginate(rows, page_size, key=("created", "id"))
+
+        return Response.set(data=rows, metadata=metadata)
+
+The cursors are signed by HMAC so the clients can not forge them. The key
+is taken from `CURSOR_SECRET` environment variable, which is required in
+production (`ENV` or `ENVIRONMENT` is `PROD`) and checked at startup by
+`Args.cursor()`. Elsewhere a random key of the process is used (with
+a warning) and the cursors are valid only within the process, i.e. not
+across the workers or restarts.
+"""
+
+# import external modules
+import os
+import hmac
+import logging
+import json
+import base64
+import hashlib
+import binascii
+from fastapi.exceptions import RequestValidationError
+
+# import internal modules
+from surquest.fastapi.schemas.responses.encoder import Encoder
+from surquest.fastapi.schemas.responses.metadata import CursorMetadata
+
+__all__ = ["Cursor"]
+
+
+class Cursor(object):
+    """Encoding of the values of the sort columns to opaque signed cursors
+    `<base64 JSON values>.<base64 signature>`"""
+
+    SECRET_ENV = "CURSOR_SECRET"
+    SIGNATURE_SIZE = 16
+
+    # environments where the random key of the process is not allowed
+    # (`ENV` or `ENVIRONMENT`, defaulting to `DEV` as for the `Catcher`)
+    PRODUCTION_ENVS = ("PROD", "PRODUCTION")
+
+    _secret = None  # random key of the process (without `CURSOR_SECRET`)
+
+    @classmethod
+    def is_production(cls) -> bool:
+
+        return any(
+            os.getenv(name, "DEV").upper() in cls.PRODUCTION_ENVS
+            for name in ("ENV", "ENVIRONMENT")
+        )
+
+    @classmethod
+    def get_secret(cls, secret=None) -> bytes:
+
+        secret = secret or os.getenv(cls.SECRET_ENV)
+
+        if secret is None:
+
+            if cls._secret is None:
+
+                if cls.is_production():
+                    raise RuntimeError(
+                        F"Environment variable `{cls.SECRET_ENV}` is required to sign the cursors "
+                        F"in production (the random key of the process is valid only within the process)"
+                    )
+
+                logging.getLogger(__name__).warning(
+                    F"`{cls.SECRET_ENV}` is not set, the cursors are signed by a random key "
+                    F"valid only within the process"
+                )
+                cls._secret = os.urandom(32)
+
+            return cls._secret
+
+        return secret.encode("utf-8") if isinstance(secret, str) else secret
+
+    @classmethod
+    def validate_secret(cls):
+        """Check the key of the signatures when the application is set up
+        (called by `Args.cursor()`), so missing `CURSOR_SECRET` fails
+        at startup instead of the paginated requests"""
+
+        cls.get_secret()
+
+    @classmethod
+    def sign(cls, payload: bytes, secret=None) -> bytes:
+        return hmac.new(cls.get_secret(secret), payload, hashlib.sha256).digest()[:cls.SIGNATURE_SIZE]
+
+    @staticmethod
+    def b64encode(data: bytes) -> str:
+        return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+    @staticmethod
+    def b64decode(data: str) -> bytes:
+        return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+    @classmethod
+    def encode(cls, values, secret=None) -> str:
+        """Returns cursor of the values of the sort columns (dates, decimals
+        etc. are encoded as by the responses, e.g. dates as ISO strings)
+
+        :param values: values of the sort columns of the last record of the page
+        :param secret: key of the signature (defaults to `CURSOR_SECRET`)
+        """
+
+        payload = Encoder.dumps_data(list(values))
+
+        return F"{cls.b64encode(payload)}.{cls.b64encode(cls.sign(payload, secret))}"
+
+    @classmethod
+    def decode(cls, cursor: str, secret=None) -> tuple:
+        """Returns values of the sort columns of the cursor (empty tuple for
+        no cursor), invalid cursors are reported as validation error of
+        the `cursor` query parameter (422)
+
+        :param cursor: cursor of the request
+        :param secret: key of the signature (defaults to `CURSOR_SECRET`)
+        """
+
+        if not cursor:
+            return ()
+
+        try:
+
+            payload, signature = cursor.split(".")
+            payload = cls.b64decode(payload)
+
+            if not hmac.compare_digest(cls.b64decode(signature), cls.sign(payload, secret)):
+                raise ValueError("Invalid signature")
+
+            values = json.loads(payload)
+
+        except (ValueError, binascii.Error):
+            values = None
+
+        if not isinstance(values, list):
+            raise RequestValidationError([{
+                "type": "value_error.cursor",
+                "loc": ("query", "cursor"),
+                "msg": "Invalid cursor",
+                "input": cursor,
+            }])
+
+        return tuple(values)
+
+    @classmethod
+    def get_key(cls, row, key) -> tuple:
+        """Returns values of the sort columns of the row
+
+        :param row: dict, object or sequence
+        :param key: names of the columns or function returning the values
+        """
+
+        if callable(key):
+            return tuple(key(row))
+
+        if isinstance(row, dict):
+            return tuple(row[column] for column in key)
+
+        return tuple(getattr(row, column) for column in key)
+
+    @classmethod
+    def paginate(
+            cls,
+            rows,
+            page_size: int,
+            key,
+            total: int = None,
+            total_estimated: bool = False,
+            secret=None
+    ) -> tuple:
+        """Returns the rows of the page and its metadata
+
+        The rows are fetched with limit `page_size + 1`: the extra row only
+        tells there is a next page, the cursor points to the last row of
+        the page.
+
+        :param rows: up to `page_size + 1` rows sorted by the key
+        :param page_size: number of the rows of the page
+        :param key: names of the sort columns or function returning their values
+        :param total: total number of the records (None if not counted)
+        :param total_estimated: the total is an estimate
+        :param secret: key of the signature (defaults to `CURSOR_SECRET`)
+        :return: tuple (rows of the page, `CursorMetadata`)
+        """
+
+        rows = list(rows)
+        next_cursor = None
+
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = cls.encode(cls.get_key(rows[-1], key), secret) if rows else None
+
+        return rows, CursorMetadata(
+            page_size=page_size,
+            count=len(rows),
+            next_cursor=next_cursor,
+            total=total,
+            total_estimated=total_estimated
+        )
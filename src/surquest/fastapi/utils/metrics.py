@@ -0,0 +1,408 @@
+"""In-process metrics (counters and histograms) exposed in Prometheus text format
+
+The values are kept in memory or, when `METRICS_DIR` environment variable
+(or `MetricsRegistry(directory=...)`) is set, in a memory mapped file per
+process within the directory. The files of all the processes (e.g. uvicorn
+or gunicorn workers) are summed up when the metrics are rendered, so any
+worker serving the metrics endpoint reports the totals of all of them.
+
+Usage:
+
+    requests = REGISTRY.counter("jobs_total", "Number of jobs", labels=("status",))
+    requests.inc("done")
+
+    app.get("/metrics", include_in_schema=False)(Route.get_metrics)
+"""
+
+# import external modules
+import os
+import glob
+import json
+import mmap
+import bisect
+import struct
+import threading
+
+__all__ = [
+    "MetricsRegistry",
+    "Counter",
+    "Histogram",
+    "REGISTRY"
+]
+
+
+class MemoryStore(object):
+    """Values of the samples kept in memory of the process"""
+
+    def __init__(self):
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, key: str, amount: float):
+
+        with self._lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def items(self):
+        return list(self.values.items())
+
+
+class MmapStore(object):
+    """Values of the samples kept in memory mapped file of the process
+
+    Layout of the file: 8 bytes header with the number of used bytes followed
+    by the entries `[key length (4 bytes)][key (padded to 8 bytes)][value (8 bytes)]`.
+    New entries are written before the header is updated, so other processes
+    can read the file at any time.
+    """
+
+    INITIAL_SIZE = 64 * 1024
+    HEADER = struct.Struct("<Q")
+    KEY_LENGTH = struct.Struct("<I")
+    VALUE = struct.Struct("<d")
+
+    def __init__(self, path: str):
+
+        self.path = path
+        self.positions = {}
+        self._lock = threading.Lock()
+
+        self._file = open(path, "a+b")
+
+        if os.fstat(self._file.fileno()).st_size == 0:
+            self._file.truncate(self.INITIAL_SIZE)
+
+        self._map()
+        self.used = self.HEADER.unpack_from(self._mmap, 0)[0] or self.HEADER.size
+
+        for key, value, position in self.read_entries(self._mmap, self.used):
+            self.positions[key] = position
+
+    def _map(self):
+
+        self.capacity = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), self.capacity)
+
+    def _add(self, key: str) -> int:
+        """Append entry of the key (with zero value), returns position of the value"""
+
+        encoded = key.encode("utf-8")
+        padding = -(self.KEY_LENGTH.size + len(encoded)) % 8
+        entry = self.KEY_LENGTH.pack(len(encoded)) + encoded + b" " * padding + self.VALUE.pack(0.0)
+
+        while self.used + len(entry) > self.capacity:
+            self._mmap.close()
+            self._file.truncate(self.capacity * 2)
+            self._map()
+
+        self._mmap[self.used:self.used + len(entry)] = entry
+        self.used += len(entry)
+        self.HEADER.pack_into(self._mmap, 0, self.used)
+
+        position = self.positions[key] = self.used - self.VALUE.size
+
+        return position
+
+    def inc(self, key: str, amount: float):
+
+        with self._lock:
+
+            position = self.positions.get(key)
+
+            if position is None:
+                position = self._add(key)
+
+            value = self.VALUE.unpack_from(self._mmap, position)[0]
+            self.VALUE.pack_into(self._mmap, position, value + amount)
+
+    def items(self):
+        return [(key, value) for key, value, _ in self.read_entries(self._mmap, self.used)]
+
+    @classmethod
+    def read_entries(cls, data, used: int):
+        """Iterate over entries `(key, value, position of the value)` of the file content"""
+
+        position = cls.HEADER.size
+
+        while position < used:
+
+            length = cls.KEY_LENGTH.unpack_from(data, position)[0]
+            key_start = position + cls.KEY_LENGTH.size
+            key = bytes(data[key_start:key_start + length]).decode("utf-8")
+
+            position = key_start + length
+            position += -position % 8
+
+            yield key, cls.VALUE.unpack_from(data, position)[0], position
+
+            position += cls.VALUE.size
+
+    @classmethod
+    def read_file(cls, path: str):
+        """Returns entries `(key, value)` of the file of any process"""
+
+        with open(path, "rb") as file:
+            data = file.read()
+
+        if len(data) < cls.HEADER.size:
+            return []
+
+        used = min(cls.HEADER.unpack_from(data, 0)[0], len(data))
+
+        return [(key, value) for key, value, _ in cls.read_entries(data, used)]
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+
+class Metric(object):
+    """Base of the metrics, the samples are identified by the keys
+    `[sample name, [[label, value], ...]]` (built once per label values)"""
+
+    TYPE = None
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, labels: tuple = ()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._keys = {}
+
+    @staticmethod
+    def build_key(sample: str, labels) -> str:
+        return json.dumps([sample, [list(label) for label in labels]], ensure_ascii=False)
+
+    def check_label_values(self, label_values: tuple):
+
+        if len(label_values) != len(self.labels):
+            raise ValueError(
+                F"Metric `{self.name}` expects labels {self.labels}, got values {label_values}"
+            )
+
+
+class Counter(Metric):
+
+    TYPE = "counter"
+
+    def inc(self, *label_values, amount: float = 1.0):
+        """Increase the counter of the label values by `amount`"""
+
+        key = self._keys.get(label_values)
+
+        if key is None:
+            self.check_label_values(label_values)
+            key = self._keys[label_values] = self.build_key(self.name, zip(self.labels, label_values))
+
+        self.registry.store.inc(key, amount)
+
+
+class Histogram(Metric):
+    """Histogram with fixed buckets (upper bounds in ascending order)"""
+
+    TYPE = "histogram"
+
+    DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+
+        super().__init__(registry, name, documentation, labels)
+
+        self.buckets = tuple(sorted(buckets))
+        self.bounds = tuple(self.format_value(bound) for bound in self.buckets) + ("+Inf",)
+
+    def get_keys(self, label_values: tuple) -> tuple:
+        """Returns keys of the buckets, sum and count of the label values"""
+
+        keys = self._keys.get(label_values)
+
+        if keys is None:
+
+            self.check_label_values(label_values)
+            labels = tuple(zip(self.labels, label_values))
+
+            buckets = tuple(
+                self.build_key(F"{self.name}_bucket", labels + (("le", bound),))
+                for bound in self.bounds
+            )
+            keys = self._keys[label_values] = (
+                buckets,
+                self.build_key(F"{self.name}_sum", labels),
+                self.build_key(F"{self.name}_count", labels),
+            )
+
+        return keys
+
+    def observe(self, value: float, *label_values):
+        """Record the observed value (e.g. duration in seconds)"""
+
+        buckets, sum_key, count_key = self.get_keys(label_values)
+        store = self.registry.store
+
+        # buckets are stored non-cumulative, summed up when rendered
+        store.inc(buckets[bisect.bisect_left(self.buckets, value)], 1.0)
+        store.inc(sum_key, value)
+        store.inc(count_key, 1.0)
+
+    @staticmethod
+    def format_value(value: float) -> str:
+        return repr(float(value))
+
+
+class MetricsRegistry(object):
+    """Registry of the metrics of the application
+
+    :param directory: directory of the memory mapped files shared by the
+        processes (defaults to `METRICS_DIR` environment variable, the values
+        are kept in memory if not set)
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self, directory: str = None):
+
+        self.directory = directory if directory is not None else os.getenv("METRICS_DIR")
+        self.metrics = {}
+
+        self._store = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def store(self):
+        """Store of the current process (new file is opened in forked worker)"""
+
+        if self._pid != os.getpid():
+
+            with self._lock:
+
+                if self._pid != os.getpid():
+
+                    if self.directory:
+                        os.makedirs(self.directory, exist_ok=True)
+                        self._store = MmapStore(os.path.join(self.directory, F"metrics_{os.getpid()}.db"))
+                    else:
+                        self._store = MemoryStore()
+
+                    self._pid = os.getpid()
+
+        return self._store
+
+    def register(self, metric: Metric) -> Metric:
+        """Register the metric (existing metric of the same name is returned)"""
+
+        with self._lock:
+
+            existing = self.metrics.get(metric.name)
+
+            if existing is not None:
+
+                if type(existing) is not type(metric) or existing.labels != metric.labels:
+                    raise ValueError(F"Metric `{metric.name}` is already registered with different type or labels")
+
+                return existing
+
+            self.metrics[metric.name] = metric
+
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self.register(Counter(self, name, documentation, labels))
+
+    def histogram(
+            self,
+            name: str,
+            documentation: str,
+            labels: tuple = (),
+            buckets: tuple = Histogram.DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(self, name, documentation, labels, buckets))
+
+    def collect(self) -> dict:
+        """Returns the values of the samples summed up over all processes
+
+        :return: dictionary `{(sample name, ((label, value), ...)): value}`
+        """
+
+        if self.directory:
+            self.store  # file of the current process exists even without samples
+            paths = glob.glob(os.path.join(self.directory, "metrics_*.db"))
+            entries = (entry for path in paths for entry in MmapStore.read_file(path))
+        else:
+            entries = self.store.items()
+
+        samples = {}
+
+        for key, value in entries:
+
+            sample, labels = json.loads(key)
+            sample_key = (sample, tuple(tuple(label) for label in labels))
+            samples[sample_key] = samples.get(sample_key, 0.0) + value
+
+        return samples
+
+    def render(self) -> str:
+        """Returns the metrics in Prometheus text exposition format"""
+
+        samples = self.collect()
+        series = {}
+
+        for sample, labels in samples:
+            series.setdefault(sample, []).append(labels)
+
+        lines = []
+
+        for name, metric in sorted(self.metrics.items()):
+
+            lines.append(F"# HELP {name} {self.escape(metric.documentation, help=True)}")
+            lines.append(F"# TYPE {name} {metric.TYPE}")
+
+            if isinstance(metric, Histogram):
+
+                for labels in sorted(series.get(F"{name}_count", [])):
+
+                    cumulative = 0.0
+
+                    for bound in metric.bounds:
+                        cumulative += samples.get((F"{name}_bucket", labels + (("le", bound),)), 0.0)
+                        lines.append(self.format_sample(F"{name}_bucket", labels + (("le", bound),), cumulative))
+
+                    lines.append(self.format_sample(F"{name}_sum", labels, samples[(F"{name}_sum", labels)]))
+                    lines.append(self.format_sample(F"{name}_count", labels, samples[(F"{name}_count", labels)]))
+
+            else:
+
+                for labels in sorted(series.get(name, [])):
+                    lines.append(self.format_sample(name, labels, samples[(name, labels)]))
+
+        return "\n".join(lines) + "\n"
+
+    @classmethod
+    def format_sample(cls, name: str, labels: tuple, value: float) -> str:
+
+        if labels:
+            name += "{" + ",".join(F'{label}="{cls.escape(str(val))}"' for label, val in labels) + "}"
+
+        return F"{name} {value!r}"
+
+    @staticmethod
+    def escape(value: str, help: bool = False) -> str:
+
+        value = value.replace("\\", "\\\\").replace("\n", "\\n")
+
+        return value if help else value.replace('"', '\\"')
+
+    def reset(self):
+        """Drop all the values of the current process (e.g. in tests)"""
+
+        with self._lock:
+
+            if isinstance(self._store, MmapStore):
+                self._store.close()
+                os.remove(self._store.path)
+
+            self._store = None
+            self._pid = None
+
+
+REGISTRY = MetricsRegistry()
@@ -1,6 +1,8 @@
 import os
 from fastapi.openapi.docs import get_swagger_ui_html
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
+
+from .metrics import REGISTRY
 
 
 class Route(object):
@@ -17,3 +19,10 @@ class Route(object):
             openapi_url=F"{os.getenv('PATH_PREFIX','')}/openapi.json",
             title=title
         )
+
+    @staticmethod
+    def get_metrics():
+        return Response(
+            content=REGISTRY.render(),
+            media_type=REGISTRY.CONTENT_TYPE
+        )
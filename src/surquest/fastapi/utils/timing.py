@@ -0,0 +1,118 @@
+"""Phase timings of the requests reported by `Server-Timing` header
+
+The timings are collected only within the requests processed by
+`LoggingMiddleware(server_timing=True)`; elsewhere the measurement is
+a single context variable lookup.
+"""
+
+# import external modules
+import re
+import time
+import contextlib
+import contextvars
+
+__all__ = ["ServerTiming", "SERVER_TIMING"]
+
+SERVER_TIMING = contextvars.ContextVar(
+    'SERVER_TIMING',
+    default=None
+)
+
+
+class ServerTiming(object):
+    """Durations of the phases of the request measured by monotonic clock
+
+    The storage is preallocated: the phases accumulate durations in a fixed
+    list and up to `MAX_SPANS` spans are kept.
+    """
+
+    __slots__ = ("start", "durations", "span_names", "span_durations", "span_count")
+
+    # indexes of the phases
+    CONTEXT = 0
+    BODY = 1
+    HANDLER = 2
+    SERIALIZATION = 3
+
+    PHASES = ("context", "body", "handler", "serialization")
+
+    MAX_SPANS = 16
+
+    # characters not allowed in the metric names of the header
+    INVALID_NAME_CHARACTERS = re.compile(r"[^\w!#$%&'*+.^`|~-]", re.ASCII)
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = [0.0] * len(self.PHASES)
+        self.span_names = [None] * self.MAX_SPANS
+        self.span_durations = [0.0] * self.MAX_SPANS
+        self.span_count = 0
+
+    @staticmethod
+    def record(phase: int, start: float):
+        """Add duration of the phase started at `start` (`time.perf_counter()`)
+        to the timing of the current request (if any)"""
+
+        timing = SERVER_TIMING.get()
+
+        if timing is not None:
+            timing.durations[phase] += time.perf_counter() - start
+
+    def add_span(self, name: str, duration: float):
+        """Add duration of the span (spans over `MAX_SPANS` are ignored)"""
+
+        if self.span_count < self.MAX_SPANS:
+            self.span_names[self.span_count] = name
+            self.span_durations[self.span_count] = duration
+            self.span_count += 1
+
+    @staticmethod
+    @contextlib.contextmanager
+    def measure_span(name: str, span_manager):
+        """Wrap the span context manager measuring the duration of the span"""
+
+        start = time.perf_counter()
+
+        try:
+            with span_manager as span:
+                yield span
+        finally:
+
+            timing = SERVER_TIMING.get()
+
+            if timing is not None:
+                timing.add_span(name, time.perf_counter() - start)
+
+    def get_total(self) -> float:
+        return time.perf_counter() - self.start
+
+    def header(self) -> str:
+        """Returns value of `Server-Timing` header (durations in milliseconds)"""
+
+        metrics = [
+            F"{phase};dur={duration * 1000:.3f}"
+            for phase, duration in zip(self.PHASES, self.durations)
+        ]
+
+        for i in range(self.span_count):
+            name = self.INVALID_NAME_CHARACTERS.sub("_", self.span_names[i])
+            metrics.append(F"span.{name};dur={self.span_durations[i] * 1000:.3f}")
+
+        metrics.append(F"total;dur={self.get_total() * 1000:.3f}")
+
+        return ", ".join(metrics)
+
+    def to_dict(self) -> dict:
+        """Returns durations of the phases and spans in milliseconds"""
+
+        timing = {
+            phase: round(duration * 1000, 3)
+            for phase, duration in zip(self.PHASES, self.durations)
+        }
+        timing["spans"] = [
+            {"name": self.span_names[i], "duration": round(self.span_durations[i] * 1000, 3)}
+            for i in range(self.span_count)
+        ]
+        timing["total"] = round(self.get_total() * 1000, 3)
+
+        return timing
@@ -0,0 +1,106 @@
+"""Benchmark of the response cache
+
+Compares an endpoint building and serializing `Response.set` envelope on
+each request with the same endpoint served from `ResponseCache` (fresh
+response and `304 Not Modified`). The ASGI application is called directly
+(no network, no HTTP client).
+
+Run from the `test` directory:
+
+    python benchmarks/bench_cache.py
+"""
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.cache import ResponseCache
+
+REQUESTS = 2000
+ROUNDS = 5
+
+RATES = [
+    {"date": F"2023-01-{day:02d}", "currency": currency, "rate": 1.0 + day / 100}
+    for day in range(1, 32)
+    for currency in ("EUR", "USD", "GBP", "CHF", "JPY")
+]
+
+
+def build_app():
+
+    app = FastAPI()
+    cache = ResponseCache()
+
+    @app.get("/rates")
+    async def get_rates():
+        return Response.set(data=RATES)
+
+    @app.get("/cached")
+    @cache.cached(ttl=3600)
+    async def get_cached_rates():
+        return Response.set(data=RATES)
+
+    return app, cache
+
+
+async def run(app, path, headers=(), requests=REQUESTS):
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"startDate=2023-01-01&endDate=2023-01-31",
+        "headers": [(b"host", b"localhost"), *headers],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(dict(scope), receive, send)  # warm up (fills the cache)
+
+    timings = []
+    for _ in range(ROUNDS):
+
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+
+        timings.append((time.perf_counter() - start) / requests)
+
+    return min(timings)
+
+
+def main():
+
+    app, cache = build_app()
+
+    baseline = asyncio.run(run(app, "/rates"))
+    print(F"{'uncached':<32} {baseline * 1e6:8.1f} us/request")
+
+    cached = asyncio.run(run(app, "/cached"))
+    etag = next(iter(cache.entries.values())).etag
+
+    for name, elapsed in (
+        ("cached", cached),
+        ("cached 304", asyncio.run(run(app, "/cached", headers=[(b"if-none-match", etag)]))),
+    ):
+        print(
+            F"{name:<32} {elapsed * 1e6:8.1f} us/request"
+            F" ({baseline / elapsed:.1f}x)"
+        )
+
+    print(cache.get_stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark of the JSON encoder backends
+
+Measures throughput of `JSONFormatter.format` on log records and of
+`Response.set` (standard and fast path) on 10k-row payloads for each
+installed backend.
+
+Run from the `test` directory:
+
+    python benchmarks/bench_encoder.py
+"""
+import logging
+import time
+import datetime as dt
+
+from surquest.fastapi.schemas.responses import Encoder, Response
+from surquest.fastapi.schemas.responses import encoder as encoder_module
+from surquest.fastapi.utils.GCP.formatter import JSONFormatter
+
+RECORDS = 20000
+PAYLOADS = 20
+ROWS = 10000
+
+BACKENDS = ["json"] + [
+    backend for backend in ("orjson", "msgspec")
+    if getattr(encoder_module, backend) is not None
+]
+
+
+def build_record():
+
+    record = logging.LogRecord(
+        name="bench",
+        level=logging.INFO,
+        pathname=__file__,
+        lineno=1,
+        msg="Found %s users",
+        args=(2,),
+        exc_info=None,
+    )
+    record.users = [
+        {"name": "John Doe", "age": 30, "email": "john@doe.com"},
+        {"name": "Will Smith", "age": 42, "email": "will@smith.com"},
+    ]
+
+    return record
+
+
+def build_rows():
+
+    return [
+        {
+            "id": i,
+            "name": F"User {i}",
+            "score": i / 3,
+            "active": i % 2 == 0,
+            "created": dt.date(2023, 1, 1) + dt.timedelta(days=i % 365),
+        }
+        for i in range(ROWS)
+    ]
+
+
+def bench_records(formatter):
+
+    records = [build_record() for _ in range(RECORDS)]
+
+    start = time.perf_counter()
+    for record in records:
+        formatter.format(record)
+
+    return RECORDS / (time.perf_counter() - start)
+
+
+def bench_payloads(fast=False):
+
+    rows = build_rows()
+
+    start = time.perf_counter()
+    for _ in range(PAYLOADS):
+        Response.set(data=rows, fast=fast)
+
+    return PAYLOADS / (time.perf_counter() - start)
+
+
+def main():
+
+    formatter = JSONFormatter()
+
+    for backend in BACKENDS:
+
+        Encoder.set_backend(backend)
+
+        print(
+            F"{backend:<8}"
+            F" log records: {bench_records(formatter):10.0f} records/s"
+            F" | {ROWS} rows payload: {bench_payloads():6.2f} responses/s"
+            F" (fast: {bench_payloads(fast=True):6.2f} responses/s)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Micro-benchmark of `JSONFormatter.format`
+
+Reports records/sec for info records (without extras, with small extras and
+with extras exceeding the payload budget) and for error records formatted
+within a request context.
+
+Run from the `test` directory:
+
+    python benchmarks/bench_formatter.py
+"""
+import asyncio
+import logging
+import time
+
+from starlette.requests import Request
+
+from surquest.fastapi.utils.GCP.formatter import JSONFormatter
+from surquest.fastapi.utils.GCP.http_context import HTTPContext
+
+RECORDS = 50000
+ROUNDS = 3
+
+
+def build_records(level, extra=None, count=RECORDS):
+
+    records = []
+
+    for _ in range(count):
+
+        record = logging.LogRecord(
+            name="bench",
+            level=level,
+            pathname=__file__,
+            lineno=1,
+            msg="Found %s users",
+            args=(2,),
+            exc_info=None,
+        )
+        record.__dict__.update(extra or {})
+        records.append(record)
+
+    return records
+
+
+async def set_request_context():
+
+    request = Request({
+        "type": "http",
+        "method": "GET",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "path": "/users",
+        "query_string": b"age=30",
+        "headers": [
+            (b"user-agent", b"bench"),
+            (b"x-cloud-trace-context", b"105445aa7843bc8bf206b12000100000/1;o=1"),
+        ],
+        "client": ("127.0.0.1", 1234),
+    })
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    request._receive = receive
+
+    await HTTPContext.set_cloud_trace_context(request)
+    await HTTPContext.set_http_request_context(request)
+
+
+def bench(formatter, level, extra=None):
+
+    best = 0
+
+    for _ in range(ROUNDS):
+
+        records = build_records(level, extra)
+
+        start = time.perf_counter()
+        for record in records:
+            formatter.format(record)
+
+        best = max(best, RECORDS / (time.perf_counter() - start))
+
+    return best
+
+
+async def main():
+
+    await set_request_context()
+    formatter = JSONFormatter(project_id="bench-project")
+
+    for name, level, extra in (
+        ("info", logging.INFO, None),
+        ("info with extra", logging.INFO, {"users": [{"name": "John Doe", "age": 30}]}),
+        ("info 10k rows", logging.INFO, {"users": [{"name": "John Doe", "age": 30}] * 10_000}),
+        ("error", logging.ERROR, {"traceback": ["Traceback:", "  File x.py", "ValueError"]}),
+    ):
+        print(F"{name:<16} {bench(formatter, level, extra):10.0f} records/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
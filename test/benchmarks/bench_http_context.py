@@ -0,0 +1,122 @@
+"""Benchmark of memory allocated per request by the request context
+
+Compares the request context stored as lazily built `RequestContext` with
+the former eager copy of the headers, cookies and parameters into a dict.
+Allocations are measured by tracemalloc for requests without logged errors
+(the context is never materialized) and with an error logged (materialized
+once) together with the size of the serialized context in the log entry.
+
+Run from the `test` directory:
+
+    python benchmarks/bench_http_context.py
+"""
+import sys
+import json
+import asyncio
+import tracemalloc
+
+from starlette.requests import Request
+
+from surquest.fastapi.utils.GCP.http_context import (
+    HTTPContext,
+    HTTP_REQUEST_CONTEXT
+)
+
+REQUESTS = 1000
+
+HEADERS = [
+    (b"host", b"example.com"),
+    (b"user-agent", b"Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 Chrome/120.0 Safari/537.36"),
+    (b"accept", b"application/json"),
+    (b"accept-encoding", b"gzip, deflate, br"),
+    (b"accept-language", b"en-US,en;q=0.9"),
+    (b"authorization", b"Bearer " + b"x" * 800),
+    (b"cookie", b"session=" + b"s" * 64 + b"; theme=dark; consent=1"),
+    (b"content-type", b"application/json"),
+    (b"content-length", b"16"),
+    (b"x-cloud-trace-context", b"105445aa7843bc8bf206b12000100000/1;o=1"),
+    (b"x-forwarded-for", b"10.0.0.1"),
+    (b"x-goog-authenticated-user-email", b"accounts.google.com:john@doe.com"),
+]
+
+
+def build_request():
+
+    async def receive():
+        return {"type": "http.request", "body": b'{"key": "value"}', "more_body": False}
+
+    return Request({
+        "type": "http",
+        "method": "POST",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "path": "/users",
+        "query_string": b"age=30&name=john",
+        "headers": HEADERS,
+        "client": ("127.0.0.1", 1234),
+    }, receive)
+
+
+async def legacy_context(request):
+    """Request context as stored before `RequestContext` (eager copies)"""
+
+    try:
+        body = await request.json()
+    except BaseException:
+        body = (await request.body()).decode('utf-8')
+
+    HTTP_REQUEST_CONTEXT.set({
+        'requestMethod': request.method,
+        'requestUrl': request.url,
+        'body': body,
+        'paramsPatch': dict(request.path_params),
+        'paramsQuery': dict(request.query_params),
+        "headers": dict(request.headers),
+        "cookies": dict(request.cookies),
+        'requestSize': sys.getsizeof(request),
+        'remoteIp': request.client.host,
+        'protocol': request.url.scheme,
+        'referrer': request.headers.get('referrer'),
+        'userAgent': request.headers.get('user-agent'),
+    })
+
+
+async def lazy_context(request):
+    await HTTPContext.set_http_request_context(request)
+
+
+async def measure(set_context, logged):
+
+    contexts = []
+    tracemalloc.start()
+
+    for _ in range(REQUESTS):
+
+        await set_context(build_request())
+
+        if logged:
+            HTTPContext.get_http_request_context()
+
+        contexts.append(HTTP_REQUEST_CONTEXT.get())  # keep the contexts alive
+
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    entry = json.dumps(HTTPContext.get_http_request_context(), default=str)
+
+    return size / REQUESTS, len(entry)
+
+
+def main():
+
+    for logged in (False, True):
+        for name, set_context in (("dict copy", legacy_context), ("RequestContext", lazy_context)):
+            size, entry = asyncio.run(measure(set_context, logged))
+            print(
+                F"{name:<16} {'logged' if logged else 'not logged':<12} {size:8.0f} B/request"
+                F" (log entry {entry} B)"
+            )
+
+
+if __name__ == "__main__":
+    main()
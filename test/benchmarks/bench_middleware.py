@@ -0,0 +1,117 @@
+"""Benchmark of per-request overhead of the middlewares
+
+Compares pure ASGI middlewares with their `BaseHTTPMiddleware` based
+equivalents on a no-op endpoint and the overhead of `Server-Timing`
+measurement of `LoggingMiddleware`. The ASGI application is called directly
+(no network, no HTTP client) so only the middleware stack is measured.
+
+Run from the `test` directory:
+
+    python benchmarks/bench_middleware.py
+"""
+import asyncio
+import logging
+import time
+
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import PlainTextResponse
+
+from surquest.fastapi.utils.GCP.catcher import Catcher
+from surquest.fastapi.utils.GCP.middleware import BasicMiddleware, LoggingMiddleware
+
+REQUESTS = 2000
+ROUNDS = 5
+
+
+class LegacyBasicMiddleware(BaseHTTPMiddleware):
+    """`BasicMiddleware` as implemented on top of `BaseHTTPMiddleware`"""
+
+    async def dispatch(self, request, call_next):
+
+        try:
+            return await call_next(request)
+        except BaseException as exc:
+            return await Catcher.catch_internal_error(request, exc)
+
+
+def build_app(middleware=None, stacked=1, **options):
+
+    app = FastAPI()
+
+    for _ in range(stacked if middleware else 0):
+        app.add_middleware(middleware, **options)
+
+    @app.get("/noop")
+    async def noop():
+        return PlainTextResponse("")
+
+    return app
+
+
+async def run(app, requests=REQUESTS):
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/noop",
+        "raw_path": b"/noop",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("localhost", 80),
+    }
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    await app(dict(scope), receive, send)  # warm up (builds middleware stack)
+
+    timings = []
+    for _ in range(ROUNDS):
+
+        start = time.perf_counter()
+        for _ in range(requests):
+            await app(dict(scope), receive, send)
+
+        timings.append((time.perf_counter() - start) / requests)
+
+    return min(timings)
+
+
+def main():
+
+    baseline = asyncio.run(run(build_app()))
+    print(F"{'no middleware':<32} {baseline * 1e6:8.1f} us/request")
+
+    for stacked in (1, 3):
+        for name, middleware in (
+            ("BaseHTTPMiddleware", LegacyBasicMiddleware),
+            ("pure ASGI", BasicMiddleware),
+        ):
+            elapsed = asyncio.run(run(build_app(middleware, stacked)))
+            print(
+                F"{name + ' x' + str(stacked):<32} {elapsed * 1e6:8.1f} us/request"
+                F" ({(elapsed - baseline) * 1e6:+.1f} us)"
+            )
+
+    # access log entries are not written (only the measurement is benchmarked)
+    for name, options in (
+        ("LoggingMiddleware", {"logging_level": logging.WARNING}),
+        ("LoggingMiddleware timing", {"logging_level": logging.WARNING, "server_timing": True}),
+    ):
+        elapsed = asyncio.run(run(build_app(LoggingMiddleware, **options)))
+        print(
+            F"{name:<32} {elapsed * 1e6:8.1f} us/request"
+            F" ({(elapsed - baseline) * 1e6:+.1f} us)"
+        )
+
+
+if __name__ == "__main__":
+    main()
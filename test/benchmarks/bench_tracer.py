@@ -0,0 +1,63 @@
+"""Micro-benchmark of the `Tracer.span` decorator
+
+Reports the cost per call of a function decorated by `Tracer.span` within
+a sampled and unsampled request (spans are exported to memory) compared
+to the plain function call.
+
+Run from the `test` directory:
+
+    python benchmarks/bench_tracer.py
+"""
+import time
+
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from surquest.fastapi.utils.GCP.tracer import Tracer
+from surquest.fastapi.utils.GCP.http_context import TRACE_CONTEXT, TraceContext
+
+CALLS = 20000
+ROUNDS = 3
+
+
+def func(value):
+    return value
+
+
+def bench(function, header=None):
+
+    best = None
+
+    for _ in range(ROUNDS):
+
+        token = TRACE_CONTEXT.set(TraceContext.from_header(header))
+
+        start = time.perf_counter()
+        for i in range(CALLS):
+            function(i)
+        elapsed = (time.perf_counter() - start) / CALLS
+
+        TRACE_CONTEXT.reset(token)
+        Tracer.exporter.exporter.clear()
+
+        best = elapsed if best is None else min(best, elapsed)
+
+    return best * 1e6
+
+
+def main():
+
+    Tracer.setup(exporter=InMemorySpanExporter(), max_queue_size=CALLS * 2, max_export_batch_size=CALLS)
+    traced = Tracer.span("bench")(func)
+
+    for name, function, header in (
+        ("plain call", func, None),
+        ("sampled", traced, "105445aa7843bc8bf206b12000100000/1;o=1"),
+        ("unsampled", traced, "105445aa7843bc8bf206b12000100000/1;o=0"),
+    ):
+        print(F"{name:<12} {bench(function, header):8.2f} us/call")
+
+    Tracer.shutdown()
+
+
+if __name__ == "__main__":
+    main()
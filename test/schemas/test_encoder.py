@@ -0,0 +1,79 @@
+import json
+import enum
+import decimal
+import datetime as dt
+import pytest
+from pydantic import BaseModel
+from starlette.datastructures import URL
+
+from surquest.fastapi.schemas.responses import Encoder, Response
+from surquest.fastapi.schemas.responses import encoder as encoder_module
+
+
+BACKENDS = ["json"] + [
+    backend for backend in ("orjson", "msgspec")
+    if getattr(encoder_module, backend) is not None
+]
+
+
+class Color(str, enum.Enum):
+    red = "red"
+
+
+class User(BaseModel):
+    name: str
+    born: dt.date
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+
+    previous = Encoder.backend
+    yield Encoder.set_backend(request.param)
+    Encoder.backend = previous
+
+
+class TestEncoder:
+
+    def test__unknown_backend(self):
+
+        with pytest.raises(ValueError):
+            Encoder.set_backend("pickle")
+
+    def test__dumps(self, backend):
+
+        obj = {
+            "date": dt.date(2023, 1, 31),
+            "datetime": dt.datetime(2023, 1, 31, 12, 30, 15, 500),
+            "enum": Color.red,
+            "model": User(name="John Doe", born=dt.date(1990, 5, 1)),
+            "url": URL("https://example.com/users?age=30"),
+            "decimal": decimal.Decimal("1.5"),
+            "set": {1},
+            "text": "Žluťoučký kůň",
+        }
+
+        assert json.loads(Encoder.dumps(obj)) == {
+            "date": "2023-01-31",
+            "datetime": "2023-01-31T12:30:15.000500",
+            "enum": "red",
+            "model": {"name": "John Doe", "born": "1990-05-01"},
+            "url": "https://example.com/users?age=30",
+            "decimal": 1.5,
+            "set": [1],
+            "text": "Žluťoučký kůň",
+        }
+
+    def test__invalid_utf8_bytes(self):
+
+        assert Encoder.default(b"ok \xff\xfe") == "ok \ufffd\ufffd"
+
+    def test__dumps_is_compact(self, backend):
+
+        assert Encoder.dumps({"a": [1, "ř"]}) == '{"a":[1,"ř"]}'.encode("utf-8")
+
+    def test__response_uses_encoder(self, backend):
+
+        response = Response.set(data=[{"born": dt.date(1990, 5, 1)}])
+
+        assert json.loads(response.body)["data"] == [{"born": "1990-05-01"}]
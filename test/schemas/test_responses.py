@@ -0,0 +1,276 @@
+import json
+import enum
+import uuid
+import decimal
+import dataclasses
+import datetime as dt
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, ValidationError
+from starlette.datastructures import URL
+
+from surquest.fastapi.schemas.responses import Encoder, Response, Responses, Message
+from surquest.fastapi.schemas.responses import encoder as encoder_module
+from surquest.fastapi.schemas.responses import streaming as streaming_module
+from surquest.fastapi.schemas.responses.metadata import Metadata, CursorMetadata
+
+
+BACKENDS = ["json"] + [
+    backend for backend in ("orjson", "msgspec")
+    if getattr(encoder_module, backend) is not None
+]
+
+
+class Color(enum.Enum):
+    red = "red"
+
+
+class Size(int, enum.Enum):
+    small = 1
+
+
+class User(BaseModel):
+    name: str
+    email: str = None
+    born: dt.datetime
+
+
+@dataclasses.dataclass
+class Point:
+    x: int
+    y: float
+
+
+UTC = dt.timezone.utc
+
+PAYLOADS = {
+    "none": None,
+    "empty list": [],
+    "empty dict": {},
+    "scalars": [1, -2, 3.5, 1e-7, True, False, None, "text", "Žluťoučký kůň 🐎", '"quoted"\n'],
+    "rows": [{"id": i, "name": F"User {i}", "score": i / 3} for i in range(100)],
+    "nested": {"a": {"b": [{"c": [1, 2, {"d": None}]}]}},
+    "tuple": (1, (2, 3)),
+    "int keys": {1: "one", 2: "two"},
+    "dates": [dt.date(2023, 1, 31), dt.datetime(2023, 1, 31, 12, 30, 15, 500), dt.time(8, 15)],
+    "aware datetime": [dt.datetime(2023, 1, 31, tzinfo=UTC)],
+    "timedelta": [dt.timedelta(hours=1, seconds=3)],
+    "enums": [Color.red, Size.small],
+    "decimal": [decimal.Decimal("1.50"), decimal.Decimal("10")],
+    "uuid": [uuid.UUID("12345678-1234-5678-1234-567812345678")],
+    "set": {"values": {1}},
+    "bytes": [b"raw"],
+    "url": [URL("https://example.com/users?age=30")],
+    "model": [User(name="John Doe", born=dt.datetime(1990, 5, 1, tzinfo=UTC))],
+    "dataclass": [Point(x=1, y=2.5)],
+    "nan": [float("nan")],
+}
+
+METADATA = [
+    None,
+    Metadata(offset=10, limit=5, count=5, total=100),
+    {"count": 1, "total": 2},
+    CursorMetadata(page_size=5, count=5, next_cursor="WzVd.c2lnbmF0dXJl"),
+]
+
+WARNINGS = [
+    None,
+    [Message(msg="Partial data", type="DATA.PARTIAL")],
+]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request):
+
+    previous = Encoder.backend
+    yield Encoder.set_backend(request.param)
+    Encoder.backend = previous
+
+
+class TestResponseFastPath:
+
+    @pytest.mark.parametrize("payload", PAYLOADS.values(), ids=PAYLOADS.keys())
+    @pytest.mark.parametrize("metadata", METADATA)
+    @pytest.mark.parametrize("warnings", WARNINGS)
+    def test__parity(self, backend, payload, metadata, warnings):
+
+        try:
+            standard = Response.set(data=payload, metadata=metadata, warnings=warnings, fast=False)
+        except Exception as exc:
+            with pytest.raises(type(exc)):
+                Response.set(data=payload, metadata=metadata, warnings=warnings, fast=True)
+            return
+
+        fast = Response.set(data=payload, metadata=metadata, warnings=warnings, fast=True)
+
+        assert fast.body == standard.body
+        assert fast.status_code == standard.status_code
+        assert fast.headers == standard.headers
+
+    def test__errors_use_standard_path(self, backend):
+
+        errors = [Message(msg="Oups")]
+
+        assert Response.set(errors=errors, fast=True).body == Response.set(errors=errors).body
+
+    def test__invalid_data_is_validated(self, backend):
+
+        with pytest.raises(ValidationError):
+            Response.set(data="not a list", fast=True)
+
+    def test__class_switch(self, backend, monkeypatch):
+
+        monkeypatch.setattr(Response, "fast", True)
+
+        assert Response.set(data=[1]).body == b'{"info":{"status":"success","metadata":null},"data":[1]}'
+
+
+class TestResponseStream:
+
+    @staticmethod
+    def build_client(rows, **options):
+
+        app = FastAPI()
+
+        @app.get("/export")
+        def export():
+            return Response.stream(rows(), **options)
+
+        return TestClient(app)
+
+    def test__json(self):
+
+        def rows():
+            for i in range(1000):
+                yield {"id": i, "created": dt.date(2023, 1, 1)}
+
+        client = self.build_client(rows, metadata={"offset": 0, "limit": 1000}, chunk_size=1024)
+        body = client.get("/export").json()
+
+        assert len(body["data"]) == 1000
+        assert body["data"][0] == {"id": 0, "created": "2023-01-01"}
+        assert body["info"] == {
+            "status": "success",
+            "metadata": {"offset": 0, "limit": 1000, "count": 1000, "total": None}
+        }
+
+    def test__json_with_total(self):
+
+        def rows():
+            yield from ({"id": i} for i in range(10))
+
+        body = self.build_client(rows, metadata={"offset": 20, "limit": 10, "total": 95}).get("/export").json()
+
+        assert body["info"]["metadata"] == {"offset": 20, "limit": 10, "count": 10, "total": 95}
+
+    def test__json_matches_set(self):
+
+        def rows():
+            yield from PAYLOADS["rows"]
+
+        response = self.build_client(rows).get("/export")
+
+        assert response.headers["content-type"] == "application/json"
+        assert response.json() == json.loads(Response.set(data=PAYLOADS["rows"]).body)
+
+    @pytest.mark.parametrize("format", ["json", "ndjson"])
+    def test__rows_are_read_in_batches(self, format, monkeypatch):
+
+        hops = []
+        run_in_threadpool = streaming_module.run_in_threadpool
+
+        async def counting_run_in_threadpool(func, *args):
+            hops.append(func)
+            return await run_in_threadpool(func, *args)
+
+        monkeypatch.setattr(streaming_module, "run_in_threadpool", counting_run_in_threadpool)
+
+        def rows():
+            for i in range(2500):
+                yield {"id": i}
+
+        response = self.build_client(rows, format=format, chunk_size=1024).get("/export")
+
+        if format == "json":
+            ids = [row["id"] for row in response.json()["data"]]
+        else:
+            ids = [json.loads(line)["id"] for line in response.text.splitlines()[:-1]]
+
+        assert ids == list(range(2500))
+        assert len(hops) == 4  # 3 batches and the end of the rows
+
+    def test__ndjson_async(self):
+
+        async def rows():
+            for i in range(3):
+                yield {"id": i}
+
+        response = self.build_client(rows, format="ndjson").get("/export")
+        lines = [json.loads(line) for line in response.text.splitlines()]
+
+        assert response.headers["content-type"] == "application/x-ndjson"
+        assert lines == [
+            {"id": 0},
+            {"id": 1},
+            {"id": 2},
+            {"info": {"status": "success", "metadata": None}}
+        ]
+
+    def test__empty(self):
+
+        response = self.build_client(lambda: iter([])).get("/export")
+
+        assert response.json() == {"data": [], "info": {"status": "success", "metadata": None}}
+
+    def test__cursor_metadata(self):
+
+        def rows():
+            for i in range(3):
+                yield {"id": i}
+
+        metadata = CursorMetadata(page_size=3, count=0, next_cursor="WzJd.c2lnbmF0dXJl")
+        body = self.build_client(rows, metadata=metadata).get("/export").json()
+
+        assert body["info"]["metadata"] == {
+            "page_size": 3,
+            "count": 3,
+            "next_cursor": "WzJd.c2lnbmF0dXJl",
+            "total": None,
+            "total_estimated": False
+        }
+
+
+class TestCursorMetadata:
+
+    def test__metadata_types_are_kept(self):
+
+        cursor = Response.set(data=[1], metadata=CursorMetadata(page_size=1, count=1, next_cursor="abc"))
+        offset = Response.set(data=[1], metadata={"count": 1, "total": 2})
+
+        assert json.loads(cursor.body)["info"]["metadata"]["next_cursor"] == "abc"
+        assert json.loads(offset.body)["info"]["metadata"] == {"offset": 0, "limit": 0, "count": 1, "total": 2}
+
+    def test__openapi_schema(self):
+
+        app = FastAPI()
+
+        @app.get("/orders", responses=Responses.get(cursor=True))
+        async def get_orders():
+            return Response.set(data=[])
+
+        @app.get("/users", responses=Responses.get())
+        async def get_users():
+            return Response.set(data=[])
+
+        schemas = app.openapi()["components"]["schemas"]
+        paths = app.openapi()["paths"]
+
+        def response_schema(path, status):
+            return paths[path]["get"]["responses"][status]["content"]["application/json"]["schema"]["$ref"]
+
+        assert response_schema("/orders", "200").endswith("/CursorSuccess")
+        assert response_schema("/orders", "299").endswith("/CursorWarnings")
+        assert response_schema("/users", "200").endswith("/Success")
+        assert "next_cursor" in schemas["CursorMetadata"]["properties"]
+        assert schemas["InfoCursorSuccess"]["properties"]["metadata"]["anyOf"][0]["$ref"].endswith("/CursorMetadata")
@@ -0,0 +1,393 @@
+import time
+import asyncio
+import pytest
+import httpx
+import datetime as dt
+from fastapi import FastAPI, Request, Depends
+from fastapi.testclient import TestClient
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.args import Args
+from surquest.fastapi.utils.cache import ResponseCache, SingleFlight
+from surquest.fastapi.utils.GCP.middleware import BasicMiddleware
+from surquest.fastapi.utils.GCP.catcher import catch_http_exceptions
+
+
+def build_app(cache, ttl=60, stale_while_revalidate=0):
+
+    app = FastAPI()
+    calls = []
+
+    @app.get("/rates")
+    @cache.cached(ttl=ttl, stale_while_revalidate=stale_while_revalidate)
+    async def get_rates(
+            start_date: Args.start_date().type = Args.start_date().query,
+            end_date: Args.end_date().type = Args.end_date().query
+    ):
+        calls.append((start_date, end_date))
+        return Response.set(data={"start": str(start_date), "end": str(end_date), "call": len(calls)})
+
+    @app.get("/users/{user_id}")
+    @cache.cached(ttl=ttl)
+    def get_user(user_id: int, request: Request):
+        calls.append(user_id)
+        return Response.set(data={"id": user_id, "path": request.url.path})
+
+    @app.get("/missing")
+    @cache.cached(ttl=ttl)
+    async def missing():
+        calls.append("missing")
+        return Response.set(status_code=404, data={})
+
+    @app.get("/conditional")
+    async def conditional(request: Request):
+        return ResponseCache.conditional(request, Response.set(data=[1, 2, 3]))
+
+    return app, calls
+
+
+class TestResponseCache:
+
+    def test__hit_and_miss(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        first = client.get("/rates", params={"startDate": "2023-01-01", "endDate": "2023-01-31"})
+        second = client.get("/rates", params={"endDate": "2023-01-31", "startDate": "2023-01-01"})
+        other = client.get("/rates", params={"startDate": "2023-02-01", "endDate": "2023-02-28"})
+
+        assert first.content == second.content
+        assert first.headers["etag"] == second.headers["etag"] != other.headers["etag"]
+        assert first.headers["content-type"] == "application/json"
+        assert calls == [(dt.date(2023, 1, 1), dt.date(2023, 1, 31)), (dt.date(2023, 2, 1), dt.date(2023, 2, 28))]
+        assert cache.get_stats()["hits"] == 1
+        assert cache.get_stats()["misses"] == 2
+
+    def test__sync_endpoint_with_request(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        responses = [client.get("/users/1").json() for i in range(3)]
+
+        assert responses[0] == responses[2]
+        assert responses[0]["data"] == {"id": 1, "path": "/users/1"}
+        assert calls == [1]
+
+    def test__not_modified(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        etag = client.get("/users/1").headers["etag"]
+
+        response = client.get("/users/1", headers={"If-None-Match": F'"other", W/{etag}'})
+
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+        assert client.get("/users/1", headers={"If-None-Match": '"other"'}).status_code == 200
+        assert cache.get_stats()["not_modified"] == 1
+
+    def test__conditional_helper(self):
+
+        app, calls = build_app(ResponseCache())
+        client = TestClient(app)
+
+        response = client.get("/conditional")
+
+        assert response.json()["data"] == [1, 2, 3]
+        assert client.get("/conditional", headers={"If-None-Match": response.headers["etag"]}).status_code == 304
+
+    def test__errors_are_not_cached(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        assert client.get("/missing").status_code == 404
+        assert client.get("/missing").status_code == 404
+        assert calls == ["missing", "missing"]
+        assert "etag" not in client.get("/missing").headers
+
+    def test__models_are_not_cached(self):
+
+        cache = ResponseCache()
+        app = FastAPI()
+        calls = []
+
+        @app.get("/plain")
+        @cache.cached(ttl=60)
+        async def plain():
+            calls.append("plain")
+            return {"value": 1}
+
+        client = TestClient(app)
+
+        assert client.get("/plain").json() == {"value": 1}
+        assert client.get("/plain").json() == {"value": 1}
+        assert calls == ["plain", "plain"]
+        assert cache.get_stats()["entries"] == 0
+
+    def test__expiration(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache, ttl=0.05)
+        client = TestClient(app)
+
+        client.get("/users/1")
+        time.sleep(0.1)
+        client.get("/users/1")
+
+        assert calls == [1, 1]
+
+    def test__stale_while_revalidate(self):
+
+        cache = ResponseCache()
+        app, calls = build_app(cache, ttl=0.5, stale_while_revalidate=60)
+
+        with TestClient(app) as client:
+
+            first = client.get("/rates").json()
+            time.sleep(0.6)
+            stale = client.get("/rates").json()
+
+            for i in range(100):
+
+                if not cache._tasks:  # revalidation finished
+                    break
+
+                time.sleep(0.01)
+
+            fresh = client.get("/rates").json()
+
+        assert stale == first
+        assert fresh["data"]["call"] == 2
+        assert len(calls) == 2
+        assert cache.get_stats()["stale"] == 1
+
+    def test__revalidation_has_own_dependencies(self):
+
+        cache = ResponseCache()
+        app = FastAPI()
+        sessions = []
+
+        def get_session():
+
+            session = {"open": True}
+            sessions.append(session)
+
+            yield session
+
+            session["open"] = False
+
+        @app.get("/orders")
+        @cache.cached(ttl=0.5, stale_while_revalidate=60)
+        async def get_orders(request: Request, session: dict = Depends(get_session)):
+            await asyncio.sleep(0.05)
+            return Response.set(data={"open": session["open"], "call": len(sessions)})
+
+        with TestClient(app) as client:
+
+            client.get("/orders")
+            time.sleep(0.6)
+            client.get("/orders", headers={"If-None-Match": "*"})
+
+            for i in range(100):
+
+                if not cache._tasks:  # revalidation finished
+                    break
+
+                time.sleep(0.01)
+
+            fresh = client.get("/orders").json()
+
+        # refreshed by the third request (the dependencies are resolved also for the cached responses)
+        assert fresh["data"] == {"open": True, "call": 3}
+        assert [session["open"] for session in sessions] == [False] * 4
+        assert cache.get_stats()["refresh_errors"] == 0
+
+    def test__lru_eviction(self):
+
+        cache = ResponseCache(max_entries=2)
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        for user_id in (1, 2, 1, 3, 1, 2):
+            client.get(F"/users/{user_id}")
+
+        # 2 is evicted by 3 as 1 was used more recently
+        assert calls == [1, 2, 3, 2]
+        assert cache.get_stats()["evictions"] == 2
+        assert cache.get_stats()["entries"] == 2
+
+    def test__size_bound(self):
+
+        cache = ResponseCache(max_bytes=100)
+        app, calls = build_app(cache)
+        client = TestClient(app)
+
+        client.get("/users/1")
+        client.get("/users/2")
+
+        stats = cache.get_stats()
+
+        assert 0 < stats["bytes"] <= 100
+        assert stats["entries"] == 1
+
+
+def build_coalesced_app(flight, cache):
+
+    app = FastAPI()
+    app.add_middleware(BasicMiddleware)
+    app.add_exception_handler(StarletteHTTPException, catch_http_exceptions)
+
+    calls = []
+    release = asyncio.Event()
+
+    @app.get("/report")
+    @flight.coalesced()
+    async def get_report(year: int = 2023):
+        calls.append(year)
+        await release.wait()
+        return Response.set(data={"year": year})
+
+    @app.get("/cached")
+    @cache.cached(ttl=60)
+    async def get_cached():
+        calls.append("cached")
+        await release.wait()
+        return Response.set(data={"cached": True})
+
+    @app.get("/fail")
+    @flight.coalesced()
+    async def fail(status: int = 500):
+        calls.append(status)
+        await release.wait()
+
+        if status == 404:
+            raise StarletteHTTPException(status_code=404, detail="Not found")
+
+        raise ValueError("boom")
+
+    return app, calls, release
+
+
+async def run_concurrently(app, release, *paths):
+
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+
+        requests = [asyncio.ensure_future(client.get(path)) for path in paths]
+
+        await asyncio.sleep(0.05)
+        release.set()
+
+        return await asyncio.gather(*requests)
+
+
+class TestSingleFlight:
+
+    def test__identical_requests_are_coalesced(self):
+
+        flight = SingleFlight()
+        app, calls, release = build_coalesced_app(flight, ResponseCache())
+
+        responses = asyncio.run(run_concurrently(
+            app, release,
+            *["/report?year=2023"] * 10,
+            "/report?year=2022"
+        ))
+
+        assert sorted(calls) == [2022, 2023]
+        assert [response.json()["data"]["year"] for response in responses] == [2023] * 10 + [2022]
+        assert flight.get_stats() == {"calls": 2, "coalesced": 9, "in_flight": 0}
+
+    def test__cache_misses_are_coalesced(self):
+
+        cache = ResponseCache()
+        app, calls, release = build_coalesced_app(SingleFlight(), cache)
+
+        responses = asyncio.run(run_concurrently(app, release, *["/cached"] * 10))
+
+        assert calls == ["cached"]
+        assert {response.headers["etag"] for response in responses} == {responses[0].headers["etag"]}
+        assert cache.get_stats()["coalesced"] == 9
+
+    def test__exceptions_are_propagated(self):
+
+        app, calls, release = build_coalesced_app(SingleFlight(), ResponseCache())
+
+        responses = asyncio.run(run_concurrently(
+            app, release,
+            *["/fail"] * 3,
+            *["/fail?status=404"] * 3
+        ))
+
+        assert calls == [500, 404]
+        assert [response.status_code for response in responses] == [500] * 3 + [404] * 3
+        assert responses[0].json()["info"]["status"] == "error"
+
+    def test__leader_cancellation(self):
+
+        flight = SingleFlight()
+        started = []
+
+        async def call():
+            started.append(1)
+            await asyncio.sleep(0.05)
+            return "result"
+
+        async def main():
+
+            leader = asyncio.ensure_future(flight.do("key", call))
+            await asyncio.sleep(0)
+            waiter = asyncio.ensure_future(flight.do("key", call))
+            await asyncio.sleep(0)
+
+            leader.cancel()  # e.g. the client disconnected
+
+            with pytest.raises(asyncio.CancelledError):
+                await leader
+
+            return await waiter
+
+        assert asyncio.run(main()) == ("result", False)
+        assert started == [1]
+        assert flight.flights == {}
+
+    def test__all_waiters_cancelled(self):
+
+        flight = SingleFlight()
+        cancelled = []
+
+        async def call():
+
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(1)
+                raise
+
+        async def main():
+
+            waiters = [asyncio.ensure_future(flight.do("key", call)) for i in range(3)]
+            await asyncio.sleep(0)
+
+            for waiter in waiters:
+                waiter.cancel()
+
+            await asyncio.gather(*waiters, return_exceptions=True)
+            await asyncio.sleep(0)
+
+            # the next call starts a new flight
+            return await flight.do("key", lambda: asyncio.sleep(0, "new"))
+
+        assert asyncio.run(main()) == ("new", True)
+        assert cancelled == [1]
@@ -3,6 +3,13 @@
 # from starlette.requests import Request
 # from starlette.datastructures import Headers
 # from surquest.fastapi.utils.catcher import Catcher
+import json
+import asyncio
+import logging
+import pytest
+
+from surquest.fastapi.utils.GCP import catcher as catcher_module
+from surquest.fastapi.utils.GCP.catcher import Catcher, ErrorThrottle
 
 class TestCase:
 
@@ -10,6 +17,196 @@ class TestCase:
 
         assert 1 == 1
 
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def raise_error(message="boom"):
+    raise ValueError(message)
+
+
+def raise_key_error():
+    raise KeyError("missing")
+
+
+def raise_type_error():
+    raise TypeError("wrong")
+
+
+def catch(function, *args):
+
+    try:
+        function(*args)
+    except Exception as exc:
+        return exc
+
+
+@pytest.fixture
+def clock(monkeypatch):
+
+    clock = Clock()
+    monkeypatch.setattr(catcher_module.time, "monotonic", clock)
+
+    return clock
+
+
+class TestErrorThrottle:
+
+    def test__fingerprint(self):
+
+        first = ErrorThrottle.fingerprint(catch(raise_error, "a"))
+        second = ErrorThrottle.fingerprint(catch(raise_error, "b"))
+
+        assert first == second
+        assert first[0] == "ValueError"
+        assert first[1] == __file__
+
+    def test__token_bucket(self, clock):
+
+        throttle = ErrorThrottle(limit=3, window=60, sample_rate=0)
+        exc = catch(raise_error)
+
+        decisions = [throttle.check(exc) for _ in range(5)]
+
+        assert decisions == [ErrorThrottle.FULL] * 3 + [ErrorThrottle.SUPPRESSED] * 2
+
+        clock.now += 20  # one token refilled
+
+        assert throttle.check(exc) == ErrorThrottle.FULL
+        assert throttle.check(exc) == ErrorThrottle.SUPPRESSED
+
+    def test__summary_during_error_storm(self, clock):
+
+        throttle = ErrorThrottle(limit=3, window=60, sample_rate=0)
+        exc = catch(raise_error)
+        decisions, summaries = [], []
+
+        for _ in range(61):  # 5 errors per second
+            decisions.extend(throttle.check(exc) for _ in range(5))
+            summaries.extend(suppressed for key, suppressed in throttle.flush())
+            clock.now += 1
+
+        assert decisions.count(ErrorThrottle.FULL) == 3 + 3  # initial burst and tokens refilled within 60 seconds
+        # reported 60 seconds after the first suppressed error (at 0th second)
+        assert summaries == [305 - 6]
+        assert list(throttle.get_stats().values()) == [{"occurrences": 305, "suppressed": 0}]
+
+    def test__summary_after_storm(self, clock):
+
+        throttle = ErrorThrottle(limit=1, window=60, sample_rate=0)
+        exc = catch(raise_error)
+
+        for _ in range(4):
+            throttle.check(exc)
+
+        assert throttle.flush() == []
+
+        clock.now += 60  # no further errors
+
+        assert throttle.flush() == [(ErrorThrottle.fingerprint(exc), 3)]
+        assert throttle.flush() == []
+
+    def test__summary_at_shutdown(self, clock):
+
+        throttle = ErrorThrottle(limit=1, window=60, sample_rate=0)
+        exc = catch(raise_error)
+
+        for _ in range(3):
+            throttle.check(exc)
+
+        assert throttle.flush(force=True) == [(ErrorThrottle.fingerprint(exc), 2)]
+
+    def test__least_recently_seen_fingerprint_is_evicted(self, clock):
+
+        throttle = ErrorThrottle(limit=1, window=60, sample_rate=0, max_fingerprints=2)
+        errors = [catch(raise_error), catch(raise_key_error), catch(raise_type_error)]
+
+        for _ in range(3):
+            throttle.check(errors[0])
+
+        throttle.check(errors[1])
+        throttle.check(errors[0])  # the first fingerprint is seen recently
+        throttle.check(errors[2])  # evicts the second one
+
+        assert [key for key in throttle.buckets] == [
+            ErrorThrottle.fingerprint(errors[0]),
+            ErrorThrottle.fingerprint(errors[2])
+        ]
+        assert throttle.buckets[ErrorThrottle.fingerprint(errors[0])][3] == 3
+
+    def test__evicted_fingerprint_is_summarized(self, clock):
+
+        throttle = ErrorThrottle(limit=1, window=60, sample_rate=0, max_fingerprints=1)
+        first, second = catch(raise_error), catch(raise_key_error)
+
+        throttle.check(first)
+        throttle.check(first)
+        throttle.check(second)
+
+        assert throttle.flush() == [(ErrorThrottle.fingerprint(first), 1)]
+
+    def test__sampled_full_reports(self, clock):
+
+        throttle = ErrorThrottle(limit=1, window=60, sample_rate=1)
+        exc = catch(raise_error)
+
+        assert [throttle.check(exc) for _ in range(3)] == [ErrorThrottle.FULL] * 3
+
+
+class TestCatcher:
+
+    @staticmethod
+    async def handle():
+
+        try:
+            raise_error()
+        except ValueError as exc:
+            return await Catcher.catch_internal_error(None, exc)
+
+    def test__throttle_is_disabled_by_default(self, caplog):
+
+        assert Catcher.throttle is None
+
+        with caplog.at_level(logging.DEBUG, logger=catcher_module.Logger.name):
+            responses = [asyncio.run(self.handle()) for _ in range(15)]
+
+        assert all("traceback" in json.loads(response.body)["info"]["errors"][0]["ctx"] for response in responses)
+        assert len(caplog.records) == 15
+
+    def test__throttled_internal_errors(self, clock, monkeypatch, caplog):
+
+        monkeypatch.setattr(Catcher, "throttle", ErrorThrottle(limit=2, window=60, sample_rate=0))
+
+        with caplog.at_level(logging.DEBUG, logger=catcher_module.Logger.name):
+
+            responses = [asyncio.run(self.handle()) for _ in range(5)]
+
+            clock.now += 60
+            Catcher.report_summaries()  # the window expired without further errors
+
+            responses.append(asyncio.run(self.handle()))
+
+        assert [response.status_code for response in responses] == [500] * 6
+        assert "traceback" in json.loads(responses[0].body)["info"]["errors"][0]["ctx"]
+        assert "traceback" not in json.loads(responses[2].body)["info"]["errors"][0]["ctx"]
+        assert Catcher._summary_timer.daemon
+
+        records = [(record.levelno, record.getMessage()) for record in caplog.records]
+        name, file, line = ErrorThrottle.fingerprint(catch(raise_error))
+
+        assert records == [
+            (logging.ERROR, "boom (ValueError)"),
+            (logging.ERROR, "boom (ValueError)"),
+            (logging.WARNING, F"ValueError ({file}:{line}) repeated 3 times"),
+            (logging.ERROR, "boom (ValueError)"),  # tokens refilled after 60 seconds
+        ]
+
 # def build_request(
 #     method: str = "GET",
 #     server: str = "www.example.com",
@@ -0,0 +1,157 @@
+import logging
+import datetime as dt
+import pytest
+from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
+from fastapi.testclient import TestClient
+
+from surquest.fastapi.schemas.responses import Response, Responses
+from surquest.fastapi.utils.args import Args
+from surquest.fastapi.utils.cursor import Cursor
+from surquest.fastapi.utils.GCP.catcher import catch_validation_exceptions
+
+ORDERS = [
+    {"id": i, "created": dt.date(2023, 1, 1 + i // 10)}
+    for i in range(25)
+]
+
+
+def build_app():
+
+    app = FastAPI()
+    app.add_exception_handler(RequestValidationError, catch_validation_exceptions)
+
+    @app.get("/orders", responses=Responses.get(cursor=True))
+    async def get_orders(
+            cursor: Args.cursor().type = Args.cursor().query,
+            page_size: Args.page_size().type = Args.page_size(default=10).query
+    ):
+        after = Cursor.decode(cursor, secret="secret")
+
+        rows = [
+            row for row in ORDERS
+            if not after or (row["created"].isoformat(), row["id"]) > tuple(after)
+        ][:page_size + 1]
+
+        rows, metadata = Cursor.paginate(rows, page_size, key=("created", "id"), secret="secret")
+
+        return Response.set(data=rows, metadata=metadata)
+
+    return app
+
+
+class TestCursor:
+
+    def test__round_trip(self):
+
+        cursor = Cursor.encode((dt.date(2023, 1, 31), 18301, "abc"), secret="secret")
+
+        assert "=" not in cursor
+        assert Cursor.decode(cursor, secret="secret") == ("2023-01-31", 18301, "abc")
+        assert Cursor.decode(None) == ()
+
+    @pytest.mark.parametrize("cursor", ["", "garbage", "WzVd.AAAA", "a.b.c", "%%%.%%%"])
+    def test__invalid_cursor(self, cursor):
+
+        valid = Cursor.encode([5], secret="secret")
+
+        with pytest.raises(RequestValidationError):
+            Cursor.decode(valid, secret="other")
+
+        if cursor:
+            with pytest.raises(RequestValidationError):
+                Cursor.decode(cursor, secret="secret")
+
+    def test__secret_from_environment(self, monkeypatch):
+
+        monkeypatch.setenv("CURSOR_SECRET", "environment")
+
+        assert Cursor.decode(Cursor.encode([1]), secret="environment") == (1,)
+
+    @pytest.mark.parametrize("name", ["ENV", "ENVIRONMENT"])
+    def test__secret_is_required(self, monkeypatch, name):
+
+        monkeypatch.delenv("CURSOR_SECRET", raising=False)
+        monkeypatch.delenv("ENV", raising=False)
+        monkeypatch.delenv("ENVIRONMENT", raising=False)
+        monkeypatch.setattr(Cursor, "_secret", None)
+        monkeypatch.setenv(name, "PROD")
+
+        with pytest.raises(RuntimeError):
+            Args.cursor()  # at startup
+
+        with pytest.raises(RuntimeError):
+            Cursor.encode([1])
+
+    def test__random_secret_by_default(self, monkeypatch):
+
+        monkeypatch.delenv("CURSOR_SECRET", raising=False)
+        monkeypatch.delenv("ENV", raising=False)
+        monkeypatch.delenv("ENVIRONMENT", raising=False)
+        monkeypatch.setattr(Cursor, "_secret", None)
+
+        assert Cursor.decode(Cursor.encode([1])) == (1,)  # `DEV` as for the `Catcher`
+
+    def test__random_secret_in_development(self, monkeypatch, caplog):
+
+        monkeypatch.delenv("CURSOR_SECRET", raising=False)
+        monkeypatch.setattr(Cursor, "_secret", None)
+        monkeypatch.setenv("ENV", "local")
+
+        with caplog.at_level(logging.WARNING, logger="surquest.fastapi.utils.cursor"):
+            cursor = Cursor.encode([1])
+            Cursor.encode([2])
+
+        assert Cursor.decode(cursor) == (1,)
+        assert len(caplog.records) == 1  # warned on first use only
+
+    def test__paginate(self):
+
+        rows, metadata = Cursor.paginate(ORDERS[:4], 3, key=lambda row: (row["id"],), total=25, total_estimated=True, secret="secret")
+
+        assert rows == ORDERS[:3]
+        assert metadata.count == 3
+        assert metadata.total == 25 and metadata.total_estimated
+        assert Cursor.decode(metadata.next_cursor, secret="secret") == (2,)
+
+        rows, metadata = Cursor.paginate(ORDERS[:3], 3, key=("id",))
+
+        assert metadata.next_cursor is None
+
+    def test__pages(self):
+
+        client = TestClient(build_app())
+        ids, cursor, pages = [], None, 0
+
+        while True:
+
+            params = {"pageSize": 10}
+
+            if cursor:
+                params["cursor"] = cursor
+
+            body = client.get("/orders", params=params).json()
+            ids += [row["id"] for row in body["data"]]
+            cursor = body["info"]["metadata"]["next_cursor"]
+            pages += 1
+
+            if cursor is None:
+                break
+
+        assert ids == list(range(25))
+        assert pages == 3
+        assert body["info"]["metadata"] == {
+            "page_size": 10,
+            "count": 5,
+            "next_cursor": None,
+            "total": None,
+            "total_estimated": False
+        }
+
+    def test__forged_cursor(self):
+
+        client = TestClient(build_app())
+        response = client.get("/orders", params={"cursor": Cursor.encode(["2023-01-02", 15], secret="forged")})
+
+        assert response.status_code == 422
+        assert response.json()["info"]["errors"][0]["loc"] == ["query", "cursor"]
@@ -0,0 +1,161 @@
+import json
+import logging
+import datetime as dt
+import pytest
+from starlette.requests import Request
+
+from surquest.fastapi.utils.GCP.budget import PayloadBudget
+from surquest.fastapi.utils.GCP.formatter import JSONFormatter
+from surquest.fastapi.utils.GCP.http_context import HTTP_REQUEST_CONTEXT, BodyCapture, RequestContext
+
+
+def build_record(level=logging.INFO, **extra):
+
+    record = logging.LogRecord(
+        name="test",
+        level=level,
+        pathname=__file__,
+        lineno=10,
+        msg="Found %s users",
+        args=(2,),
+        exc_info=None,
+    )
+    record.__dict__.update(extra)
+
+    return record
+
+
+@pytest.fixture
+def formatter():
+    return JSONFormatter(project_id="test-project")
+
+
+class TestJSONFormatter:
+
+    def test__info(self, formatter):
+
+        log = json.loads(formatter.format(build_record()))
+
+        assert log["severity"] == "INFO"
+        assert log["message"] == "Found 2 users"
+        assert log["ctx"] == {}
+        assert log["logging.googleapis.com/trace"].startswith("projects/test-project/traces/")
+        assert log["logging.googleapis.com/sourceLocation"]["line"] == 10
+
+    def test__extra(self, formatter):
+
+        log = json.loads(formatter.format(build_record(users=["John"], age=30)))
+
+        assert log["ctx"] == {"users": ["John"], "age": 30}
+
+    def test__invalid_utf8_bytes(self, formatter):
+
+        log = json.loads(formatter.format(build_record(payload=b"\xff\xfe")))
+
+        assert log["ctx"] == {"payload": "\ufffd\ufffd"}
+
+    def test__record_formatted_twice(self, formatter):
+
+        record = build_record(users=["John"])
+
+        first = json.loads(formatter.format(record))
+        second = json.loads(formatter.format(record))
+
+        assert first["ctx"] == second["ctx"] == {"users": ["John"]}
+
+    def test__error_request_context_is_cached(self, formatter):
+
+        token = HTTP_REQUEST_CONTEXT.set({
+            "requestMethod": "GET",
+            "requestUrl": "https://example.com/users",
+            "headers": {"x-goog-authenticated-user-email": "john@doe.com"},
+        })
+
+        try:
+            first = json.loads(formatter.format(build_record(logging.ERROR, traceback=["ValueError"])))
+            second = json.loads(formatter.format(build_record(logging.ERROR)))
+            cached = formatter._request_cache[1]
+        finally:
+            HTTP_REQUEST_CONTEXT.reset(token)
+
+        third = json.loads(formatter.format(build_record(logging.ERROR)))
+
+        assert first["message"] == "Found 2 users:\nValueError"
+        assert first["context"]["httpRequest"]["method"] == "GET"
+        assert first["context"]["user"] == "john@doe.com"
+        assert first["context"] == second["context"]
+        assert formatter._request_cache[1] is not cached
+        assert third["context"]["user"] == "unknown"
+        assert first["serviceContext"] == {"service": "LOCAL", "version": "-"}
+
+    def test__request_context_in_extra(self, formatter):
+
+        capture = BodyCapture("application/json")
+        capture.write(b'{"key": "value"}')
+        capture.complete = True
+
+        request = Request({"type": "http", "method": "POST", "path": "/users", "query_string": b"", "headers": []})
+        log = json.loads(formatter.format(build_record(request=RequestContext(request, body=capture))))
+
+        assert log["ctx"]["request"]["requestMethod"] == "POST"
+        assert log["ctx"]["request"]["body"] == {"key": "value"}
+
+    def test__oversized_extra_is_truncated(self, formatter):
+
+        users = [{"name": F"User {i}", "bio": "x" * 100_000} for i in range(10_000)]
+        log = json.loads(formatter.format(build_record(users=users)))
+
+        assert log["truncated"] is True
+        assert len(log["ctx"]["users"]) <= 21
+        assert log["ctx"]["users"][-1].startswith("list of 10000 items, first ")
+        assert log["ctx"]["users"][0]["bio"].endswith("... (100000 characters)")
+        assert len(json.dumps(log)) < 256_000
+
+    def test__long_traceback_is_kept(self, formatter):
+
+        traceback = ["Traceback (most recent call last):"]
+
+        for i in range(67):
+            traceback += [F'  File "app.py", line {i}, in handler_{i}', F"    handler_{i + 1}()"]
+
+        traceback.append("ValueError: boom")
+
+        record = build_record(level=logging.ERROR, error={"msg": "boom", "ctx": {"traceback": traceback}})
+        record.traceback = traceback
+        log = json.loads(formatter.format(record))
+
+        assert len(traceback) == 136
+        assert log["ctx"]["traceback"] == traceback
+        assert log["ctx"]["error"]["ctx"]["traceback"] == traceback
+        assert log["message"].rstrip().endswith("ValueError: boom")
+
+    def test__small_extra_is_not_truncated(self, formatter):
+
+        log = json.loads(formatter.format(build_record(users=[{"name": "John"}])))
+
+        assert "truncated" not in log
+        assert log["ctx"] == {"users": [{"name": "John"}]}
+
+
+class TestPayloadBudget:
+
+    def test__depth(self):
+
+        payload, truncated = PayloadBudget(max_depth=2).apply({"a": {"b": {"c": 1}}})
+
+        assert truncated is True
+        assert payload == {"a": {"b": "dict of 1 keys"}}
+
+    def test__bytes(self):
+
+        payload, truncated = PayloadBudget(max_bytes=100).apply({"rows": ["x" * 40] * 10})
+
+        assert truncated is True
+        assert payload["rows"][-1] == "list of 10 items, first 3 shown"
+
+    def test__unsupported_objects(self):
+
+        payload, truncated = PayloadBudget().apply({"date": dt.date(2023, 1, 31)})
+
+        assert truncated is False
+        assert payload == {"date": "2023-01-31"}
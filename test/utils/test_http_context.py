@@ -0,0 +1,224 @@
+import json
+import asyncio
+import pytest
+
+from starlette.requests import Request
+
+from surquest.fastapi.schemas.responses.encoder import Encoder
+
+from surquest.fastapi.utils.GCP.http_context import (
+    BodyCapture,
+    TraceContext,
+    HTTPContext,
+    ContextProjection,
+    RequestContext,
+    HTTP_REQUEST_CONTEXT
+)
+
+
+def receive_from(*chunks):
+
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    return receive
+
+
+class TestBodyCapture:
+
+    @pytest.mark.parametrize(
+        "content_type, expected",
+        [
+            ("application/json", True),
+            ("application/vnd.api+json; charset=utf-8", True),
+            ("text/plain", True),
+            ("", True),
+            ("multipart/form-data; boundary=x", False),
+            ("application/octet-stream", False),
+            ("image/png", False),
+        ]
+    )
+    def test__is_capturable(self, content_type, expected):
+
+        assert BodyCapture.is_capturable(content_type) is expected
+
+    def test__resolve_json(self):
+
+        capture = BodyCapture("application/json")
+        receive = capture.wrap(receive_from(b'{"key": ', b'"value"}'))
+
+        asyncio.run(receive())
+        assert capture.complete is False
+
+        asyncio.run(receive())
+        assert capture.complete is True
+        assert capture.resolve() == {"key": "value"}
+
+    def test__resolve_truncated(self):
+
+        capture = BodyCapture("application/json", max_size=4)
+        receive = capture.wrap(receive_from(b'{"key": "value"}'))
+
+        asyncio.run(receive())
+
+        assert capture.truncated is True
+        assert capture.resolve() == '{"ke'
+
+
+class TestTraceContext:
+
+    def test__from_header(self):
+
+        trace = TraceContext.from_header("105445aa7843bc8bf206b12000100000/1;o=1")
+
+        assert trace.trace_id == "105445aa7843bc8bf206b12000100000"
+        assert trace.span_id == "0000000000000001"
+        assert trace.sampled is True
+        assert trace.decided is True
+
+    @pytest.mark.parametrize("header", [None, "", "not-a-hex-id", "/abc"])
+    def test__generated(self, header):
+
+        trace = TraceContext.from_header(header)
+
+        assert len(trace.trace_id) == 32
+        assert len(trace.span_id) == 16
+        assert int(trace.trace_id, 16) and int(trace.span_id, 16)
+        assert trace.sampled is False
+        assert trace.decided is False
+
+    def test__trace_is_stable_within_request(self):
+
+        async def handle_request():
+
+            request = Request({
+                "type": "http",
+                "headers": [],
+            })
+            await HTTPContext.set_cloud_trace_context(request)
+
+            return [HTTPContext.get_trace_context() for _ in range(3)]
+
+        first = asyncio.run(handle_request())
+        second = asyncio.run(handle_request())
+
+        assert first[0] is first[1] is first[2]
+        assert first[0].trace_id != second[0].trace_id
+        assert tuple(first[0]) == (first[0].trace_id, first[0].span_id, False)
+
+
+def build_request(body=b"", headers=()):
+
+    request = Request({
+        "type": "http",
+        "method": "POST",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "path": "/users",
+        "query_string": b"age=30",
+        "headers": [(name.encode(), value.encode()) for name, value in headers],
+        "client": ("127.0.0.1", 1234),
+    }, receive_from(body))
+
+    return request
+
+
+class TestRequestContext:
+
+    HEADERS = (
+        ("content-type", "application/json"),
+        ("authorization", "Bearer secret"),
+        ("cookie", "session=abc; theme=dark"),
+        ("x-goog-authenticated-user-email", "john@doe.com"),
+        ("user-agent", "test"),
+    )
+
+    def test__context_is_built_on_access(self):
+
+        async def handle_request():
+
+            request = build_request(b'{"key": "value"}', self.HEADERS)
+            await HTTPContext.set_http_request_context(request)
+
+            context = HTTP_REQUEST_CONTEXT.get()
+            built_before_access = context._data is not None
+            request.scope["path_params"] = {"user_id": 1}  # set by the router later
+
+            return built_before_access, HTTPContext.get_http_request_context()
+
+        built_before_access, context = asyncio.run(handle_request())
+
+        assert built_before_access is False
+        assert context["body"] == {"key": "value"}
+        assert context["paramsPatch"] == {"user_id": 1}
+        assert context["paramsQuery"] == {"age": "30"}
+        assert context["requestSize"] == 16
+        assert context["userAgent"] == "test"
+        assert context["headers"]["authorization"] == ContextProjection.REDACTED
+        assert context["headers"]["cookie"] == ContextProjection.REDACTED
+        assert context["cookies"] == {"session": ContextProjection.REDACTED, "theme": ContextProjection.REDACTED}
+
+    def test__projection(self):
+
+        projection = ContextProjection(
+            headers=["Content-Type", "X-Goog-Authenticated-User-Email"],
+            cookies=["session"],
+            redact=["session"],
+            body=False,
+            params=False
+        )
+        context = RequestContext(build_request(headers=self.HEADERS), projection=projection)
+
+        assert context["headers"] == {
+            "content-type": "application/json",
+            "x-goog-authenticated-user-email": "john@doe.com"
+        }
+        assert context["cookies"] == {"session": ContextProjection.REDACTED}
+        assert context["body"] is None
+        assert context["paramsQuery"] is None
+
+    def test__cookies_are_redacted(self):
+
+        request = build_request(headers=[("cookie", "session=SECRET123; theme=dark")])
+
+        allowed = RequestContext(request, projection=ContextProjection(cookies=["theme"]))
+        not_redacted = RequestContext(request, projection=ContextProjection(redact=["authorization"]))
+
+        assert RequestContext(request)["cookies"] == {
+            "session": ContextProjection.REDACTED,
+            "theme": ContextProjection.REDACTED
+        }
+        assert allowed["cookies"] == {"theme": "dark"}
+        assert not_redacted["cookies"] == {"session": "SECRET123", "theme": "dark"}
+
+    def test__context_is_mutable(self):
+
+        context = RequestContext(build_request(headers=self.HEADERS), body=b'{"key": "value"}')
+
+        context["user"] = "john@doe.com"
+        del context["cookies"]
+
+        assert context["user"] == "john@doe.com"
+        assert "cookies" not in context
+        assert json.loads(Encoder.dumps(context))["body"] == {"key": "value"}
+        assert json.loads(Encoder.dumps(context))["user"] == "john@doe.com"
+
+    def test__request_size(self):
+
+        assert RequestContext(build_request(headers=[("content-length", "42")]))["requestSize"] == 42
+        assert RequestContext(build_request(), body=b"12345")["requestSize"] == 5
+        assert RequestContext(build_request())["requestSize"] is None
+
+        capture = BodyCapture("application/json", max_size=4)
+        receive = capture.wrap(receive_from(b'{"key": "value"}'))
+        asyncio.run(receive())
+
+        context = RequestContext(build_request(), body=capture)
+
+        assert context.resolve()["requestSize"] == 16
+        assert context.resolve()["body"] == '{"ke'
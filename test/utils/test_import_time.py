@@ -0,0 +1,81 @@
+import os
+import sys
+import subprocess
+import pytest
+
+# modules which must be loaded on first use only (not at import of the package)
+LAZY_MODULES = (
+    "google.cloud.logging",
+    "google.cloud.logging_v2",
+    "opentelemetry.sdk",
+    "opentelemetry.exporter.cloud_trace",
+)
+
+# dependencies every application imports anyway, imported before the measured
+# module so the budget covers only the package itself (~25 ms measured,
+# google.cloud.logging alone adds ~400 ms)
+BASELINE_MODULES = ("fastapi", "opentelemetry.trace")
+
+IMPORT_BUDGET_MS = 150
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "..", "src")
+
+
+def import_time(module, preload=()):
+    """Import the module in fresh interpreter with `-X importtime` and
+    returns cumulative import time (in microseconds) of all imported modules
+
+    :param module: measured module
+    :param preload: modules imported before the measured module
+    """
+
+    code = "".join(F"import {name}; " for name in preload) + F"import {module}"
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=dict(os.environ, PYTHONPATH=os.path.abspath(SRC)),
+        capture_output=True,
+        text=True,
+        check=True
+    )
+
+    timings = {}
+
+    for line in result.stderr.splitlines():
+
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+
+        _, cumulative, name = line.split("|")
+        timings[name.strip()] = int(cumulative)
+
+    return timings
+
+
+class TestImportTime:
+
+    @pytest.mark.parametrize(
+        "module",
+        [
+            "surquest.fastapi.utils",
+            "surquest.fastapi.utils.GCP",
+            "surquest.fastapi.utils.GCP.middleware",
+            "surquest.fastapi.utils.GCP.tracer",
+        ]
+    )
+    def test__heavy_dependencies_are_lazy(self, module):
+
+        timings = import_time(module, preload=BASELINE_MODULES)
+        loaded = [
+            name for name in timings
+            if name.startswith(LAZY_MODULES)
+        ]
+
+        assert loaded == []
+        assert timings[module] / 1000 < IMPORT_BUDGET_MS
+
+    def test__schemas_do_not_import_utils(self):
+
+        timings = import_time("surquest.fastapi.schemas.responses")
+
+        assert [name for name in timings if name.startswith("surquest.fastapi.utils")] == []
@@ -0,0 +1,459 @@
+import io
+import json
+import logging
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.GCP import logging as gcp_logging
+from surquest.fastapi.utils.GCP.logging import (
+    Logger,
+    setup_logging,
+    reconfigure_logging,
+    is_logging_configured,
+    BackgroundHandler,
+    CloudLoggingHandler,
+    SamplingFilter
+)
+from surquest.fastapi.utils.GCP.http_context import (
+    CLOUD_TRACE_CONTEXT,
+    TRACE_CONTEXT,
+    TraceContext
+)
+from surquest.fastapi.utils.GCP.middleware import LoggingMiddleware
+
+
+@pytest.fixture
+def formatter_constructions(monkeypatch):
+
+    constructions = []
+
+    class CountingFormatter(gcp_logging.JSONFormatter):
+
+        def __init__(self, *args, **kwargs):
+            constructions.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setenv("ENV", "TEST")
+    monkeypatch.setattr(gcp_logging, "JSONFormatter", CountingFormatter)
+    monkeypatch.setattr(gcp_logging, "_CONFIGURED", False)
+
+    yield constructions
+
+    reconfigure_logging()
+
+
+class TestSetupLogging:
+
+    def test__setup_logging_is_idempotent(self, formatter_constructions):
+
+        setup_logging()
+        handlers = list(Logger.handlers)
+        setup_logging(level=logging.INFO)
+
+        assert is_logging_configured() is True
+        assert Logger.handlers == handlers
+        assert Logger.level == logging.DEBUG
+        assert len(formatter_constructions) == 1
+
+    def test__reconfigure_logging(self, formatter_constructions):
+
+        setup_logging()
+        reconfigure_logging(level=logging.INFO)
+
+        assert Logger.level == logging.INFO
+        assert len(Logger.handlers) == 1
+        assert len(formatter_constructions) == 2
+
+    def test__no_setup_on_request_path(self, formatter_constructions):
+
+        app = FastAPI()
+        app.add_middleware(LoggingMiddleware)
+
+        @app.get("/")
+        async def index():
+            Logger.info("Request handled")
+            return Response.set(data=[])
+
+        with TestClient(app) as client:
+            for _ in range(10):
+                assert client.get("/").status_code == 200
+
+        assert len(formatter_constructions) == 1
+
+
+class BlockingStream(io.StringIO):
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def write(self, text):
+        self.released.wait()
+        return super().write(text)
+
+
+class TestBackgroundHandler:
+
+    @staticmethod
+    def build_logger(handler):
+
+        logger = logging.getLogger(F"test.background.{id(handler)}")
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+
+        return logger
+
+    def test__records_are_formatted_in_caller_context(self):
+
+        class TraceFormatter(logging.Formatter):
+
+            def format(self, record):
+                return F"{record.getMessage()} [{CLOUD_TRACE_CONTEXT.get()}]"
+
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream=stream)
+        handler.setFormatter(TraceFormatter())
+        logger = self.build_logger(handler)
+
+        token = CLOUD_TRACE_CONTEXT.set("abc/1;o=1")
+        logger.info("first")
+        CLOUD_TRACE_CONTEXT.reset(token)
+        logger.info("second")
+
+        handler.close()
+
+        assert stream.getvalue() == "first [abc/1;o=1]\nsecond []\n"
+        assert handler.get_stats()["written"] == 2
+
+    def test__arguments_are_merged_by_caller(self):
+
+        released = threading.Event()
+
+        class BlockingFormatter(logging.Formatter):
+
+            def format(self, record):
+                released.wait()
+                return super().format(record)
+
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream=stream)
+        handler.setFormatter(BlockingFormatter("%(message)s"))
+        logger = self.build_logger(handler)
+
+        items = ["a"]
+        logger.warning("items=%s", items)
+        items.append("MUTATED")
+
+        released.set()
+        handler.close()
+
+        assert stream.getvalue() == "items=['a']\n"
+
+    def test__records_after_close_are_dropped(self):
+
+        stream = io.StringIO()
+        handler = BackgroundHandler(stream=stream)
+        logger = self.build_logger(handler)
+
+        handler.close()
+        logger.info("late")
+
+        assert stream.getvalue() == ""
+        assert handler.get_stats()["dropped"] == 1
+        assert handler.queue.qsize() == 0
+
+    def test__overflow_drops_records(self):
+
+        stream = BlockingStream()
+        handler = BackgroundHandler(stream=stream, queue_size=2, batch_size=1)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger = self.build_logger(handler)
+
+        for i in range(10):
+            logger.info("record %s", i)
+
+        stats = handler.get_stats()
+        assert stats["dropped"] >= 7
+        assert stats["queue_depth"] <= 2
+
+        stream.released.set()
+        handler.close()
+
+        stats = handler.get_stats()
+        assert stats["written"] + stats["dropped"] == 10
+        assert stats["queue_depth"] == 0
+        assert stats["flush_latency_max"] >= stats["flush_latency_last"]
+
+
+class TestSamplingFilter:
+
+    @staticmethod
+    def build_logger(name, sampling):
+
+        records = []
+
+        class ListHandler(logging.Handler):
+
+            def emit(self, record):
+                records.append(record.getMessage())
+
+        handler = ListHandler()
+        handler.addFilter(sampling)
+
+        logger = logging.getLogger(name)
+        logger.propagate = False
+        logger.handlers = [handler]
+        logger.setLevel(logging.DEBUG)
+
+        return logger, records
+
+    @staticmethod
+    def log_request(logger, trace_id, sampled=False):
+
+        token = TRACE_CONTEXT.set(TraceContext(trace_id, "0" * 16, sampled=sampled, decided=True))
+
+        try:
+            logger.debug("debug")
+            logger.info("info")
+            logger.error("error")
+        finally:
+            TRACE_CONTEXT.reset(token)
+
+    def test__request_logs_are_kept_or_dropped_as_unit(self):
+
+        sampling = SamplingFilter(rates={"DEBUG": 0.25, "INFO": 0.5})
+        logger, records = self.build_logger("test.sampling.unit", sampling)
+
+        self.log_request(logger, "0" * 16 + "1" * 16)  # below both rates
+        self.log_request(logger, "0" * 16 + "6" * 16)  # below INFO rate only
+        self.log_request(logger, "0" * 16 + "f" * 16)  # above both rates
+
+        assert records == ["debug", "info", "error", "info", "error", "error"]
+        assert sampling.get_stats() == {"kept": 3, "dropped": 3}
+
+    def test__sampled_trace_is_kept(self):
+
+        sampling = SamplingFilter(rates={"DEBUG": 0.0, "INFO": 0.0})
+        logger, records = self.build_logger("test.sampling.trace", sampling)
+
+        self.log_request(logger, "f" * 32, sampled=True)
+        self.log_request(logger, "f" * 32, sampled=False)
+
+        assert records == ["debug", "info", "error", "error"]
+
+    def test__logger_overrides(self):
+
+        sampling = SamplingFilter(
+            rates={"INFO": 0.0},
+            loggers={"test.sampling.override": {"INFO": 1.0}}
+        )
+        logger, records = self.build_logger("test.sampling.override.child", sampling)
+        other, other_records = self.build_logger("test.sampling.other", sampling)
+
+        self.log_request(logger, "f" * 32)
+        self.log_request(other, "f" * 32)
+
+        assert records == ["debug", "info", "error"]
+        assert other_records == ["debug", "error"]
+
+    def test__invalid_rates(self):
+
+        with pytest.raises(ValueError):
+            SamplingFilter(rates={"DEBUG": 2})
+
+        with pytest.raises(ValueError):
+            SamplingFilter(rates={"VERBOSE": 0.5})
+
+    def test__setup_logging_with_sampling(self, formatter_constructions):
+
+        setup_logging(sampling={"rates": {"DEBUG": 0.1}})
+
+        sampling = Logger.handlers[0].filters[0]
+
+        assert isinstance(sampling, SamplingFilter)
+        assert sampling.rates == {logging.DEBUG: 0.1}
+        assert "sampling" in gcp_logging.get_logging_stats()["StreamHandler"]
+
+
+class LoggingAPIServer(HTTPServer):
+    """Local stand-in for the Cloud Logging API"""
+
+    def __init__(self, failures=0, status=503):
+
+        self.failures = failures
+        self.status = status
+        self.requests = []
+
+        super().__init__(("127.0.0.1", 0), LoggingAPIHandler)
+
+    @property
+    def endpoint(self):
+        return F"http://127.0.0.1:{self.server_port}"
+
+    @property
+    def entries(self):
+        return [entry for body in self.requests for entry in body["entries"]]
+
+
+class LoggingAPIHandler(BaseHTTPRequestHandler):
+
+    def do_POST(self):
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+
+        if self.server.failures:
+            self.server.failures -= 1
+            status = self.server.status
+        else:
+            self.server.requests.append(json.loads(body))
+            status = 200
+
+        self.send_response(status)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def logging_api(request):
+
+    server = LoggingAPIServer(**getattr(request, "param", {}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server
+
+    server.shutdown()
+    server.server_close()
+
+
+class TestCloudLoggingHandler:
+
+    @staticmethod
+    def build_logger(logging_api, **options):
+
+        handler = CloudLoggingHandler(
+            log_name="test/api",
+            project_id="test-project",
+            endpoint=logging_api.endpoint,
+            backoff=0.0,
+            **options
+        )
+
+        logger = logging.getLogger(F"test.cloud.{id(handler)}")
+        logger.propagate = False
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+
+        return logger, handler
+
+    def test__entries_are_written_in_batches(self, logging_api):
+
+        logger, handler = self.build_logger(logging_api, batch_size=2, flush_interval=10.0)
+
+        token = CLOUD_TRACE_CONTEXT.set("abc/1;o=1")
+        logger.info("first", extra={"user": "test"})
+        CLOUD_TRACE_CONTEXT.reset(token)
+        logger.warning("second")
+        logger.error("third")
+
+        handler.close()  # flush on shutdown
+
+        assert [len(body["entries"]) for body in logging_api.requests] == [2, 1]
+
+        body = logging_api.requests[0]
+        assert body["logName"] == "projects/test-project/logs/test%2Fapi"
+        assert body["resource"] == {"type": "global"}
+
+        entry = body["entries"][0]
+        assert entry["severity"] == "INFO"
+        assert entry["trace"] == "projects/test-project/traces/abc"
+        assert entry["traceSampled"] is True
+        assert entry["sourceLocation"]["function"] == "test__entries_are_written_in_batches"
+        assert entry["jsonPayload"] == {"message": "first", "ctx": {"user": "test"}}
+        assert entry["timestamp"].endswith("+00:00")
+
+        stats = handler.get_stats()
+        assert stats["written"] == 3
+        assert stats["requests"] == 2
+        assert stats["dropped"] == 0
+
+    def test__requests_are_split_by_size(self, logging_api):
+
+        logger, handler = self.build_logger(logging_api, max_request_bytes=1000, flush_interval=10.0)
+
+        for i in range(6):
+            logger.info("x" * 300)
+
+        handler.close()
+
+        assert len(logging_api.entries) == 6
+        assert len(logging_api.requests) > 1
+
+    @pytest.mark.parametrize("logging_api", [{"failures": 2}], indirect=True)
+    def test__failed_requests_are_retried(self, logging_api):
+
+        logger, handler = self.build_logger(logging_api)
+
+        logger.info("retried")
+        handler.close()
+
+        stats = handler.get_stats()
+        assert [entry["jsonPayload"]["message"] for entry in logging_api.entries] == ["retried"]
+        assert stats["retries"] == 2
+        assert stats["failed_requests"] == 0
+
+    @pytest.mark.parametrize("logging_api", [{"failures": 10, "status": 400}], indirect=True)
+    def test__rejected_entries_are_dropped(self, logging_api):
+
+        logger, handler = self.build_logger(logging_api)
+
+        logger.info("rejected")
+        handler.close()
+
+        stats = handler.get_stats()
+        assert logging_api.entries == []
+        assert stats["requests"] == 1  # client errors are not retried
+        assert stats["failed_requests"] == 1
+        assert stats["dropped"] == 1
+
+    @pytest.mark.parametrize("logging_api", [{"failures": 10}], indirect=True)
+    def test__entries_are_dropped_after_retries(self, logging_api):
+
+        logger, handler = self.build_logger(logging_api, max_retries=2, batch_size=10, flush_interval=0.5)
+
+        for i in range(3):
+            logger.info("dropped %s", i)
+
+        handler.close()
+
+        stats = handler.get_stats()
+        assert stats["requests"] == 3
+        assert stats["dropped"] == 3
+        assert stats["written"] == 0
+
+    @pytest.mark.parametrize("env", ["TEST", "LOCAL"])
+    def test__setup_logging_keeps_project_of_formatter(self, logging_api, formatter_constructions, monkeypatch, env):
+
+        monkeypatch.setenv("ENV", env)
+        monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "env-project")
+
+        setup_logging(cloud_logging=True, project_id="test-project", endpoint=logging_api.endpoint, backoff=0.0)
+        handler = Logger.handlers[0]
+
+        token = CLOUD_TRACE_CONTEXT.set("abc/1;o=1")
+        Logger.info("traced")
+        CLOUD_TRACE_CONTEXT.reset(token)
+
+        handler.close()
+
+        assert handler.formatter.project_id == "test-project"
+        assert [entry["trace"] for entry in logging_api.entries] == ["projects/test-project/traces/abc"]
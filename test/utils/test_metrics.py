@@ -0,0 +1,159 @@
+import multiprocessing
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.route import Route
+from surquest.fastapi.utils.metrics import MetricsRegistry, REGISTRY
+from surquest.fastapi.utils.GCP.middleware import BasicMiddleware
+from surquest.fastapi.utils.GCP.catcher import catch_http_exceptions
+from starlette.exceptions import HTTPException as StarletteHTTPException
+
+
+@pytest.fixture(params=["memory", "mmap"])
+def registry(request, tmp_path):
+
+    registry = MetricsRegistry(directory=str(tmp_path) if request.param == "mmap" else "")
+
+    yield registry
+
+    registry.reset()
+
+
+def increment(directory, count):
+
+    registry = MetricsRegistry(directory=directory)
+    counter = registry.counter("jobs_total", "Number of jobs", labels=("status",))
+    histogram = registry.histogram("job_duration_seconds", "Duration of jobs", buckets=(0.1, 1.0))
+
+    for i in range(count):
+        counter.inc("done")
+        histogram.observe(0.5)
+
+
+class TestMetricsRegistry:
+
+    def test__counter(self, registry):
+
+        counter = registry.counter("jobs_total", "Number of jobs", labels=("status",))
+        counter.inc("done")
+        counter.inc("done", amount=2)
+        counter.inc('failed "hard"')
+
+        assert registry.render() == (
+            "# HELP jobs_total Number of jobs\n"
+            "# TYPE jobs_total counter\n"
+            'jobs_total{status="done"} 3.0\n'
+            'jobs_total{status="failed \\"hard\\""} 1.0\n'
+        )
+
+    def test__histogram(self, registry):
+
+        histogram = registry.histogram("duration_seconds", "Duration", buckets=(0.1, 1.0))
+
+        for value in (0.05, 0.1, 0.5, 5.0):
+            histogram.observe(value)
+
+        assert registry.render() == (
+            "# HELP duration_seconds Duration\n"
+            "# TYPE duration_seconds histogram\n"
+            'duration_seconds_bucket{le="0.1"} 2.0\n'
+            'duration_seconds_bucket{le="1.0"} 3.0\n'
+            'duration_seconds_bucket{le="+Inf"} 4.0\n'
+            "duration_seconds_sum 5.65\n"
+            "duration_seconds_count 4.0\n"
+        )
+
+    def test__registration(self, registry):
+
+        counter = registry.counter("jobs_total", "Number of jobs", labels=("status",))
+
+        assert registry.counter("jobs_total", "Number of jobs", labels=("status",)) is counter
+
+        with pytest.raises(ValueError):
+            registry.histogram("jobs_total", "Number of jobs", labels=("status",))
+
+        with pytest.raises(ValueError):
+            counter.inc("done", "extra")
+
+    def test__mmap_store_grows(self, tmp_path):
+
+        registry = MetricsRegistry(directory=str(tmp_path))
+        counter = registry.counter("items_total", "Number of items", labels=("item",))
+
+        for i in range(2000):  # exceeds initial size of the file
+            counter.inc(F"item-{i}")
+
+        samples = registry.collect()
+        registry.reset()
+
+        assert len(samples) == 2000
+        assert set(samples.values()) == {1.0}
+
+    def test__processes_are_aggregated(self, tmp_path):
+
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=increment, args=(str(tmp_path), count))
+            for count in (10, 20, 30)
+        ]
+
+        for process in processes:
+            process.start()
+
+        for process in processes:
+            process.join()
+            assert process.exitcode == 0
+
+        registry = MetricsRegistry(directory=str(tmp_path))
+        counter = registry.counter("jobs_total", "Number of jobs", labels=("status",))
+        registry.histogram("job_duration_seconds", "Duration of jobs", buckets=(0.1, 1.0))
+        counter.inc("done")
+
+        output = registry.render()
+        registry.reset()
+
+        assert 'jobs_total{status="done"} 61.0' in output
+        assert 'job_duration_seconds_bucket{le="1.0"} 60.0' in output
+        assert "job_duration_seconds_count 60.0" in output
+
+
+class TestMetricsEndpoint:
+
+    def test__requests_and_errors_are_counted(self):
+
+        REGISTRY.reset()
+
+        app = FastAPI()
+        app.add_middleware(BasicMiddleware)
+        app.add_middleware(BasicMiddleware)  # stacked middlewares record the request once
+        app.add_exception_handler(StarletteHTTPException, catch_http_exceptions)
+        app.get("/metrics")(Route.get_metrics)
+
+        @app.get("/users/{user_id}")
+        async def get_user(user_id: int):
+            return Response.set(data={"id": user_id})
+
+        @app.get("/fail")
+        async def fail():
+            raise ValueError("boom")
+
+        client = TestClient(app)
+
+        for user_id in range(3):
+            client.get(F"/users/{user_id}")
+
+        client.get("/fail")
+        client.get("/unknown")
+
+        response = client.get("/metrics")
+        output = response.text
+
+        assert response.headers["content-type"] == MetricsRegistry.CONTENT_TYPE
+        assert 'http_requests_total{method="GET",route="/users/{user_id}",status="200"} 3.0' in output
+        assert 'http_requests_total{method="GET",route="/fail",status="500"} 1.0' in output
+        assert 'http_requests_total{method="GET",route="-",status="404"} 1.0' in output
+        assert 'http_request_duration_seconds_count{method="GET",route="/users/{user_id}",status="200"} 3.0' in output
+        assert 'http_errors_total{type="SERVER.ERROR"} 1.0' in output
+        assert 'http_errors_total{type="NOT.FOUND"} 1.0' in output
@@ -0,0 +1,411 @@
+import re
+import logging
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+from starlette.responses import StreamingResponse
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from surquest.fastapi.schemas.responses import Response
+from surquest.fastapi.utils.GCP.http_context import HTTPContext, HTTP_REQUEST_CONTEXT, ContextProjection
+from surquest.fastapi.utils.GCP.observability import observability
+from surquest.fastapi.utils.GCP.tracer import Tracer
+from surquest.fastapi.utils.GCP.logging import Logger
+from surquest.fastapi.utils.GCP.middleware import (
+    BasicMiddleware,
+    LoggingMiddleware,
+    DBMiddleware
+)
+
+
+class FakeEngine:
+
+    def __init__(self):
+        self.disposed = False
+
+    def dispose(self):
+        self.disposed = True
+
+
+class FakeDB:
+
+    def __init__(self):
+        self.engines = []
+
+    def get_engine(self):
+        engine = FakeEngine()
+        self.engines.append(engine)
+        return engine
+
+
+def build_app(middleware, **options):
+
+    if middleware is DBMiddleware:
+        options.setdefault("db", FakeDB())
+
+    app = FastAPI()
+    app.add_middleware(middleware, **options)
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return Response.set(data=await request.json())
+
+    @app.get("/stream")
+    async def stream():
+
+        async def chunks():
+            for i in range(3):
+                yield F"{i};".encode()
+
+        return StreamingResponse(chunks(), media_type="text/plain")
+
+    @app.get("/traced")
+    def traced():
+
+        with Tracer.start_span("db query"):
+            pass
+
+        return Response.set(data=[1, 2, 3])
+
+    @app.get("/fail")
+    async def fail():
+        raise ValueError("boom")
+
+    return app
+
+
+class TestMiddleware:
+
+    @pytest.mark.parametrize("middleware", [BasicMiddleware, LoggingMiddleware, DBMiddleware])
+    def test__body_is_passed_to_handler(self, middleware):
+
+        client = TestClient(build_app(middleware))
+        response = client.post("/echo", json={"key": "value"})
+
+        assert response.status_code == 200
+        assert response.json()["data"] == {"key": "value"}
+
+    @pytest.mark.parametrize("middleware", [BasicMiddleware, LoggingMiddleware, DBMiddleware])
+    def test__streaming_response(self, middleware):
+
+        client = TestClient(build_app(middleware))
+        response = client.get("/stream")
+
+        assert response.status_code == 200
+        assert response.text == "0;1;2;"
+
+    @pytest.mark.parametrize("middleware", [BasicMiddleware, LoggingMiddleware, DBMiddleware])
+    def test__internal_error(self, middleware):
+
+        client = TestClient(build_app(middleware), raise_server_exceptions=False)
+        response = client.get("/fail")
+
+        assert response.status_code == 500
+        assert response.json()["info"]["status"] == "error"
+        assert response.json()["info"]["errors"][0]["msg"] == "boom (ValueError)"
+
+    def test__db_engine_is_shared(self):
+
+        db = FakeDB()
+        client = TestClient(build_app(DBMiddleware, db=db), raise_server_exceptions=False)
+
+        with client:
+            assert client.post("/echo", json=[1, 2]).status_code == 200
+            assert client.get("/fail").status_code == 500
+            assert len(db.engines) == 1
+            assert db.engines[0].disposed is False
+
+        assert db.engines[0].disposed is True
+
+    def test__db_connections_are_reused(self, tmp_path):
+
+        sqlalchemy = pytest.importorskip("sqlalchemy")
+        connects = []
+
+        class SQLiteDB:
+
+            def get_engine(self):
+
+                engine = sqlalchemy.create_engine(
+                    F"sqlite:///{tmp_path / 'test.db'}",
+                    poolclass=sqlalchemy.pool.QueuePool,
+                    pool_size=2
+                )
+                sqlalchemy.event.listen(engine, "connect", lambda *args: connects.append(args))
+
+                return engine
+
+        app = build_app(DBMiddleware, db=SQLiteDB())
+
+        @app.get("/query")
+        def query(request: Request):
+            connection = DBMiddleware.get_connection(request)
+            value = connection.execute(sqlalchemy.text("SELECT 1")).scalar()
+            return Response.set(data={"value": value, "pool": DBMiddleware.get_pool_stats(request)})
+
+        with TestClient(app) as client:
+            for _ in range(10):
+                data = client.get("/query").json()["data"]
+                assert data["value"] == 1
+
+        assert len(connects) == 1
+        assert data["pool"]["connections"] == 10
+        assert data["pool"]["checked_out"] == 1
+
+    @pytest.mark.parametrize("middleware", [LoggingMiddleware, DBMiddleware])
+    def test__lazy_body_capture(self, middleware):
+
+        app = build_app(middleware, lazy_body=True, max_body_size=8)
+        captured = {}
+
+        @app.post("/capture")
+        async def capture(request: Request):
+            data = await request.json()
+            captured.update(HTTPContext.get_http_request_context())
+            return Response.set(data=data)
+
+        client = TestClient(app)
+        response = client.post("/capture", json={"key": "value"})
+
+        assert response.json()["data"] == {"key": "value"}
+        assert captured["body"] == '{"key":"'
+
+
+    @pytest.mark.parametrize("middleware", [LoggingMiddleware, DBMiddleware])
+    def test__projection(self, middleware):
+
+        app = build_app(middleware, projection=ContextProjection(headers=("x-request-id",), body=False))
+        captured = {}
+
+        @app.post("/capture")
+        async def capture(request: Request):
+            captured.update(HTTPContext.get_http_request_context())
+            return Response.set(data=await request.json())
+
+        client = TestClient(app)
+        response = client.post("/capture", json={"key": "value"}, headers={"X-Request-ID": "abc"})
+
+        assert response.json()["data"] == {"key": "value"}
+        assert captured["headers"] == {"x-request-id": "abc"}
+        assert captured["body"] is None
+
+
+class TestServerTiming:
+
+    @pytest.fixture(autouse=True)
+    def tracer(self):
+
+        Tracer.setup(exporter=InMemorySpanExporter())
+
+        yield Tracer
+
+        Tracer.shutdown()
+
+    @pytest.fixture
+    def records(self):
+
+        records = []
+
+        class ListHandler(logging.Handler):
+
+            def emit(self, record):
+                records.append(record)
+
+        handler = ListHandler()
+        Logger.addHandler(handler)
+
+        yield records
+
+        Logger.removeHandler(handler)
+
+    @staticmethod
+    def parse_header(value):
+        return dict(re.findall(r"([\w.]+);dur=([\d.]+)", value))
+
+    @pytest.mark.parametrize("middleware", [LoggingMiddleware, DBMiddleware])
+    def test__server_timing_header(self, records, middleware):
+
+        client = TestClient(build_app(middleware, server_timing=True))
+        response = client.get("/traced")
+
+        metrics = self.parse_header(response.headers["server-timing"])
+
+        assert response.status_code == 200
+        assert list(metrics) == ["context", "body", "handler", "serialization", "span.db_query", "total"]
+        assert float(metrics["handler"]) >= float(metrics["serialization"]) > 0.0
+        assert float(metrics["total"]) >= float(metrics["handler"])
+
+        access_log = records[-1]
+
+        assert access_log.getMessage() == "GET /traced 200"
+        assert access_log.status == 200
+        assert access_log.timing["spans"][0]["name"] == "db query"
+        assert set(access_log.timing) == {"context", "body", "handler", "serialization", "spans", "total"}
+
+    @pytest.mark.parametrize("middleware", [LoggingMiddleware, DBMiddleware])
+    def test__internal_error(self, records, middleware):
+
+        client = TestClient(build_app(middleware, server_timing=True))
+        response = client.get("/fail")
+
+        assert response.status_code == 500
+        assert "handler;dur=" in response.headers["server-timing"]
+        assert records[-1].getMessage() == "GET /fail 500"
+
+    @pytest.mark.parametrize("middleware", [LoggingMiddleware, DBMiddleware])
+    def test__disabled_by_default(self, records, middleware):
+
+        client = TestClient(build_app(middleware))
+        response = client.post("/echo", json={"key": "value"})
+
+        assert "server-timing" not in response.headers
+        assert response.json()["data"] == {"key": "value"}
+
+
+class TestObservabilityProfiles:
+
+    @pytest.fixture
+    def captured(self):
+        return {}
+
+    @pytest.fixture(params=[LoggingMiddleware, DBMiddleware])
+    def app(self, request, captured):
+
+        app = FastAPI()
+        app.add_middleware(
+            request.param,
+            server_timing=True,
+            **({"db": FakeDB()} if request.param is DBMiddleware else {})
+        )
+
+        def capture():
+            captured["context"] = HTTP_REQUEST_CONTEXT.get()
+            captured["trace"] = HTTPContext.get_trace_context()
+
+        @app.get("/health")
+        @observability("off")
+        async def health():
+            capture()
+            return Response.set(data={"status": "ok"})
+
+        @app.get("/health/fail")
+        @observability("off")
+        async def health_fail():
+            raise ValueError("boom")
+
+        @app.post("/users/me")
+        async def update_me(request: Request):
+            capture()
+            return Response.set(data=await request.json())
+
+        @app.post("/users/{user_id}")
+        @observability("headers-only")
+        async def update_user(user_id: int, request: Request):
+            capture()
+            return Response.set(data=await request.json())
+
+        @app.post("/sampled")
+        @observability("full", sample_rate=0.5)
+        async def sampled(request: Request):
+            capture()
+            return Response.set(data=await request.json())
+
+        return app
+
+    def test__off(self, app, captured):
+
+        token = HTTP_REQUEST_CONTEXT.set({})
+
+        try:
+            client = TestClient(app, raise_server_exceptions=False)
+            response = client.get("/health")
+            failed = client.get("/health/fail")
+        finally:
+            HTTP_REQUEST_CONTEXT.reset(token)
+
+        assert response.status_code == 200
+        assert "server-timing" not in response.headers
+        assert captured["context"] == {}
+        assert failed.status_code == 500
+
+    def test__headers_only(self, app, captured):
+
+        client = TestClient(app)
+        response = client.post("/users/1", json={"key": "value"})
+
+        context = captured["context"].resolve()
+
+        assert response.json()["data"] == {"key": "value"}
+        assert context["requestUrl"].path == "/users/1"
+        assert context["body"] is None
+        assert "server-timing" in response.headers
+
+    def test__static_route_is_not_matched_by_template(self, app, captured):
+
+        client = TestClient(app)
+        client.post("/users/me", json={"key": "value"})
+
+        assert captured["context"].resolve()["body"] == {"key": "value"}
+
+    def test__first_matching_route_wins(self, captured):
+
+        app = FastAPI()
+        app.add_middleware(LoggingMiddleware)
+
+        @app.get("/items/{item_id:int}")
+        async def by_id(item_id: int):
+            captured["context"] = HTTP_REQUEST_CONTEXT.get()
+            return Response.set(data={"id": item_id})
+
+        @app.get("/items/{name}")
+        @observability("off")
+        async def by_name(name: str):
+            captured["context"] = HTTP_REQUEST_CONTEXT.get()
+            return Response.set(data={"name": name})
+
+        @app.get("/items/latest")
+        async def latest():
+            captured["context"] = HTTP_REQUEST_CONTEXT.get()
+            return Response.set(data={"latest": True})
+
+        client = TestClient(app)
+        token = HTTP_REQUEST_CONTEXT.set({})
+
+        try:
+
+            assert client.get("/items/5").json()["data"] == {"id": 5}
+            assert captured["context"].resolve()["requestUrl"].path == "/items/5"
+
+            # served by the template declared before the static route
+            assert client.get("/items/latest").json()["data"] == {"name": "latest"}
+            assert captured["context"] == {}
+
+        finally:
+            HTTP_REQUEST_CONTEXT.reset(token)
+
+    def test__sample_rate(self, app, captured):
+
+        client = TestClient(app)
+        bodies = 0
+
+        for i in range(200):
+            client.post("/sampled", json={"key": "value"})
+            bodies += bool(captured["context"]) and captured["context"].resolve()["body"] is not None
+
+        assert 50 < bodies < 150
+
+        # the decision is made by the trace ID
+        header = {"X-Cloud-Trace-Context": "105445aa7843bc8bf206b12000100000/1;o=1"}
+        decisions = set()
+
+        for i in range(5):
+            client.post("/sampled", json={"key": "value"}, headers=header)
+            decisions.add(bool(captured["context"]))
+
+        assert len(decisions) == 1
+        assert captured["trace"].trace_id == "105445aa7843bc8bf206b12000100000"
+
+    def test__unknown_profile(self):
+
+        with pytest.raises(ValueError):
+            observability("verbose")
@@ -0,0 +1,100 @@
+import time
+import threading
+import pytest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from surquest.fastapi.utils.GCP.project import ProjectID
+from surquest.fastapi.utils.GCP.formatter import JSONFormatter
+
+
+class MetadataServer(HTTPServer):
+    """Local stand-in for the metadata server"""
+
+    def __init__(self, project_id="metadata-project", delay=0.0):
+
+        self.project_id = project_id
+        self.delay = delay
+        self.requests = []
+
+        super().__init__(("127.0.0.1", 0), MetadataHandler)
+
+    @property
+    def host(self):
+        return F"127.0.0.1:{self.server_port}"
+
+
+class MetadataHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+
+        self.server.requests.append((self.path, self.headers.get("Metadata-Flavor")))
+        time.sleep(self.server.delay)
+
+        body = self.server.project_id.encode()
+        self.send_response(200)
+        self.send_header("Metadata-Flavor", "Google")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def metadata_server(request, monkeypatch):
+
+    server = MetadataServer(**getattr(request, "param", {}))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    for name in ProjectID.ENV_VARS + ("GCP_OFFLINE",):
+        monkeypatch.delenv(name, raising=False)
+
+    monkeypatch.setenv("GCE_METADATA_HOST", server.host)
+    ProjectID.reset()
+
+    yield server
+
+    ProjectID.reset()
+    server.shutdown()
+    server.server_close()
+
+
+class TestProjectID:
+
+    def test__explicit(self, metadata_server, monkeypatch):
+
+        monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "env-project")
+
+        assert ProjectID.resolve("explicit-project") == "explicit-project"
+        assert metadata_server.requests == []
+
+    def test__env(self, metadata_server, monkeypatch):
+
+        monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "env-project")
+
+        assert ProjectID.resolve() == "env-project"
+        assert metadata_server.requests == []
+
+    def test__metadata_server_is_queried_once(self, metadata_server):
+
+        assert ProjectID.resolve() == "metadata-project"
+        assert ProjectID.resolve() == "metadata-project"
+        assert JSONFormatter().project_id == "metadata-project"
+        assert metadata_server.requests == [(ProjectID.METADATA_PATH, "Google")]
+
+    @pytest.mark.parametrize("metadata_server", [{"delay": 2.0}], indirect=True)
+    def test__metadata_server_timeout(self, metadata_server):
+
+        start = time.perf_counter()
+
+        assert ProjectID.resolve() == ProjectID.UNKNOWN
+        assert time.perf_counter() - start < 1.5
+
+    def test__offline(self, metadata_server, monkeypatch):
+
+        monkeypatch.setenv("GCP_OFFLINE", "true")
+
+        assert JSONFormatter().project_id == ProjectID.UNKNOWN
+        assert metadata_server.requests == []
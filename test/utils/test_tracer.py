@@ -0,0 +1,336 @@
+import asyncio
+import threading
+import pytest
+from opentelemetry import trace
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+
+from starlette.requests import Request
+
+from surquest.fastapi.utils.GCP.tracer import Tracer
+from surquest.fastapi.utils.GCP.http_context import (
+    TRACE_CONTEXT,
+    HTTP_REQUEST_CONTEXT,
+    RequestContext,
+    TraceContext
+)
+
+
+@pytest.fixture
+def exporter():
+
+    Tracer.shutdown()  # drop configuration of other tests
+    exporter = InMemorySpanExporter()
+
+    yield exporter
+
+    Tracer.shutdown()
+
+
+def run_requests(count, header=None, path="/"):
+    """Start span within `count` requests with random trace IDs"""
+
+    recording = 0
+
+    for i in range(count):
+
+        trace_token = TRACE_CONTEXT.set(TraceContext.from_header(header))
+        request_token = HTTP_REQUEST_CONTEXT.set({"requestUrl": type("URL", (), {"path": path})()})
+
+        try:
+            with Tracer.start_span("request") as span:
+                recording += span.is_recording()
+        finally:
+            HTTP_REQUEST_CONTEXT.reset(request_token)
+            TRACE_CONTEXT.reset(trace_token)
+
+    Tracer.provider.force_flush()
+
+    return recording
+
+
+class TestTracerSampling:
+
+    def test__ratio(self, exporter):
+
+        Tracer.setup(ratio=0.25, exporter=exporter)
+
+        recording = run_requests(2000)
+
+        assert 350 < recording < 650
+        assert len(exporter.get_finished_spans()) == recording
+        assert Tracer.get_stats()["exported"] == recording
+
+    def test__caller_decision_is_honored(self, exporter):
+
+        Tracer.setup(ratio=0.0, exporter=exporter)
+
+        assert run_requests(10, header="105445aa7843bc8bf206b12000100000/1;o=1") == 10
+        assert run_requests(10, header="105445aa7843bc8bf206b12000100000/1;o=0") == 0
+
+    def test__caller_decision_is_ignored(self, exporter):
+
+        Tracer.setup(ratio=1.0, parent_based=False, exporter=exporter)
+
+        assert run_requests(10, header="105445aa7843bc8bf206b12000100000/1;o=0") == 10
+
+    def test__route_overrides(self, exporter):
+
+        Tracer.setup(ratio=1.0, routes={"/health": 0.0}, exporter=exporter)
+
+        assert run_requests(10, path="/health") == 0
+        assert run_requests(10, path="/users") == 10
+
+    def test__templated_route_overrides(self, exporter):
+
+        Tracer.setup(ratio=1.0, routes={"/users/{user_id}": 0.0}, exporter=exporter)
+
+        def sampled(path, route=None):
+
+            request = Request({"type": "http", "method": "GET", "path": path, "query_string": b"", "headers": []})
+
+            if route is not None:
+                request.scope["route"] = type("Route", (), {"path": route})()  # set by the router
+
+            token = HTTP_REQUEST_CONTEXT.set(RequestContext(request))
+
+            try:
+                return Tracer.sampler.is_sampled(1, TraceContext.from_header(None))
+            finally:
+                HTTP_REQUEST_CONTEXT.reset(token)
+
+        assert sampled("/users/1", route="/users/{user_id}") is False
+        assert sampled("/users/{user_id}") is False  # path before the routing
+        assert sampled("/orders/1", route="/orders/{order_id}") is True
+
+    def test__child_spans_follow_parent(self, exporter):
+
+        Tracer.setup(ratio=0.5, exporter=exporter)
+
+        for i in range(50):
+
+            token = TRACE_CONTEXT.set(TraceContext.from_header(None))
+
+            with Tracer.start_span("parent") as parent:
+                with Tracer.start_span("child") as child:
+                    assert child.is_recording() == parent.is_recording()
+
+            TRACE_CONTEXT.reset(token)
+
+    def test__unsampled_span_is_not_exported(self, exporter):
+
+        Tracer.setup(ratio=0.0, exporter=exporter)
+
+        run_requests(100)
+
+        assert exporter.get_finished_spans() == ()
+        assert Tracer.get_stats()["queued"] == 0
+        assert Tracer.get_stats()["exports"] == 0
+
+    def test__invalid_ratio(self, exporter):
+
+        with pytest.raises(ValueError):
+            Tracer.setup(ratio=1.5, exporter=exporter)
+
+
+class BlockingExporter(InMemorySpanExporter):
+
+    def __init__(self):
+        super().__init__()
+        self.released = threading.Event()
+
+    def export(self, spans):
+        self.released.wait()
+        return super().export(spans)
+
+
+class FailingExporter(SpanExporter):
+
+    def export(self, spans):
+        return SpanExportResult.FAILURE
+
+
+class TestTracerStats:
+
+    def test__dropped_spans(self):
+
+        exporter = BlockingExporter()
+        Tracer.setup(exporter=exporter, max_queue_size=10, max_export_batch_size=5)
+
+        try:
+
+            for i in range(40):
+                with Tracer.start_span("request"):
+                    pass
+
+            exporter.released.set()
+            Tracer.provider.force_flush()
+            stats = Tracer.get_stats()
+
+        finally:
+            exporter.released.set()
+            Tracer.shutdown()
+
+        assert stats["queued"] == 40
+        assert stats["dropped"] >= 20
+        assert abs(stats["dropped"] + stats["exported"] - 40) <= 1  # the queue is checked without lock
+        assert stats["export_latency_max"] >= stats["export_latency_last"] > 0.0
+
+    def test__dropped_spans_are_counted_without_sdk_internals(self, monkeypatch):
+
+        from surquest.fastapi.utils.GCP.tracing import MonitoredExporter, MonitoredSpanProcessor
+
+        monkeypatch.setenv("OTEL_BSP_MAX_QUEUE_SIZE", "10")
+        exporter = BlockingExporter()
+        processor = MonitoredSpanProcessor(exporter, max_export_batch_size=5)
+
+        assert isinstance(processor.exporter, MonitoredExporter)
+        assert processor.max_queue_size == 10
+
+        # the spans do not reach the queue of the SDK
+        monkeypatch.setattr(BatchSpanProcessor, "on_end", lambda self, span: None)
+
+        tracer = TracerProvider().get_tracer(__name__)
+
+        for i in range(15):
+            with tracer.start_span("request") as span:
+                pass
+            processor.on_end(span)
+
+        exporter.released.set()
+        processor.shutdown()
+
+        assert processor.get_stats() == {"queued": 15, "dropped": 5}
+
+    def test__failed_export(self):
+
+        Tracer.setup(exporter=FailingExporter())
+
+        try:
+            run_requests(3)
+            stats = Tracer.get_stats()
+        finally:
+            Tracer.shutdown()
+
+        assert stats["failed"] == 3
+        assert stats["exported"] == 0
+
+
+class TestTracerSpanDecorator:
+
+    @staticmethod
+    def within_request(func, header):
+
+        token = TRACE_CONTEXT.set(TraceContext.from_header(header))
+
+        try:
+            return func()
+        finally:
+            TRACE_CONTEXT.reset(token)
+
+    def test__sync_and_async_functions(self, exporter):
+
+        Tracer.setup(exporter=exporter)
+
+        @Tracer.span("inner", attributes={"db.system": "postgresql"})
+        async def inner(value):
+            return value * 2
+
+        @Tracer.span()
+        def outer(value):
+            return asyncio.run(inner(value))
+
+        assert self.within_request(lambda: outer(21), "105445aa7843bc8bf206b12000100000/1;o=1") == 42
+        Tracer.provider.force_flush()
+
+        spans = {span.name: span for span in exporter.get_finished_spans()}
+
+        assert outer.__name__ == "outer"
+        assert set(spans) == {"inner", "TestTracerSpanDecorator.test__sync_and_async_functions.<locals>.outer"}
+        assert spans["inner"].attributes == {"db.system": "postgresql"}
+        assert spans["inner"].parent.span_id == spans[outer.__qualname__].context.span_id
+        assert F"{spans['inner'].context.trace_id:032x}" == "105445aa7843bc8bf206b12000100000"
+
+    def test__unsampled_calls_are_not_wrapped(self, exporter):
+
+        Tracer.setup(exporter=exporter)
+        spans = []
+
+        @Tracer.span("unsampled")
+        def func():
+            spans.append(trace.get_current_span())
+            return "result"
+
+        assert self.within_request(func, "105445aa7843bc8bf206b12000100000/1;o=0") == "result"
+        Tracer.provider.force_flush()
+
+        assert not spans[0].get_span_context().is_valid
+        assert exporter.get_finished_spans() == ()
+
+    def test__disabled_tracing(self, exporter):
+
+        Tracer.setup(enabled=False, exporter=exporter)
+
+        try:
+
+            @Tracer.span("disabled")
+            def func():
+                return "result"
+
+            assert self.within_request(func, "105445aa7843bc8bf206b12000100000/1;o=1") == "result"
+
+            with Tracer.start_span("disabled") as span:
+                assert not span.is_recording()
+
+        finally:
+            Tracer.enabled = True
+
+        Tracer.provider.force_flush()
+        assert exporter.get_finished_spans() == ()
+
+    def test__parent_is_built_once_per_request(self, exporter):
+
+        Tracer.setup(exporter=exporter)
+
+        def request():
+
+            parents = set()
+
+            for i in range(3):
+                with Tracer.start_span("sibling") as span:
+                    parents.add(span.parent.span_id)
+
+            return parents
+
+        first = self.within_request(request, "105445aa7843bc8bf206b12000100000/1234;o=1")
+        second = self.within_request(request, "105445aa7843bc8bf206b12000100000/5678;o=1")
+
+        # the parent is the span of the caller
+        assert first == {1234}
+        assert second == {5678}
+
+    def test__interleaved_requests(self, exporter):
+
+        Tracer.setup(exporter=exporter)
+
+        first = TraceContext.from_header("105445aa7843bc8bf206b12000100000/1234;o=1")
+        second = TraceContext.from_header("205445aa7843bc8bf206b12000100000/5678;o=1")
+        parents = []
+
+        for trace_context in (first, second, first):
+
+            token = TRACE_CONTEXT.set(trace_context)
+
+            try:
+                with Tracer.start_span("request") as span:
+                    parents.append((span.context.trace_id, span.parent.span_id))
+            finally:
+                TRACE_CONTEXT.reset(token)
+
+        assert parents == [
+            (int(first.trace_id, 16), 1234),
+            (int(second.trace_id, 16), 5678),
+            (int(first.trace_id, 16), 1234),
+        ]
+        assert first.span_id == F"{1234:016x}"  # logged by the formatter